@@ -24,6 +24,7 @@ try:
     from pylab import argsort, rand
     import datetime
     import filecmp
+    import zipfile
 except Exception as E:
     with open('/tmp/optima_backup_error.log','w') as f:
         errormsg = 'Essential import for Optima backup failed: %s' % E.__repr__()
@@ -42,6 +43,112 @@ def safemkdir(*args):
     return fullpath
     
 
+def login(username=None, password=None, server=None):
+    ''' Start an HTTP session logged into the server '''
+    print('Starting HTTP sesion...')
+    session = requests.Session()
+
+    print('Logging in as %s...' % (username,))
+    hashed_password = sha224()
+    hashed_password.update(password)
+    password = hashed_password.hexdigest()
+
+    print('Logging into server...')
+    response = session.post(server + '/api/user/login', json={'username': username, 'password': password})
+    if not response.status_code == 200:
+        print('Failed login:\n%s' % response.content)
+        sys.exit(1)
+    print('Logged in as %s on %s' % (response.json()['username'], server))
+    return session
+
+
+def downloadusers(session=None, server=None, savelocation=None):
+    ''' Save the user list to users.json, and return it '''
+    print('Downloading user list...')
+    safemkdir(savelocation)
+    users = session.get(server + '/api/user').json()['users']['users']
+    with open(os.path.join(savelocation, 'users.json'), 'w') as f:
+        json.dump(users, f, indent=2)
+    return users
+
+
+def downloadexport(session=None, server=None, savelocation=None, since=None, project_ids=None):
+    ''' Download a zip of projects (see dataio.download_zip_of_projects) and extract them; returns the list of projects '''
+    zipname = os.path.join(savelocation, 'projects.zip')
+    payload = {'name': 'download_zip_of_projects', 'kwargs': {'since': since, 'project_ids': project_ids}}
+    response = session.post(server + '/api/download/stream', data=json.dumps(payload), stream=True)
+    with open(zipname, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=2**20):
+            f.write(chunk)
+    with zipfile.ZipFile(zipname) as zf:
+        export = json.loads(zf.read('projects.json').decode('utf-8'))
+        for name in zf.namelist():
+            if name != 'projects.json':
+                zf.extract(name, savelocation)
+    os.remove(zipname)
+    return export
+
+
+def downloadzip(username=None, password=None, savelocation=None, server=None, lastlocation=None):
+    '''
+    Like downloadprojects(), but download all projects (without results) at once, as a zip streamed
+    from the server. If lastlocation is the folder of a previous backup made this way, only the projects
+    modified since then are downloaded, and the others are symlinked to their copies there.
+
+    Version: 2026oct18
+    '''
+    
+    # Define defaults
+    if username is None:     username     = 'admin'
+    if password is None:     password     = 'zzz'
+    if savelocation is None: savelocation = 'optimaprojects'
+    if server is None:       server       = 'http://localhost:8080'
+    
+    session = login(username=username, password=password, server=server)
+    downloadusers(session=session, server=server, savelocation=savelocation)
+    
+    # Find when the last backup was made, and where its projects are
+    since = None
+    lastpaths = {}
+    if lastlocation is not None:
+        try:
+            with open(os.path.join(lastlocation, 'projects.json')) as f:
+                lastexport = json.load(f)
+            since = lastexport['time']
+            lastpaths = dict([(entry['id'], entry['path']) for entry in lastexport['projects']])
+        except Exception as E:
+            print('Could not read the previous list of projects, so downloading them all: %s' % E.__repr__())
+    
+    print('Downloading projects%s...' % (' modified since the last backup' if since is not None else ''))
+    export = downloadexport(session=session, server=server, savelocation=savelocation, since=since)
+    
+    print('Linking unchanged projects...')
+    missing = []
+    for entry in export['projects']:
+        fname = os.path.join(savelocation, entry['path'])
+        if os.path.exists(fname): continue
+        lastfname = os.path.join(lastlocation, lastpaths[entry['id']]) if entry['id'] in lastpaths else None
+        if not entry['included'] and lastfname and os.path.exists(lastfname):
+            safemkdir(os.path.dirname(fname))
+            os.symlink(os.path.realpath(lastfname), fname)
+        else:
+            missing.append(entry['id'])
+    if missing:
+        print('Downloading %i projects missing from the last backup...' % len(missing))
+        downloadexport(session=session, server=server, savelocation=savelocation, project_ids=missing)
+    
+    with open(os.path.join(savelocation, 'projects.json'), 'w') as f: # Only once everything is downloaded
+        json.dump(export, f, indent=2)
+    
+    failed = [entry['path'] for entry in export['projects'] if not os.path.exists(os.path.join(savelocation, entry['path']))]
+    if len(failed):
+        print('The following projects FAILED MISERABLY:')
+        for fail in failed: print(fail)
+    else:
+        print('All %i projects successfully backed up.' % len(export['projects']))
+    return None
+
+
 def downloadprojects(username=None, password=None, savelocation=None, server=None, overwrite=None, withresults=None):
     '''
     A utility for downloading all projects from an Optima 2.0+ server for an admin account.
@@ -65,26 +172,8 @@ def downloadprojects(username=None, password=None, savelocation=None, server=Non
     try:    T = op.tic()
     except: pass
     
-    print('Starting HTTP sesion...')
-    session = requests.Session()
-
-    print('Logging in as %s...' % (username,))
-    hashed_password = sha224()
-    hashed_password.update(password)
-    password = hashed_password.hexdigest()
-
-    print('Logging into server...')
-    response = session.post(server + '/api/user/login', json={'username': username, 'password': password})
-    if not response.status_code == 200:
-        print('Failed login:\n%s' % response.content)
-        sys.exit(1)
-    print('Logged in as %s on %s' % (response.json()['username'], server))
-
-    print('Downloading user list...')
-    safemkdir(savelocation)
-    users = session.get(server + '/api/user').json()['users']['users']
-    f = open(os.path.join(savelocation, 'users.json'), 'w')
-    json.dump(users, f, indent=2)
+    session = login(username=username, password=password, server=server)
+    users = downloadusers(session=session, server=server, savelocation=savelocation)
     username_by_id = {}
     for user in users:
         username_by_id[user['id']] = user['username']
@@ -190,7 +279,7 @@ def backup():
     
         python backup.py admin zzz "http://localhost:8080"
     
-    Version: 2017may23
+    Version: 2026oct18
     '''
     
     print('Starting backup...')
@@ -237,7 +326,10 @@ def backup():
         try:    withresults = sys.argv[5]
         except: withresults = None
         print('Downloading projects into the current folder: username=%s, server=%s' % (username, server))
-        downloadprojects(username=username, password=password, savelocation=currabs, server=server, overwrite=overwrite, withresults=withresults)
+        if withresults: # Results aren't included in the zip
+            downloadprojects(username=username, password=password, savelocation=currabs, server=server, overwrite=overwrite, withresults=withresults)
+        else:
+            downloadzip(username=username, password=password, savelocation=currabs, server=server, lastlocation=lastabs)
         
         # Create symlinks
         subfolders = os.listdir(currabs)
@@ -75,7 +75,7 @@ from .colortools import alpinecolormap, bicolormap, gridcolors, vectocolor, shif
 from . import colortools as _colortools; del colortools
 
 # Optimization algorithm
-from .asd import asd
+from .asd import asd, objdict
 
 # Interpolation
 from .pchip import pchip, plotpchip
@@ -124,8 +124,8 @@ class OptimaException(Exception):
 #####################################################################################################################
 
 # File I/O
-try:    from sciris  import loadobj, saveobj, loadstr, dumpstr # If Sciris is installed, use more up to date functions
-except: from .fileio import loadobj, saveobj, loadstr, dumpstr # Fall back in built-in methods
+from .fileio import loadobj, saveobj, loadstr, dumpstr, Codec, registercodec # Not Sciris's versions, since these can load data saved with any codec
+from .fileio import saveresults, loadresults
 from .fileio import optimafolder, loadpartable, loadtranstable, loaddatapars # CK: may want to tidy up
 from . import fileio as _fileio; del fileio
 
@@ -134,12 +134,12 @@ from .settings import Settings, convertlimits, gettvecdt
 from . import settings as _settings; del settings
 
 # Generate results -- import first because parameters use results
-from .results import Result, Resultset, Multiresultset, BOC, ICER, getresults
+from .results import Result, Resultset, Multiresultset, BOC, ICER, getresults, calcoutcomes, bocreruns, closestBOCallocation
 from . import results as _results; del results
 
 # Define the model parameters -- import before makespreadsheet because makespreadsheet uses partable to make a pre-filled spreadsheet
-from .parameters import Par, Dist, Constant, Metapar, Timepar, Popsizepar, Yearpar, Parameterset # Parameter and Parameterset classes
-from .parameters import makepars, makesimpars, applylimits, comparepars, comparesimpars, sanitycheck
+from .parameters import Par, Dist, Constant, Metapar, Timepar, Popsizepar, Yearpar, Parameterset, Parsoverlay # Parameter and Parameterset classes
+from .parameters import makepars, makesimpars, applylimits, comparepars, comparesimpars, sanitycheck, parkey
 from . import parameters as _parameters; del parameters
 
 # Create a blank spreadsheet
@@ -150,10 +150,10 @@ except Exception as E: _failed.append('makespreadsheet: %s' % repr(E))
 from .loadspreadsheet import loadspreadsheet, loadprogramspreadsheet
 
 # Define and run the model
-from .model import model
+from .model import model, model_batch, makeforceinf, calcforceinf, maketransitions
 
 # Define the programs and cost functions
-from .programs import Program, Programset
+from .programs import Program, Programset, Compiledprogset
 from . import programs as _programs; del programs
 
 # Automatic calibration and sensitivity
@@ -165,7 +165,7 @@ from .scenarios import Parscen, Budgetscen, Coveragescen, Progscen, runscenarios
 from . import scenarios as _scenarios; del scenarios
 
 # Optimization and ICER analyses
-from .optimization import Optim, defaultobjectives, defaultconstraints, defaulttvsettings, optimize, multioptimize, tvoptimize, outcomecalc, icers, tvfunction
+from .optimization import Optim, Outcomecache, defaultobjectives, defaultconstraints, defaulttvsettings, optimize, multioptimize, tvoptimize, outcomecalc, icers, tvfunction
 from . import optimization as _optimization; del optimization
 
 # Plotting functions
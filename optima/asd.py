@@ -8,7 +8,7 @@ __all__ = ['asd']
 def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
     pinitial=None, sinitial=None, xmin=None, xmax=None, maxiters=None, maxtime=None, 
     abstol=1e-6, reltol=1e-3, stalliters=None, stoppingfunc=None, randseed=None, 
-    label=None, verbose=2, **kwargs):
+    label=None, verbose=2, progressfunc=None, **kwargs):
     """
     Optimization using adaptive stochastic descent (ASD).
     
@@ -37,6 +37,7 @@ def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
       randseed       None    The random seed to use
       verbose        2       How much information to print during the run
       label          None    A label to use to annotate the output
+      progressfunc   None    Function called after each iteration with a progress event (see below)
      
     asd() returns an objdict (which can be accessed by index, key, or attribute)
     with the following items:
@@ -47,6 +48,11 @@ def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
                       function at each iteration; xvals, the parameter values at each iteration;
                       probabilities, the probability of each step; and stepsizes, the size of each
                       step for each parameter.
+    
+    If progressfunc is supplied, it is called after each iteration with an objdict with
+    the label, iteration, maxiters, fval (the best so far), fvalorig, x (the best so far),
+    elapsed (in seconds), and eta (an estimate of the seconds left, from whichever of
+    maxiters and maxtime will be reached first).
   
     Example:
         import numpy as np
@@ -59,7 +65,7 @@ def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
         Optimization by adaptive stochastic descent. 
         PloS ONE 13 (3), e0192944.
     
-    Version: 2019jul08
+    Version: 2026oct18
     """
     if randseed is not None:
         nr.seed(int(randseed)) # Don't reset it if not supplied
@@ -196,6 +202,10 @@ def asd(function, x, args=None, stepsize=0.1, sinc=2, sdec=2, pinc=2, pdec=2,
         # Store output information
         fvals[count] = fval # Store objective function evaluations
         allsteps[count, :] = x # Store parameters
+        if progressfunc:
+            elapsed = time() - start
+            eta = max(0, min(maxtime-elapsed, elapsed/count*(maxiters-count))) # Whichever limit will be reached first
+            progressfunc(objdict([('label',label), ('iteration',count), ('maxiters',maxiters), ('fval',fval), ('fvalorig',fvalorig), ('x',np.reshape(x.copy(), origshape)), ('elapsed',elapsed), ('eta',eta)]))
 
         # Stopping criteria
         if count >= maxiters: # Stop if the iteration limit is exceeded
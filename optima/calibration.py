@@ -4,23 +4,45 @@ CALIBRATION
 Function(s) to perform calibration.
 """
 
-from optima import OptimaException, Link, Par, dcp, asd, printv, findinds, isnumber, odict
-from numpy import zeros, array, mean
+from optima import OptimaException, CancelException, Link, Par, dcp, asd, printv, findinds, isnumber, odict, objdict, calcoutcomes, makesimpars, sigfig
+from numpy import zeros, array, mean, concatenate, exp, clip, argmin, floor, nan, diag, dot, maximum, where, isfinite, sign, sqrt
+from numpy.linalg import solve, LinAlgError
+from numpy.random import randn, seed
+from time import time
+
+# Import dependencies here so no biggie if they fail
+try:    from multiprocessing import Process, Queue, Event
+except: Process, Queue, Event = None, None, None # OK to skip these if nchains is not set
 
 import six
+from six.moves.queue import Empty
 if six.PY3:
     unicode = str
 
 
-def autofit(project=None, name=None, fitwhat=None, fitto=None, method='wape', maxtime=None, maxiters=1000, verbose=2, doplot=False, randseed=None, **kwargs):
+def autofit(project=None, name=None, fitwhat=None, fitto=None, method='wape', maxtime=None, maxiters=1000, verbose=2, doplot=False, randseed=None, parvec=None, 
+            nchains=None, nblocks=None, spread=0.5, optimizer='asd', **kwargs):
     ''' 
     Function to automatically fit parameters. Parameters:
         fitwhat = which parameters to vary to improve the fit; these are defined in parameters.py under the 'auto' attribute; default is 'force' (FOI metaparameters only)
         fitto = what kind of data to fit to; options are anything in results.main; default is 'prev' (prevalence) or everything
         method = which method of calculating the objective/goodness-of-fit to use; default weighted absolute percentage error to place less weight on outliers
+        parvec = values of the parameters being fitted to start from instead of the parset's, e.g. the x of the last progress event (see asd()) of an interrupted fit
+        nchains = number of ASD chains to run in parallel, each in its own process (see runfitchains()); default is a single chain
+        nblocks = number of blocks to split maxiters into for the chains, after each of which they all restart from the best fit so far
+        spread = how far the starting points of all but the first chain are from parvec, as the standard deviation of a lognormal multiplier
+        optimizer = 'asd' (default), or 'lm' to minimize the same mismatch by Levenberg-Marquardt (see lmfit() and fitresiduals())
     Others should be self-explanatory.
     
-    Version: 2017may22 
+    With nchains, the best parset is returned, with the objective function values of each chain in multiimprovement, e.g.
+        P.autofit(name='default', fitwhat=['force','init'], maxiters=200, nchains=4, nblocks=5, randseed=1)
+        pl.plot(P.parsets['default'].multiimprovement.transpose())
+    
+    The data being fitted to are compiled once by makefittargets(), so each step only runs the model up to the last
+    data point and calculates the mismatch in one go (see fastobjectivecalc()); this isn't possible with doplot=True,
+    or for results that calcoutcomes() can't calculate, in which case each step makes a Resultset (see objectivecalc()).
+    
+    Version: 2026oct18
     '''
     if doplot: # Store global information for debugging
         global autofitfig, autofitresults
@@ -34,6 +56,7 @@ def autofit(project=None, name=None, fitwhat=None, fitto=None, method='wape', ma
     if project is None: raise OptimaException('autofit() requires a project in order to run')
     if name is None: name = -1 # Calibrate last parameter set
     elif type(name) not in (str,unicode) and not(isnumber(name)): raise OptimaException('%s must be the name or index of a parameter set' % name)
+    if optimizer not in ['asd', 'lm']: raise OptimaException('Optimizer "%s" not recognized; must be "asd" or "lm"' % optimizer)
     
     # Initialization
     parset = project.parsets[name] # Shorten the original parameter set
@@ -50,20 +73,152 @@ def autofit(project=None, name=None, fitwhat=None, fitto=None, method='wape', ma
     parhigher = array(project.settings.convertlimits([item['limits'][1] for item in parlist])) # Replace text labels with numeric values
     
     # Perform fit
-    parvec = convert(pars, parlist)
-    args = {'pars':pars, 'parlist':parlist, 'project':project, 'fitto':fitto, 'method':method, 'doplot':doplot, 'verbose':verbose}
-    res = asd(objectivecalc, parvec, args=args, xmin=parlower, xmax=parhigher, maxtime=maxtime, maxiters=maxiters, randseed=randseed, verbose=verbose, **kwargs)
+    if parvec is None: 
+        parvec = convert(pars, parlist)
+    elif len(parvec)!=len(parlist):
+        errormsg = 'Cannot start fit from %i parameter values, since %i parameters are being fitted' % (len(parvec), len(parlist))
+        raise OptimaException(errormsg)
+    else:
+        parvec = array(parvec, dtype=float)
+    targets = None if doplot else makefittargets(project=project, pars=pars, fitto=fitto, method=method)
+    if targets is not None:
+        function = fastobjectivecalc
+        args = {'pars':pars, 'parlist':parlist, 'project':project, 'targets':targets, 'verbose':verbose}
+    else:
+        function = objectivecalc
+        args = {'pars':pars, 'parlist':parlist, 'project':project, 'fitto':fitto, 'method':method, 'doplot':doplot, 'verbose':verbose}
+    if optimizer=='lm':
+        if targets is None: raise OptimaException('Fitting with optimizer="lm" requires results that calcoutcomes() can calculate, and cannot be plotted')
+        if nchains and nchains>1: raise OptimaException('Fitting with optimizer="lm" cannot be run in multiple chains')
+        args = {'pars':pars, 'parlist':parlist, 'project':project, 'targets':targets}
+        res = lmfit(fitresiduals, parvec, args=args, xmin=parlower, xmax=parhigher, maxtime=maxtime, maxiters=maxiters, verbose=verbose, **kwargs)
+        bestparvec, fvals, multiimprovement = res.x, res.details.fvals, None
+    elif nchains and nchains>1:
+        if doplot: raise OptimaException('Cannot plot the fit while running multiple chains')
+        if maxiters is None: raise OptimaException('Running multiple chains requires maxiters to be set')
+        if nblocks is None: nblocks = 5
+        if randseed is None: randseed = int((time()-floor(time()))*1e4) # Make sure a seed is used, so the starting points can be reproduced
+        seed(randseed)
+        parvecs = [parvec] + [clip(parvec*exp(spread*randn(len(parvec))), parlower, parhigher) for chain in range(nchains-1)] # Multiple starts
+        stoppingfunc, progressfunc = kwargs.pop('stoppingfunc', None), kwargs.pop('progressfunc', None) # Called by the main process, rather than by each chain
+        asdkwargs = dict(kwargs, xmin=parlower, xmax=parhigher, verbose=verbose)
+        bestparvec, fvals, multiimprovement = runfitchains(parvecs, function=function, args=args, asdkwargs=asdkwargs, nblocks=nblocks, blockiters=max(1,maxiters//nblocks), 
+                                                           maxtime=maxtime, randseed=randseed, stoppingfunc=stoppingfunc, progressfunc=progressfunc, verbose=verbose)
+    else:
+        res = asd(function, parvec, args=args, xmin=parlower, xmax=parhigher, maxtime=maxtime, maxiters=maxiters, randseed=randseed, verbose=verbose, **kwargs)
+        bestparvec, fvals, multiimprovement = res.x, res.details.fvals, None
 
     # Save, along with some additional info
-    pars = convert(pars, parlist, res.x)
+    pars = convert(pars, parlist, bestparvec)
     parset.pars = pars
-    parset.improvement.append(res.details.fvals) # Store improvement history
-    parset.autofitsettings = odict([('fitwhat', fitwhat), ('fitto', fitto), ('maxtime', maxtime), ('maxiters', maxiters), ('randseed', randseed)])
+    parset.improvement.append(fvals) # Store improvement history
+    if multiimprovement is not None: parset.multiimprovement = multiimprovement # Store the objective function values of all chains
+    parset.autofitsettings = odict([('fitwhat', fitwhat), ('fitto', fitto), ('method', method), ('optimizer', optimizer), ('maxtime', maxtime), ('maxiters', maxiters), ('randseed', randseed), ('nchains', nchains), ('nblocks', nblocks)])
     
     return parset
 
 
 
+## Worker processes for running chains in parallel -- tasks have to be standalone functions, see batchtools.py
+
+def fitchain_task(chain=None, function=None, args=None, asdkwargs=None, randseed=None, inqueue=None, outqueue=None, stopevent=None):
+    '''
+    Run one chain of a multi-chain fit in a worker process. The worker is started once, and then fits from each
+    parameter vector and time limit it receives until it receives None. The ASD step sizes and parameter selection
+    probabilities are kept from one block to the next, as is the random number stream.
+    '''
+    try:
+        seed(randseed) # Seed once, rather than for every block
+        pinitial, sinitial = None, None
+        while True:
+            item = inqueue.get()
+            if item is None: break
+            parvec, maxtime = item
+            res = asd(function, parvec, args=args, pinitial=pinitial, sinitial=sinitial, maxtime=maxtime, stoppingfunc=stopevent.is_set, **asdkwargs)
+            pinitial, sinitial = res.details.probabilities, res.details.stepsizes
+            outqueue.put((chain, res.x, res.details.fvals))
+    except Exception as E:
+        outqueue.put((chain, E, None)) # Pass the error back, rather than leaving the main process waiting
+    return None
+
+
+def runfitchains(parvecs=None, function=None, args=None, asdkwargs=None, nblocks=None, blockiters=None, maxtime=None, randseed=None, 
+                 stoppingfunc=None, progressfunc=None, verbose=2, interval=1.0):
+    '''
+    Run a multi-chain fit: one worker per starting parameter vector in parvecs runs blockiters iterations of ASD, then
+    all chains restart from the best parameter vector found, for nblocks blocks or until maxtime seconds have passed.
+    The workers are started once, and only the parameter vectors and objective function values are sent between them
+    and the main process. If progressfunc is supplied, it is called with a progress event for the best fit after each
+    block, as asd() does after each iteration. Returns the best parameter vector, the objective function values for the
+    chain it came from, and an array of the values for all chains.
+    
+    Version: 2026oct18
+    '''
+    if Process is None:
+        raise OptimaException('Running a multi-chain fit requires the multiprocessing module')
+    starttime = time()
+    nchains = len(parvecs)
+    maxiters = blockiters*nblocks
+    fvalarray = zeros((nchains,maxiters+1)) + nan
+    bestfvals = [] # The objective function values of the chain that ended up best, over all blocks so far
+    
+    # Start the workers
+    inqueues = [Queue() for chain in range(nchains)]
+    outqueue = Queue()
+    stopevent = Event()
+    processes = []
+    for chain in range(nchains):
+        thisseed = randseed + (chain+1)*(2**10-1) # Pseudorandom seeds
+        chainkwargs = dict(asdkwargs, maxiters=blockiters, randseed=None, label='%s chain %i' % (asdkwargs.get('label') or '', chain+1))
+        prc = Process(target=fitchain_task, args=(chain, function, args, chainkwargs, thisseed, inqueues[chain], outqueue, stopevent))
+        prc.start()
+        processes.append(prc)
+    
+    try:
+        # Loop over the blocks
+        for block in range(nblocks):
+            timeleft = None if maxtime is None else maxtime-(time()-starttime)
+            if block and timeleft is not None and timeleft<=0: break # Always run at least one block
+            printv('Running block %i/%i of a %i-chain fit with %i iterations per block' % (block+1, nblocks, nchains, blockiters), 2, verbose)
+            for chain,inqueue in enumerate(inqueues): inqueue.put((parvecs[chain], timeleft))
+            
+            # Gather the results, checking the stopping function while waiting
+            outputs = [None]*nchains
+            for i in range(nchains):
+                while True:
+                    try:
+                        chain, x, fvals = outqueue.get(timeout=interval)
+                        break
+                    except Empty:
+                        if stoppingfunc and stoppingfunc():
+                            stopevent.set()
+                            raise CancelException
+                if isinstance(x, Exception): raise x
+                outputs[chain] = (x, fvals)
+            
+            # Figure out which one did best, and restart all the chains from it -- this is key!
+            leftbound = block*blockiters
+            for chain,(x,fvals) in enumerate(outputs): fvalarray[chain,leftbound:leftbound+len(fvals)] = fvals # Overwrites the last value of the previous block with the same value
+            bestchain = argmin([fvals[-1] for x,fvals in outputs])
+            parvecs = [outputs[bestchain][0]]*nchains
+            bestfvals = list(bestfvals[:-1]) + list(outputs[bestchain][1]) # The first value of each block is the last of the previous one
+            
+            if progressfunc:
+                progressfunc(objdict([('label',asdkwargs.get('label')), ('iteration',len(bestfvals)-1), ('maxiters',maxiters), ('fval',bestfvals[-1]), ('fvalorig',fvalarray[0,0]), 
+                                      ('x',parvecs[0].copy()), ('elapsed',time()-starttime), ('eta',(nblocks-block-1)*(time()-starttime)/(block+1.))]))
+            if stoppingfunc and stoppingfunc():
+                raise CancelException
+    finally:
+        stopevent.set()
+        for inqueue in inqueues: inqueue.put(None) # Tell the workers to finish
+        for prc in processes: prc.join(timeout=interval)
+        for prc in processes: 
+            if prc.is_alive(): prc.terminate()
+    
+    return parvecs[0], array(bestfvals), fvalarray
+
+
+
 ## WARNING -- the following two functions must be updated together! 
 
 # Populate lists of what to fit
@@ -267,4 +422,217 @@ def objectivecalc(parvec=None, pars=None, parlist=None, project=None, fitto='pre
         pause(0.001)
         
     printv('Current mismatch: %s' % array(mismatch), 4, verbose=verbose)
-    return mismatch
\ No newline at end of file
+    return mismatch
+
+
+
+# Years to run the model past the last data point being fitted, so parameter smoothing (see Timepar.interp()) doesn't change the model there
+endmargin = 2
+
+
+def makefittargets(project=None, pars=None, fitto='prev', method='wape', bestindex=0):
+    '''
+    Compile the data points that objectivecalc() compares the model to into flat arrays of the data values and
+    the divisors used by the method, and, for each result, the populations and years of the model values to compare
+    them with, so that fastobjectivecalc() can calculate the mismatch in one go. The data are taken from a Resultset
+    made with pars, so they match objectivecalc(). Returns None if any of the results being fitted aren't available
+    from calcoutcomes(), or the method isn't known.
+    
+    Version: 2026oct18
+    '''
+    if method not in ['wape', 'mape', 'mad', 'mse']: return None # Let objectivecalc() raise the error
+    eps = project.settings.eps
+    start, end = project.data['years'][0], project.data['years'][-1]
+    results = project.runsim(pars=pars, start=start, end=end, verbose=0, resultname=project.name+'-autofit', addresult=False, keepraw=True)
+    if fitto in [None, 'all', ['all']]: fitto = list(results.main.keys()) # If not specified, use everything
+    
+    targets = odict([('start',start), ('end',min(start+endmargin, end)), ('method',method), ('tot',odict()), ('pops',odict())])
+    data = odict([('tot',odict()), ('pops',odict())]) # The data and divisors for each result, to put in the same order as the model values
+    for key in fitto:
+        try: this = results.main[key]
+        except: 
+            errormsg = 'autofit(): Key to fit "%s" not found; valid keys are:\n%s' % (key, results.main.keys())
+            raise OptimaException(errormsg)
+        for attr in ['tot', 'pops']:
+            tmpdata = getattr(this, 'data'+attr)
+            if tmpdata is None: continue
+            datarows = tmpdata[bestindex]
+            bypop = len(getattr(this, attr)[bestindex].shape)>1
+            rows, tinds, thisdatay, divisors = [], [], [], []
+            for row in range(len(datarows)):
+                datax, datay = extractdata(results.datayears, datarows[row])
+                for i,year in enumerate(datax):
+                    modelx = findinds(results.tvec, year)
+                    if not len(modelx): continue # No model value to compare with, so it doesn't count
+                    rows.append(row)
+                    tinds.append(modelx[0])
+                    thisdatay.append(datay[i])
+                    if   method=='wape': divisors.append(mean(datay+eps))
+                    elif method=='mape': divisors.append(datay[i]+eps)
+                    else:                divisors.append(1.0)
+                    targets['end'] = max(year+endmargin, targets['end']) # Only run the model as far as the data go
+            if len(rows):
+                which = 'pops' if bypop else 'tot'
+                targets[which][key] = (array(rows), array(tinds), not this.ispercentage) # Results are rounded unless they're percentages, as in Resultset.make()
+                data[which][key] = (thisdatay, divisors)
+    
+    for bypop in [False, True]:
+        try:    calcoutcomes(raw=results.raw[0], keys=targets['pops' if bypop else 'tot'].keys(), pars=pars, settings=project.settings, bypop=bypop)
+        except OptimaException: return None
+    targets['end'] = min(targets['end'], end)
+    targets['datay']    = array([y for which in data.keys() for thisdatay,divisors in data[which].values() for y in thisdatay])
+    targets['divisors'] = array([d for which in data.keys() for thisdatay,divisors in data[which].values() for d in divisors])
+    return targets
+
+
+def calcfitvalues(raw=None, pars=None, project=None, targets=None, doround=True):
+    ''' Extract the model values to compare with the data in targets from makefittargets() from a raw model output '''
+    modely = []
+    for bypop in [False, True]:
+        blocks = targets['pops' if bypop else 'tot']
+        if not len(blocks): continue
+        tvec, outcomes = calcoutcomes(raw=raw, keys=blocks.keys(), pars=pars, settings=project.settings, bypop=bypop)
+        for key,(rows,tinds,rounded) in blocks.items():
+            values = outcomes[key][rows,tinds] if bypop else outcomes[key][tinds]
+            modely.append(values.round() if rounded and doround else values)
+    return concatenate(modely) if len(modely) else zeros(0)
+
+
+def fastobjectivecalc(parvec=None, pars=None, parlist=None, project=None, targets=None, verbose=2):
+    '''
+    Calculate the same mismatch as objectivecalc(), using the targets from makefittargets(): the model is only run
+    up to the last data point, and the results are calculated directly from its output by calcoutcomes().
+    
+    Version: 2026oct18
+    '''
+    pars = convert(pars, parlist, parvec)
+    raw = project.runsim(pars=pars, start=targets['start'], end=targets['end'], verbose=0, rawonly=True)[0]
+    modely = calcfitvalues(raw=raw, pars=pars, project=project, targets=targets)
+    
+    if   targets['method']=='mse': mismatches = (modely - targets['datay'])**2
+    else:                          mismatches = abs(modely - targets['datay']) / targets['divisors']
+    mismatch = mismatches.sum()
+    printv('Current mismatch: %s' % mismatch, 4, verbose=verbose)
+    return mismatch
+
+
+def fitresiduals(parvecs=None, pars=None, parlist=None, project=None, targets=None):
+    '''
+    Calculate residuals between the model and the data for each of a list of parameter vectors, using the targets from
+    makefittargets(), such that the sum of their squares is the mismatch that fastobjectivecalc() calculates: the
+    differences for 'mse', and the square roots of the weighted absolute differences, with their signs, otherwise.
+    The simulations are run together by model_batch(), and the model values aren't rounded, so small changes in the
+    parameters give small changes in the residuals. Returns an array with one row for each parameter vector.
+    
+    Version: 2026oct18
+    '''
+    allpars = [convert(dcp(pars), parlist, parvec) for parvec in parvecs] # Copied, since convert() changes the pars in place
+    simparslist = [makesimpars(thesepars, start=targets['start'], end=targets['end'], settings=project.settings, verbose=0) for thesepars in allpars]
+    rawlist = project.runsim(simpars=simparslist, verbose=0, rawonly=True)
+    diffs = array([calcfitvalues(raw=raw, pars=thesepars, project=project, targets=targets, doround=False) - targets['datay'] for raw,thesepars in zip(rawlist,allpars)])
+    if targets['method']=='mse': return diffs
+    else:                        return sign(diffs)*sqrt(abs(diffs)/targets['divisors'])
+
+
+def lmfit(function=None, x=None, args=None, xmin=None, xmax=None, maxiters=None, maxtime=None, relstep=1e-3, damping=1e-2, 
+          dampings=None, reltol=1e-6, stoppingfunc=None, progressfunc=None, label=None, verbose=2, **kwargs):
+    '''
+    Minimize the sum of squared residuals by bounded Levenberg-Marquardt. function takes a list of parameter vectors
+    (plus args) and returns an array of the residuals for each, so that all the runs needed for each iteration can
+    be done together, e.g. fitresiduals():
+        - the Jacobian is estimated by forward differences, with a step of relstep times each parameter (backwards
+          if that would go past xmax);
+        - steps are then tried for several multiples (dampings) of the current damping, and the best one kept if it
+          is an improvement, with the damping updated to the one used; otherwise the damping is increased tenfold;
+        - steps are clipped to xmin and xmax.
+    
+    maxiters is the number of iterations, each of which is one Jacobian plus one set of steps, i.e. len(x)+len(dampings)
+    model runs. Stops when the relative improvement is less than reltol, the damping gets too large, maxiters or maxtime
+    is reached, or stoppingfunc returns True. Returns an objdict like asd(), with progress events like asd()'s sent
+    to progressfunc after each iteration. Other keyword arguments, e.g. ones only asd() accepts, raise an error.
+    
+    Version: 2026oct18
+    '''
+    if kwargs: raise OptimaException('lmfit() does not accept the arguments %s' % ', '.join(sorted(kwargs.keys())))
+    if args is None: args = {}
+    if maxiters is None: maxiters = 100
+    if maxtime is None: maxtime = 3600
+    if dampings is None: dampings = [0.1, 1.0, 10.0]
+    if label is None: label = ''
+    x = array(x, dtype=float)
+    nparams = len(x)
+    xmin = zeros(nparams)-float('inf') if xmin is None else array(xmin, dtype=float)
+    xmax = zeros(nparams)+float('inf') if xmax is None else array(xmax, dtype=float)
+    x = clip(x, xmin, xmax)
+    
+    start = time()
+    residuals = function([x], **args)[0]
+    fval = fvalorig = dot(residuals, residuals)
+    fvals = [fval]
+    count = 0
+    exitreason = 'Unknown exit reason'
+    while True:
+        count += 1
+        
+        # Estimate the Jacobian, with all the perturbed runs done together
+        steps = relstep*maximum(abs(x), relstep) # Don't use a zero step for parameters that are zero
+        steps = where(x+steps>xmax, -steps, steps) # Step backwards from the upper limit
+        perturbed = [x.copy() for i in range(nparams)]
+        for i in range(nparams): perturbed[i][i] += steps[i]
+        jacobian = ((function(perturbed, **args) - residuals) / steps[:,None]).transpose() # One row per residual, one column per parameter
+        
+        # Try steps for a range of dampings, also together
+        jtj = dot(jacobian.transpose(), jacobian)
+        gradient = dot(jacobian.transpose(), residuals)
+        scaling = diag(jtj) + 1e-12 # Avoid a singular matrix for parameters that don't change the residuals
+        candidates, thesedampings = [], []
+        for thisdamping in damping*array(dampings):
+            try: dx = solve(jtj + thisdamping*diag(scaling), -gradient)
+            except LinAlgError: continue
+            candidates.append(clip(x+dx, xmin, xmax))
+            thesedampings.append(thisdamping)
+        if len(candidates):
+            newresiduals = function(candidates, **args)
+            newfvals = array([dot(r,r) if isfinite(r).all() else float('inf') for r in newresiduals])
+            best = argmin(newfvals)
+        if len(candidates) and newfvals[best]<fval:
+            improvement = (fval-newfvals[best])/fval if fval else 0
+            x, residuals, fval = candidates[best], newresiduals[best], newfvals[best]
+            damping = thesedampings[best]
+            flag = '++'
+        else:
+            improvement = None
+            damping *= 10 # Be more like gradient descent
+            flag = '--'
+        fvals.append(fval)
+        if verbose>=2: print('    %s step %i (%0.1f s) %s (orig: %s | best: %s | damping: %s)' % ((label, count, time()-start, flag) + sigfig([fvalorig, fval, damping])))
+        if progressfunc:
+            elapsed = time()-start
+            eta = max(0, min(maxtime-elapsed, elapsed/count*(maxiters-count)))
+            progressfunc(objdict([('label',label), ('iteration',count), ('maxiters',maxiters), ('fval',fval), ('fvalorig',fvalorig), ('x',x.copy()), ('elapsed',elapsed), ('eta',eta)]))
+        
+        # Stopping criteria
+        if count>=maxiters:
+            exitreason = 'Maximum iterations reached'
+            break
+        if time()-start>maxtime:
+            exitreason = 'Time limit reached'
+            break
+        if improvement is not None and improvement<reltol:
+            exitreason = 'Relative improvement too small (%s < %s)' % sigfig([improvement, reltol])
+            break
+        if damping>1e10:
+            exitreason = 'No improving step found'
+            break
+        if stoppingfunc and stoppingfunc():
+            exitreason = 'Stopping function called'
+            break
+    
+    if verbose>=2: print('=== %s %s (%i steps, orig: %s | best: %s) ===' % ((label, exitreason, count) + sigfig([fvalorig, fval])))
+    output = objdict()
+    output['x'] = x
+    output['fval'] = fval
+    output['exitreason'] = exitreason
+    output['details'] = objdict()
+    output['details']['fvals'] = array(fvals)
+    return output
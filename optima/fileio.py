@@ -4,7 +4,10 @@
 
 from gzip import GzipFile
 from contextlib import closing
-from numpy import ones, zeros
+import struct
+import zlib
+import mmap
+from numpy import ones, zeros, ndarray, ascontiguousarray
 from optima import odict, OptimaException, makefilepath
 from xlrd import open_workbook
 import os
@@ -27,48 +30,58 @@ else: # Python 2
 ### Basic I/O functions
 #############################################################################################################################
 
-def saveobj(filename=None, obj=None, compresslevel=5, verbose=True, folder=None):
+def saveobj(filename=None, obj=None, compresslevel=5, verbose=True, folder=None, codec=None):
     '''
     Save an object to file -- use compression 5 by default, since more is much slower but not much smaller.
     Once saved, can be loaded with loadobj() (q.v.).
+    
+    By default, saves a gzipped pickle, which any version of Optima can load; to save faster, use a different
+    codec, e.g. codec='zlib' (see Codec). compresslevel only applies to the default format.
 
     Usage:
 		myobj = ['this', 'is', 'a', 'weird', {'object':44}]
 		saveobj('myfile.obj', myobj)
+		saveobj('myfile.obj', myobj, codec='zlib')
     '''
     fullpath = makefilepath(filename=filename, folder=folder, sanitize=True)
-    with GzipFile(fullpath, 'wb', compresslevel=compresslevel) as fileobj:
-        fileobj.write(pkl.dumps(obj, protocol=-1))
+    if codec is None or codec=='gzip':
+        with GzipFile(fullpath, 'wb', compresslevel=compresslevel) as fileobj:
+            fileobj.write(pkl.dumps(obj, protocol=-1))
+    else:
+        with open(fullpath, 'wb') as fileobj:
+            getcodec(codec).dump(obj, fileobj)
     if verbose: print('Object saved to "%s"' % fullpath)
     return fullpath
 
 
 def loadobj(filename=None, folder=None, verbose=True):
     '''
-    Load a saved file.
+    Load a saved file, whichever codec it was saved with.
 
     Usage:
     	obj = loadobj('myfile.obj')
     '''
     # Handle loading of either filename or file object
     if isinstance(filename, basestring): 
-        argtype = 'filename'
         filename = makefilepath(filename=filename, folder=folder) # If it is a file, validate the folder
+        with open(filename, 'rb') as fileobj:
+            obj = loadfileobj(fileobj)
     else: 
-        argtype = 'fileobj'
-    kwargs = {'mode': 'rb', argtype: filename}
-    with GzipFile(**kwargs) as fileobj:
-        obj = loadpickle(fileobj)
+        obj = loadfileobj(filename)
     if verbose: print('Object loaded from "%s"' % filename)
     return obj
 
 
-def dumpstr(obj):
-    ''' Write data to a fake file object,then read from it -- used on the FE '''
+def dumpstr(obj, codec=None):
+    ''' Write data to a fake file object,then read from it -- used on the FE. By default uses defaultcodec. '''
     result = None
+    if codec is None: codec = defaultcodec
     with closing(IO()) as output:
-        with GzipFile(fileobj = output, mode = 'wb') as fileobj: 
-            fileobj.write(pkl.dumps(obj, protocol=-1))
+        if codec=='gzip':
+            with GzipFile(fileobj = output, mode = 'wb') as fileobj: 
+                fileobj.write(pkl.dumps(obj, protocol=-1))
+        else:
+            getcodec(codec).dump(obj, output)
         output.seek(0)
         result = output.read()
     return result
@@ -77,31 +90,338 @@ def dumpstr(obj):
 def loadstr(source):
     ''' Load data from a fake file object -- also used on the FE '''
     with closing(IO(source)) as output:
-        with GzipFile(fileobj = output, mode = 'rb') as fileobj: 
-            obj = loadpickle(fileobj)
+        obj = loadfileobj(output)
+    return obj
+
+
+def loadfileobj(fileobj):
+    ''' Load an object from a file object, using the codec named in its header, or as a gzipped pickle if there isn't one '''
+    start = fileobj.tell()
+    if fileobj.read(len(magicheader)) != magicheader: # Saved before codecs, or with codec='gzip'
+        fileobj.seek(start)
+        with GzipFile(fileobj=fileobj, mode='rb') as gzipfileobj:
+            obj = loadpickle(gzipfileobj)
+    else:
+        namelength = ord(fileobj.read(1))
+        name = fileobj.read(namelength).decode()
+        obj = getcodec(name).load(fileobj)
     return obj
 
 
-def loadpickle(fileobj, verbose=False):
+def loadpickle(fileobj, verbose=False, buffers=None):
     ''' Loads a pickled object -- need to define legacy classes here since they're needed for unpickling '''
     
-    # Load the file string
-    filestr = fileobj.read()
+    # Read the pickle from the file as it's unpickled, rather than reading it all first
+    kwargs = {'buffers': buffers} if buffers is not None else {} # Only for out-of-band buffers, Python 3.8+
+    start = fileobj.tell()
     
     try: # Try just loading it
-        obj = pkl.loads(filestr) # Actually load it
+        obj = pkl.load(fileobj, **kwargs) # Actually load it
     except: # If that fails, create legacy classes and try again
         if verbose: print('Initial loading failed, trying again with legacy classes...')
         class EmptyClass(object): pass
         op._project.Spreadsheet = EmptyClass
         op._portfolio.GAOptim = EmptyClass
-        obj = pkl.loads(filestr) # Actually load it with legacy classes
+        fileobj.seek(start)
+        obj = pkl.load(fileobj, **kwargs) # Actually load it with legacy classes
         del op._project.Spreadsheet
         del op._portfolio.GAOptim
     
     return obj
 
 
+
+#############################################################################################################################
+### Memory-mapped result stores
+#############################################################################################################################
+
+resultsheader = b'\x89OPTRES\n' # Starts a result store
+resultsalign = 64 # Each array starts at a multiple of this many bytes
+
+
+def saveresults(filename=None, results=None, folder=None, verbose=True):
+    '''
+    Save a Resultset or Multiresultset (or any other object) as a result store: each NumPy array in it
+    -- the pops and tot of each Result, the raw arrays, etc. -- is stored as a separate contiguous block,
+    after an index of where each one is and a pickle of everything else. Load with loadresults(), which
+    memory-maps the arrays, so only the ones that are used are read from disk.
+    
+    The file is written under a temporary name and then moved into place, so any results already loaded
+    from it are unaffected.
+    
+    Usage:
+        saveresults('myresults.res', P.result())
+    
+    Version: 2026oct18
+    '''
+    fullpath = makefilepath(filename=filename, folder=folder, sanitize=True)
+    arrays = [] # The arrays to store separately, in order
+    arrayinds = {} # Index of each one in arrays, by id, so an array used in several places is only stored once
+    
+    def persistentid(obj):
+        ''' Replace numeric arrays with their index in arrays '''
+        if isinstance(obj, ndarray) and type(obj) is ndarray and obj.dtype.kind in 'biufc' and obj.ndim and obj.size:
+            if id(obj) not in arrayinds:
+                arrayinds[id(obj)] = len(arrays)
+                arrays.append(obj)
+            return arrayinds[id(obj)]
+        return None
+    
+    with closing(IO()) as output:
+        pickler = pkl.Pickler(output, -1)
+        pickler.persistent_id = persistentid
+        pickler.dump(results)
+        skeleton = output.getvalue()
+    
+    index = [] # Data type, shape, and offset of each array from the start of the data
+    offset = 0
+    for arr in arrays:
+        index.append((arr.dtype.str, arr.shape, offset))
+        offset += -(-arr.nbytes//resultsalign)*resultsalign
+    index = pkl.dumps(index, -1)
+    
+    tmppath = fullpath+'.tmp'
+    with open(tmppath, 'wb') as fileobj:
+        fileobj.write(resultsheader)
+        for data in [index, skeleton]:
+            fileobj.write(struct.pack('<Q', len(data)))
+            fileobj.write(data)
+        fileobj.write(b'\0'*(-fileobj.tell()%resultsalign)) # Pad to the start of the data
+        for arr in arrays:
+            fileobj.write(ascontiguousarray(arr).data)
+            fileobj.write(b'\0'*(-arr.nbytes%resultsalign))
+    if os.path.exists(fullpath) and not hasattr(os, 'replace'): os.remove(fullpath) # Python 2
+    getattr(os, 'replace', os.rename)(tmppath, fullpath)
+    if verbose: print('Results saved to "%s"' % fullpath)
+    return fullpath
+
+
+def loadresults(filename=None, folder=None, usemmap=True, verbose=True):
+    '''
+    Load results saved with saveresults(). With usemmap=True, the arrays are memory-mapped rather than read
+    in, so only those that are used are read from disk. They can still be modified: the changes are kept in
+    memory, not written back to the file.
+    
+    Usage:
+        results = loadresults('myresults.res')
+    
+    Version: 2026oct18
+    '''
+    fullpath = makefilepath(filename=filename, folder=folder)
+    with open(fullpath, 'rb') as fileobj:
+        if fileobj.read(len(resultsheader)) != resultsheader:
+            errormsg = 'File "%s" is not a result store' % fullpath
+            raise OptimaException(errormsg)
+        index = pkl.loads(fileobj.read(struct.unpack('<Q', fileobj.read(8))[0]))
+        skeleton = fileobj.read(struct.unpack('<Q', fileobj.read(8))[0])
+        start = fileobj.tell() + (-fileobj.tell()%resultsalign)
+        if not index: # Nothing to map
+            data = None
+        elif usemmap:
+            data = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_COPY) # Stays open after the file is closed, as long as the arrays use it
+        else:
+            fileobj.seek(0)
+            data = bytearray(fileobj.read())
+    
+    def persistentload(ind):
+        ''' Make the array from its place in the data '''
+        dtype, shape, offset = index[ind]
+        return ndarray(shape, dtype=dtype, buffer=data, offset=start+offset)
+    
+    with closing(IO(skeleton)) as output:
+        unpickler = pkl.Unpickler(output)
+        unpickler.persistent_load = persistentload
+        results = unpickler.load()
+    if verbose: print('Results loaded from "%s"' % fullpath)
+    return results
+
+
+
+#############################################################################################################################
+### Codecs
+#############################################################################################################################
+
+magicheader = b'\x89OPT' # Starts data saved with a codec -- gzip files start with \x1f\x8b and pickles with \x80 (or "(" etc. for old protocols)
+
+
+class Codec(object):
+    '''
+    A way of turning objects into bytes and back: a pickle protocol, and optionally a compressor that the
+    pickle is streamed through. With outofband=True (pickle protocol 5+, i.e. Python 3.8+), NumPy arrays are
+    stored as separate buffers before the pickle instead of being copied into it.
+    
+    Data saved with a codec start with magicheader and the codec's name, so loadstr() and loadobj() can tell
+    which one to use; data without it are gzipped pickles, as saved by earlier versions. Codecs are looked
+    up by name in codecs -- add new ones with registercodec().
+    
+    Version: 2026oct18
+    '''
+    def __init__(self, name=None, protocol=-1, compressor=None, decompressor=None, outofband=False):
+        self.name = name # Stored in the header, so can't be changed once data have been saved with it
+        self.protocol = protocol
+        self.compressor = compressor # Function returning an object with compress() and flush() methods, e.g. zlib.compressobj
+        self.decompressor = decompressor # Function returning an object with a decompress() method, e.g. zlib.decompressobj
+        self.outofband = outofband
+    
+    def __repr__(self):
+        return 'Codec "%s": pickle protocol %s, %s, %s' % (self.name, self.protocol, 'compressed' if self.compressor else 'uncompressed', 'out-of-band buffers' if self.outofband else 'in-band buffers')
+    
+    def dump(self, obj, fileobj):
+        ''' Write the header and the object to a file object '''
+        name = self.name.encode()
+        fileobj.write(magicheader + struct.pack('B', len(name)) + name)
+        stream = Compressedwriter(fileobj, self.compressor()) if self.compressor else fileobj
+        if self.outofband:
+            buffers = []
+            data = pkl.dumps(obj, protocol=self.protocol, buffer_callback=buffers.append)
+            buffers = [buf.raw() for buf in buffers]
+            stream.write(struct.pack('<Q', len(buffers)))
+            stream.write(struct.pack('<%iQ' % len(buffers), *[buf.nbytes for buf in buffers]))
+            for buf in buffers: stream.write(buf)
+            stream.write(data)
+        else:
+            pkl.dump(obj, stream, protocol=self.protocol)
+        if self.compressor: stream.flush()
+        return None
+    
+    def load(self, fileobj):
+        ''' Load the object from a file object, positioned just after the header '''
+        stream = Decompressedreader(fileobj, self.decompressor) if self.decompressor else fileobj
+        buffers = None
+        if self.outofband:
+            nbuffers = struct.unpack('<Q', stream.read(8))[0]
+            sizes = struct.unpack('<%iQ' % nbuffers, stream.read(8*nbuffers))
+            buffers = []
+            for size in sizes:
+                buf = bytearray(size)
+                stream.readinto(buf)
+                buffers.append(buf)
+        return loadpickle(stream, buffers=buffers)
+
+
+class Compressedwriter(object):
+    ''' A file object that compresses what is written to it before writing it to another one '''
+    def __init__(self, fileobj, compressor):
+        self.fileobj = fileobj
+        self.compressor = compressor
+    
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+        return memoryview(data).nbytes # Large arrays are written as buffers, which don't have a len()
+    
+    def flush(self):
+        ''' Write out the end of the compressed data -- call once, after the last write() '''
+        self.fileobj.write(self.compressor.flush())
+        return None
+
+
+class Decompressedreader(object):
+    '''
+    A file object that decompresses another one as it's read, a chunk at a time, so neither the compressed
+    nor the decompressed data have to be held in memory all at once. Only supports seeking backwards (by
+    starting again), which loadpickle() needs.
+    '''
+    def __init__(self, fileobj, decompressor, chunksize=2**20):
+        self.fileobj = fileobj
+        self.makedecompressor = decompressor
+        self.chunksize = chunksize
+        self.start = fileobj.tell()
+        self.seek(0)
+    
+    def more(self):
+        ''' Decompress the next chunk into the buffer; returns False at the end of the data '''
+        if self.eof: return False
+        chunk = self.fileobj.read(self.chunksize)
+        if chunk: 
+            self.buffer = self.decompressor.decompress(chunk)
+        else: 
+            self.buffer = self.decompressor.flush() if hasattr(self.decompressor, 'flush') else b''
+            self.eof = True
+        self.bufferpos = 0
+        return True
+    
+    def read(self, n=-1):
+        pieces = []
+        if n is None or n<0: n = float('inf')
+        while n>0:
+            if self.bufferpos>=len(self.buffer):
+                if not self.more(): break
+                continue
+            piece = self.buffer[self.bufferpos:self.bufferpos+n] if n<float('inf') else self.buffer[self.bufferpos:]
+            self.bufferpos += len(piece)
+            self.pos += len(piece)
+            n -= len(piece)
+            pieces.append(piece)
+        return b''.join(pieces)
+    
+    def readline(self):
+        pieces = []
+        while True:
+            if self.bufferpos>=len(self.buffer):
+                if not self.more(): break
+                continue
+            end = self.buffer.find(b'\n', self.bufferpos)
+            end = len(self.buffer) if end<0 else end+1
+            piece = self.buffer[self.bufferpos:end]
+            self.bufferpos = end
+            self.pos += len(piece)
+            pieces.append(piece)
+            if piece.endswith(b'\n'): break
+        return b''.join(pieces)
+    
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+    
+    def tell(self):
+        return self.pos
+    
+    def seek(self, pos):
+        ''' Go back to the start, then read up to pos '''
+        self.fileobj.seek(self.start)
+        self.decompressor = self.makedecompressor()
+        self.buffer = b''
+        self.bufferpos = 0
+        self.pos = 0
+        self.eof = False
+        if pos: self.read(pos)
+        return self.pos
+
+
+codecs = odict() # All the codecs available, by name
+
+def registercodec(codec):
+    ''' Add a codec, so data saved with it can be loaded '''
+    if len(codec.name.encode())>255:
+        raise OptimaException('Codec name "%s" is too long' % codec.name)
+    codecs[codec.name] = codec
+    return None
+
+def getcodec(codec):
+    ''' Get a codec by name, or return it if it's already a Codec '''
+    if isinstance(codec, Codec): return codec
+    try: 
+        return codecs[codec]
+    except: 
+        errormsg = 'Codec "%s" not available; choices are: %s' % (codec, ', '.join(['gzip']+codecs.keys()))
+        raise OptimaException(errormsg)
+
+registercodec(Codec('zlib', compressor=lambda: zlib.compressobj(1), decompressor=zlib.decompressobj)) # Fast, but almost as small as gzip
+registercodec(Codec('pickle', compressor=None, decompressor=None)) # Uncompressed: fastest, but largest
+if pkl.HIGHEST_PROTOCOL>=5: # Python 3.8+
+    registercodec(Codec('pickle5', protocol=5, outofband=True)) # Uncompressed, and arrays aren't copied into the pickle
+    registercodec(Codec('zlib5', protocol=5, outofband=True, compressor=lambda: zlib.compressobj(1), decompressor=zlib.decompressobj))
+try: # Optional dependency
+    import lz4.frame as lz4frame
+    registercodec(Codec('lz4', compressor=lz4frame.LZ4FrameCompressor, decompressor=lz4frame.LZ4FrameDecompressor)) # Fastest compressor, if available
+except ImportError: 
+    pass
+
+defaultcodec = 'zlib' # Used by dumpstr() -- use 'gzip' for data that older versions need to load
+
+
+
 def optimafolder(subfolder=None):
     '''
     A centralized place to get the correct paths for Optima.
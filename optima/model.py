@@ -1,69 +1,750 @@
 ## Imports
-from numpy import zeros, exp, maximum, minimum, inf, array, isnan, einsum, floor, ones, power as npow, concatenate as cat, interp, nan, squeeze, isinf, isfinite
-from optima import OptimaException, printv, dcp, odict, findinds
+from numpy import zeros, exp, maximum, minimum, inf, array, isnan, einsum, floor, ones, power as npow, concatenate as cat, interp, nan, squeeze, isinf, isfinite, add, where, ndarray, ascontiguousarray
+from hashlib import sha1
+from optima import OptimaException, printv, dcp, odict, findinds, promotetolist
+addat = add.at # Unbuffered in-place addition, used for summing over edges of the transition graph
 
-def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False, debug=False, label=None, startind=None):
+def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False, debug=False, label=None, startind=None, savecheckpoints=None, checkpoint=None):
     """
-    Runs Optima's epidemiological model.
-    
-    Version: 1.8 (2017mar03)
+    Runs Optima's epidemiological model for a single set of simulation parameters -- see model_batch() for
+    running several at once, and for saving and resuming from checkpoints.
+
+    Version: 1.9 (2026oct18)
     """
-    
+    if simpars is None:  raise OptimaException('model() requires simpars as an input')
+    rawlist = model_batch(simparslist=[simpars], settings=settings, initpeople=initpeople, verbose=verbose, die=die, debug=debug, label=label, startind=startind, savecheckpoints=savecheckpoints, checkpoint=checkpoint)
+    return rawlist[0] # Return raw results
+
+
+
+def model_batch(simparslist=None, settings=None, initpeople=None, verbose=None, die=False, debug=False, label=None, startind=None, savecheckpoints=None, checkpoint=None):
+    """
+    Runs Optima's epidemiological model for K sets of simulation parameters at once, e.g. the samples used for
+    uncertainty. Each parameter is stacked along a leading axis of length K, so all the simulations are advanced
+    through the same timestep loop together. Returns a list of K raw outputs, in the same order as simparslist,
+    each the same as what model() (a batch of one) returns for the same simpars. initpeople can be a list with
+    one entry per simulation, or a single array to use for all of them.
+
+    The arithmetic is done in a different order from the model before batching, so results differ from it by
+    rounding error: up to 1e-9 relative to the size of each value plus one, which can be more than 1e-9
+    relative to the values of health states that are almost empty (see the 'baseline' test in testmodel.py).
+
+    Simulations can only be run together if they have the same structure (populations, time vector, state
+    transitions, partnerships, and age, risk and birth transitions). If they don't, they are run one at a time.
+
+    Checkpoints are full snapshots of the state of a simulation at the start of a timestep, which can be used to
+    skip the timesteps before it in later runs. Use savecheckpoints to give a list of timestep indices to save
+    them at; they are returned in raw['checkpoints'], a dict keyed by index. To resume, pass a single checkpoint,
+    or a list or dict of them, as checkpoint: the latest one that is valid for every simulation is used, and the
+    results are identical to a run from the beginning. A checkpoint is valid if every simulation parameter up to
+    that timestep matches the run it was saved from; if none are valid, the simulations are run in full. The index
+    of the checkpoint used, or None, is returned in raw['resumedfrom'].
+
+    Version: 2026oct18
+    """
+
     ##################################################################################################################
-    ### Setup 
+    ### Setup
     ##################################################################################################################
 
     # Initialize basic quantities
-    
     if verbose is None:  verbose = settings.verbose # Verbosity of output
     if label is None:    label = ''
     else:                label += ': '# An optional label to add to error messages
     if startind is None: startind = 0 # Point to start from -- used with non-empty initpeople
-    if simpars is None:  raise OptimaException(label+'model() requires simpars as an input')
-    if settings is None: raise OptimaException(label+'model() requires settings as an input')
-    printv('Running model...', 1, verbose)
-    
-    if initpeople is not None:
+    if savecheckpoints is None: savecheckpoints = [] # Timestep indices to save checkpoints at
+    initind = startind # Store where initpeople gets applied, since startind changes if resuming from a checkpoint
+    if simparslist is None: raise OptimaException(label+'model() requires simpars as an input')
+    if settings is None:    raise OptimaException(label+'model() requires settings as an input')
+    simparslist = promotetolist(simparslist)
+    nsims = len(simparslist)
+    if not isinstance(initpeople, list): initpeople = [initpeople]*nsims # Use the same initial conditions for every simulation
+    printv('Running model%s...' % (' (%i simulations)' % nsims if nsims>1 else ''), 1, verbose)
+
+    if any([thisinitpeople is not None for thisinitpeople in initpeople]):
         print('WARNING, due to parameter interpolation, results are unreliable if initpeople is not None!')
-    
+
+    # Check that the simulations can be run together
+    def getstructure(simpars):
+        structure = [simpars['popkeys'], simpars['tvec'].tolist(), float(simpars['dt']), simpars['fromto']]
+        structure += [list(simpars['acts'+act].keys()) for act in ['reg','cas','com','inj']]
+        structure += [(simpars['agetransit']!=0).tolist(), (simpars['risktransit']!=0).tolist()]
+        structure += [einsum('ij,ik->ijk', simpars['birthtransit'], simpars['birth']).any(axis=2).tolist()]
+        return structure
+
+    if nsims>1:
+        structure = getstructure(simparslist[0])
+        if not all([getstructure(simpars)==structure for simpars in simparslist[1:]]):
+            printv('Simulations do not have the same structure, running them one at a time', 2, verbose)
+            kwargs = {'settings':settings, 'verbose':verbose, 'die':die, 'debug':debug, 'label':label[:-2] if label else None, 'startind':startind, 'savecheckpoints':savecheckpoints, 'checkpoint':checkpoint}
+            return [model_batch([simpars], initpeople=[thisinitpeople], **kwargs)[0] for simpars,thisinitpeople in zip(simparslist, initpeople)]
+
     # Extract key items
-    popkeys         = simpars['popkeys']
+    popkeys         = simparslist[0]['popkeys']
     npops           = len(popkeys)
-    simpars         = dcp(simpars)
-    tvec            = simpars['tvec']
-    dt              = float(simpars['dt'])          # Shorten dt and make absolutely sure it's a float
+    tvec            = simparslist[0]['tvec']
+    dt              = float(simparslist[0]['dt'])   # Shorten dt and make absolutely sure it's a float
     npts            = len(tvec)                     # Number of time points
     ncd4            = settings.ncd4                 # Shorten number of CD4 states
     nstates         = settings.nstates              # Shorten number of health states
     eps             = settings.eps                  # Define another small number to avoid divide-by-zero errors
     forcepopsize    = settings.forcepopsize         # Whether or not to force the population size to match the parameters
     treatbycd4      = settings.treatbycd4           # Whether or not to preferentially put people on treatment from lower CD4 counts
-    fromto          = simpars['fromto']             # States to and from
-    transmatrix     = simpars['transmatrix']        # Raw transitions matrix
+    fromto          = simparslist[0]['fromto']      # States to and from
+
+    # Disease state indices
+    susreg          = settings.susreg               # Susceptible, regular
+    progcirc        = settings.progcirc             # Susceptible, programmatically circumcised
+    sus             = settings.sus                  # Susceptible, both circumcised and uncircumcised
+    undx            = settings.undx                 # Undiagnosed
+    dx              = settings.dx                   # Diagnosed
+    alldx           = settings.alldx                # All diagnosed
+    allcare         = settings.allcare              # All in care
+    alltx           = settings.alltx                # All on treatment
+    allplhiv        = settings.allplhiv             # All PLHIV
+    notonart        = settings.notonart             # All PLHIV who are not on ART
+    care            = settings.care                 # In care
+    usvl            = settings.usvl                 # On treatment - Unsuppressed Viral Load
+    svl             = settings.svl                  # On treatment - Suppressed Viral Load
+    aidsind         = settings.aidsind              # AIDS
+    si              = susreg[0]                     # susreg is a single element, but needs an index since can't index a list with an array
+    pi              = progcirc[0]                   # as above
+
+    # Set up each simulation, then stack them along the first axis
+    sims = [initmodel(simpars, settings, initpeople=thisinitpeople, verbose=verbose, die=die, debug=debug, label=label) for simpars,thisinitpeople in zip(simparslist, initpeople)]
+    def stack(key): return array([sim[key] for sim in sims])
 
     # Initialize people array
-    people          = zeros((nstates, npops, npts)) # Matrix to hold everything
+    people          = zeros((nsims, nstates, npops, npts)) # Matrix to hold everything
+    people[:,:,:,startind] = stack('initpeople')
 
     # Initialize other arrays used for internatl calculations
-    allpeople       = zeros((npops, npts))          # Population sizes
-    effallprev      = zeros((nstates, npops))       # HIV effective prevalence (prevalence times infectiousness), by health state
-    inhomo          = zeros(npops)                  # Inhomogeneity calculations
+    allpeople       = zeros((nsims, npops, npts))          # Population sizes
 
     # Initialize raw arrays -- reporting annual quantities (so need to divide by dt!)
-    raw_inci        = zeros((npops, npts))          # Total incidence acquired by each population
-    raw_incibypop   = zeros((npops, npts))          # Total incidence caused by each population
-    raw_births      = zeros((npops, npts))          # Total number of births to each population
-    raw_mtct        = zeros((npops, npts))          # Number of mother-to-child transmissions to each population
-    raw_mtctfrom    = zeros((npops, npts))          # Number of mother-to-child transmissions from each population
-    raw_hivbirths   = zeros((npops, npts))          # Number of births to HIV+ pregnant women
-    raw_receivepmtct= zeros((npops, npts))          # Initialise a place to store the number of people in each population receiving PMTCT
-    raw_diag        = zeros((npops, npts))          # Number diagnosed per timestep
-    raw_newcare     = zeros((npops, npts))          # Number newly in care per timestep
-    raw_newtreat    = zeros((npops, npts))          # Number initiating ART per timestep
-    raw_newsupp     = zeros((npops, npts))          # Number newly suppressed per timestep
-    raw_death       = zeros((nstates, npops, npts)) # Number of deaths per timestep
-    raw_otherdeath  = zeros((npops, npts))          # Number of other deaths per timestep
-    
+    raw_inci        = zeros((nsims, npops, npts))          # Total incidence acquired by each population
+    raw_incibypop   = zeros((nsims, npops, npts))          # Total incidence caused by each population
+    raw_births      = zeros((nsims, npops, npts))          # Total number of births to each population
+    raw_mtct        = zeros((nsims, npops, npts))          # Number of mother-to-child transmissions to each population
+    raw_mtctfrom    = zeros((nsims, npops, npts))          # Number of mother-to-child transmissions from each population
+    raw_hivbirths   = zeros((nsims, npops, npts))          # Number of births to HIV+ pregnant women
+    raw_receivepmtct= zeros((nsims, npops, npts))          # Initialise a place to store the number of people in each population receiving PMTCT
+    raw_diag        = zeros((nsims, npops, npts))          # Number diagnosed per timestep
+    raw_newcare     = zeros((nsims, npops, npts))          # Number newly in care per timestep
+    raw_newtreat    = zeros((nsims, npops, npts))          # Number initiating ART per timestep
+    raw_newsupp     = zeros((nsims, npops, npts))          # Number newly suppressed per timestep
+    raw_death       = zeros((nsims, nstates, npops, npts)) # Number of deaths per timestep
+    raw_otherdeath  = zeros((nsims, npops, npts))          # Number of other deaths per timestep
+
+    # Parameters used in the time loop -- see initmodel() for definitions
+    deathprob       = stack('deathprob')
+    background      = stack('background')
+    alltrans        = stack('alltrans')
+    requiredvl      = stack('requiredvl')
+    treatvs         = stack('treatvs')
+    treatfail       = stack('treatfail')
+    linktocare      = stack('linktocare')
+    aidslinktocare  = stack('aidslinktocare')
+    leavecare       = stack('leavecare')
+    aidsleavecare   = stack('aidsleavecare')
+    regainvs        = stack('regainvs')
+    popsize         = stack('popsize')
+    sharing         = stack('sharing')
+    numtx           = stack('numtx')
+    numvlmon        = stack('numvlmon')
+    hivtest         = stack('hivtest')
+    aidstest        = stack('aidstest')
+    numcirc         = stack('numcirc')
+    numpmtct        = stack('numpmtct')
+    proppmtct       = stack('proppmtct')
+    transinj        = stack('transinj')
+    prepeff         = stack('prepeff')
+    osteff          = stack('osteff')
+    effmtct         = stack('effmtct')
+    pmtcteff        = stack('pmtcteff')
+    alleff          = stack('alleff')
+    force           = stack('force')
+    inhomopar       = stack('inhomopar')
+
+    # Births, deaths and transitions
+    birth           = stack('birth')
+    agetransit      = stack('agetransit')
+    risktransit     = stack('risktransit')
+    birthtransit    = stack('birthtransit')
+
+    # Shorten to lists of key tuples so don't have to iterate over every population twice for every timestep
+    risktransitlist,agetransitlist = [],[]
+    for p1 in range(npops):
+        for p2 in range(npops):
+            if agetransit[0,p1,p2]:   agetransitlist.append((p1,p2, (1.-exp(-dt/agetransit[:,p1,p2]))))
+            if risktransit[0,p1,p2]:  risktransitlist.append((p1,p2, (1.-exp(-dt/risktransit[:,p1,p2]))))
+
+    # Figure out which populations have age inflows -- don't force population
+    ageinflows   = agetransit[0].sum(axis=0)            # Find populations with age inflows
+    birthinflows = birthtransit[0].sum(axis=0)          # Find populations with birth inflows
+    noinflows = findinds(ageinflows+birthinflows==0)    # Find populations with no inflows
+
+    # These all have the same format, so we put them in tuples of (proptype, data structure for storing output, state below, state in question, states above (including state in question), numerator, denominator, data structure for storing new movers)
+    #                    name,       prop,                lower, to,    num,     denom,   raw_new,        fixyear
+    propstruct = odict([('propdx',   [stack('propdx'),   undx, dx,    alldx,   allplhiv, raw_diag,       stack('fixpropdx')]),
+                        ('propcare', [stack('propcare'), dx,   care,  allcare, alldx,    raw_newcare,    stack('fixpropcare')]),
+                        ('proptx',   [stack('proptx'),   care, alltx, alltx,   allcare,  raw_newtreat,   stack('fixproptx')]),
+                        ('propsupp', [stack('propsupp'), usvl, svl,   svl,     alltx,    raw_newsupp,    stack('fixpropsupp')])])
+    fixedprops = odict([(name, zeros(nsims)+nan) for name in propstruct.keys()]) # The values proportions have been fixed at, if any, for storing in checkpoints
+
+    # Everything else that gets carried over between timesteps, for saving and restoring checkpoints
+    rawarrays = odict([('inci',raw_inci), ('incibypop',raw_incibypop), ('births',raw_births), ('mtct',raw_mtct), ('mtctfrom',raw_mtctfrom),
+                       ('hivbirths',raw_hivbirths), ('receivepmtct',raw_receivepmtct), ('diag',raw_diag), ('newcare',raw_newcare),
+                       ('newtreat',raw_newtreat), ('newsupp',raw_newsupp), ('death',raw_death), ('otherdeath',raw_otherdeath)])
+    savedcheckpoints = [dict() for k in range(nsims)] # Has to be a dict rather than an odict since the keys are timestep indices
+
+    # Resume from a checkpoint, if there's a valid one
+    resumedfrom = None # Timestep index of the checkpoint used, if any
+    if checkpoint is not None:
+        checkpointlist = findcheckpoint(simparslist, checkpoint, settings=settings, initpeople=initpeople, initind=initind)
+        if checkpointlist is None:
+            printv('No valid checkpoint found, running from the beginning', 3, verbose)
+        else:
+            for k,thischeckpoint in enumerate(checkpointlist):
+                startind = thischeckpoint['ind']
+                people[k,:,:,:startind+1] = thischeckpoint['people']
+                for key,rawarray in rawarrays.items():
+                    rawarray[k,...,:startind+1] = thischeckpoint['raw'][key]
+                for name,proplist in propstruct.items():
+                    calcprop = thischeckpoint['fixedprops'][name]
+                    if not isnan(calcprop): # Apply the same fixing as in the original run
+                        fixproportion(proplist[0][k], int(proplist[6][k]), calcprop)
+                        fixedprops[name][k] = calcprop
+            resumedfrom = startind
+            printv('Resuming from checkpoint at timestep %i' % startind, 3, verbose)
+
+
+    ##################################################################################################################
+    ### Compute the effective numbers of acts outside the time loop
+    ##################################################################################################################
+    foi = makeforceinf(simparslist, label=label, die=die, debug=debug, verbose=verbose)
+
+
+    ## Births precalculation
+    birthslist = []
+    for p1 in range(npops):
+        for p2 in range(npops):
+            birthrates = einsum('i,ij->ij', birthtransit[:, p1, p2], birth[:, p1, :])
+            if birthrates[0].any():
+                birthslist.append(tuple([p1,p2,birthrates]))
+    motherpops = set([thisbirth[0] for thisbirth in birthslist]) # Get the list of all populations who are mothers
+
+
+    ##################################################################################################################
+    ### Define error checking
+    ##################################################################################################################
+
+    def total(arr, axis):
+        ''' Sum over the given axes in the same order however many simulations there are, so batched results match individual runs '''
+        return ascontiguousarray(arr).sum(axis=axis)
+
+    def checkfornegativepeople(people, tind=None):
+        if tind is None: tind = Ellipsis
+        if not((people[:,:,:,tind]>=0).all()): # If not every element is a real number >0, throw an error
+            for k in range(nsims):
+                for t in range(npts):
+                    for errstate in range(nstates): # Loop over all heath states
+                        for errpop in range(npops): # Loop over all populations
+                            if not(people[k,errstate,errpop,t]>=0):
+                                errormsg = label + 'WARNING, Non-positive people found!\npeople[%i, %i, %i] = people[%s, %s, %s] = %s' % (errstate, errpop, t, settings.statelabels[errstate], popkeys[errpop], tvec[t], people[k,errstate,errpop,t])
+                                if nsims>1: errormsg += ' (simulation %i)' % k
+                                if die: raise OptimaException(errormsg)
+                                else:   printv(errormsg, 1, verbose=verbose)
+                                people[k,errstate,errpop,t] = 0.0 # Reset
+
+
+    ##################################################################################################################
+    ### Run the model
+    ##################################################################################################################
+
+    # Compile the time-constant transitions into a list of edges, which get rescaled on each timestep
+    trans = maketransitions(fromto, stack('transmatrix'), settings)
+    edgefrom = trans['from']
+
+    for t in range(startind, npts): # Loop over time
+        printv('Timestep %i of %i' % (t+1, npts), 4, verbose)
+        thispeople = people[:,:,:,t] # People in each simulation, health state and population at this timestep
+
+        ## Save a snapshot of everything needed to continue from this timestep
+        if t in savecheckpoints:
+            for k in range(nsims):
+                thischeckpoint = odict()
+                thischeckpoint['ind']        = t
+                thischeckpoint['key']        = checkpointkey(simparslist[k], t, settings=settings, initpeople=initpeople[k], initind=initind)
+                thischeckpoint['people']     = people[k,:,:,:t+1].copy()
+                thischeckpoint['raw']        = odict([(key,rawarray[k,...,:t+1].copy()) for key,rawarray in rawarrays.items()])
+                thischeckpoint['fixedprops'] = odict([(name,fixedprops[name][k]) for name in fixedprops.keys()])
+                savedcheckpoints[k][t] = thischeckpoint
+
+        ###############################################################################
+        ## Initial steps
+        ###############################################################################
+
+        ## Pull out the transitions for this timestep -- one row per edge of the state graph
+        thistransit = trans['prob'].copy()
+
+        ## Calculate "effective" HIV prevalence -- taking diagnosis and treatment into account
+        allpeople[:,:,t] = thispeople.sum(axis=1)
+        if debug and not((allpeople[:,:,t]>0).all()):
+            errormsg = label + 'No people in populations %s at timestep %i (time %0.1f)' % (findinds((allpeople[:,:,t]<=0).any(axis=0)), t, tvec[t])
+            if die: raise OptimaException(errormsg)
+            else: printv(errormsg, 1, verbose)
+
+        effallprev = einsum('ki,kij->kij',alltrans,thispeople) / allpeople[:,None,:,t]
+        if debug and not((effallprev>=0).all()):
+            errormsg = label + 'HIV prevalence invalid at time %s' % (t)
+            if die: raise OptimaException(errormsg)
+            else:   printv(errormsg, 1, verbose)
+            effallprev = minimum(effallprev,eps)
+
+        ## Calculate inhomogeneity in the force-of-infection based on prevalence
+        thisprev = total(thispeople[:,allplhiv,:], axis=1) / allpeople[:,:,t]
+        inhomo = (inhomopar+eps) / (exp(inhomopar+eps)-1) * exp(inhomopar*(1-thisprev)) # Don't shift the mean, but make it maybe nonlinear based on prevalence
+
+
+        ###############################################################################
+        ## Calculate probability of getting infected
+        ###############################################################################
+
+        # Probability of getting infected. In the first stage of construction, we actually store this as the probability of NOT getting infected
+        # First dimension: simulation. Second dimension: infection acquired by (circumcision status). Third dimension:  infection acquired by (pop). Fourth dimension: infection caused by (health/treatment state). Fifth dimension: infection caused by (pop)
+        forceinffull = calcforceinf(foi, t, alleff, effallprev, transinj=transinj, sharing=sharing, osteff=osteff, prepeff=prepeff, nsus=len(sus), label=label, debug=debug)
+
+        # Probability of getting infected is one minus forceinffull times any scaling factors
+        forceinffull  = einsum('kijlm,kj,kj,kj->kijlm', 1.-forceinffull, force, inhomo,(1.-background[:,:,t]))
+        acquired      = forceinffull.sum(axis=(3,4)) # Infections acquired through sex and injecting - by population who gets infected
+        infections_to = minimum(acquired, (1.0-eps-background[:,:,t].max(axis=1))[:,None,None]) # Make sure it never exceeds the limit
+
+        # Add these transition probabilities to the main array
+        thistransit[:,trans['sisi']] *= ((1.-background[:,:,t]) - infections_to[:,si])[:,None,:] # Index for moving from sus to sus
+        thistransit[:,trans['siui']] *= infections_to[:,None,si] # Index for moving from sus to infection
+        thistransit[:,trans['pipi']] *= ((1.-background[:,:,t]) - infections_to[:,pi])[:,None,:] # Index for moving from circ to circ
+        thistransit[:,trans['piui']] *= infections_to[:,None,pi] # Index for moving from circ to infection
+
+        # Calculate infections acquired and transmitted
+        raw_inci[:,:,t]       = einsum('kij,kij->kj', thispeople[:,sus,:], acquired)/dt
+        raw_incibypop[:,:,t]  = einsum('kij,kijlm->km', ascontiguousarray(thispeople[:,sus,:]), forceinffull)/dt
+
+
+        ##############################################################################################################
+        ### Calculate deaths
+        ##############################################################################################################
+
+        # Adjust transition rates
+        thistransit[:,trans['infected']] *= (1.-background[:,None,:,t])
+
+        # Store deaths
+        raw_death[:,:,:,t]    = einsum('kij,kij->kij', thispeople, deathprob)/dt
+        raw_otherdeath[:,:,t] = einsum('kij,kj->kj',   thispeople, background[:,:,t])/dt
+
+
+        ##############################################################################################################
+        ### Calculate probabilities of shifting along cascade (if programmatically determined)
+        ##############################################################################################################
+
+        def userate(prop,t):
+            if t==0: return ones(nsims, dtype=bool) # Never force a proportion on the first timestep
+            else:    return isnan(prop[:,t-1]) # If the previous timestep had a rate, keep the rate here; otherwise, use a proportion instead of a rate
+
+        # Undiagnosed to diagnosed
+        dxprob = zeros((nsims,ncd4,npops))
+        rate = userate(propstruct['propdx'][0],t) # Need to project forward one year to avoid mismatch
+        dxprob[rate,:,:] = hivtest[:,:,t][rate,None,:]
+        dxprob[rate,aidsind:,:] = maximum(aidstest[:,t,None],hivtest[:,:,t])[rate,None,:]
+        thistransit[:,trans['undxstay']] *= (1.-dxprob[:,trans['undxstaycd4']]) # Probability of not being tested
+        thistransit[:,trans['undxmove']] *= dxprob[:,trans['undxmovecd4']] # Probability of being tested
+        raw_diag[:,:,t] += total(thispeople[:,edgefrom[trans['undxmove']],:]*thistransit[:,trans['undxmove']]/dt, axis=1)
+
+        # Diagnosed/lost to care
+        careprob = zeros((nsims,ncd4,npops))
+        rate = userate(propstruct['propcare'][0],t)
+        careprob[rate,:,:] = linktocare[:,:,t][rate,None,:]
+        careprob[rate,aidsind:,:] = maximum(aidslinktocare[:,t,None],linktocare[:,:,t])[rate,None,:]
+        thistransit[:,trans['dxstay']] *= (1.-careprob[:,trans['dxstaycd4']]) # Probability of not moving into care
+        thistransit[:,trans['dxmove']] *= careprob[:,trans['dxmovecd4']] # Probability of moving into care
+
+        # Care/USVL/SVL to lost
+        lossprob = zeros((nsims,ncd4,npops))
+        lossprob[rate,:,:] = leavecare[:,:,t][rate,None,:]
+        lossprob[rate,aidsind:,:] = minimum(aidsleavecare[:,t,None],leavecare[:,:,t])[rate,None,:]
+        thistransit[:,trans['carestay']] *= (1.-lossprob[:,trans['carestaycd4']]) # Probability of not being lost and remaining in care
+        thistransit[:,trans['caremove']] *= lossprob[:,trans['caremovecd4']] # Probability of being lost
+
+        # SVL to USVL
+        rate = userate(propstruct['propsupp'][0],t)
+        usvlprob = where(rate, treatfail[:,t], 0.)
+        thistransit[:,trans['svlstay']] *= (1.-usvlprob)[:,None,None] # Probability of remaining suppressed
+        thistransit[:,trans['svlmove']] *= usvlprob[:,None,None] # Probability of becoming unsuppressed
+
+        # USVL to SVL
+        svlprob = where(rate, minimum(regainvs[:,t]*numvlmon[:,t]/(eps+total(thispeople[:,alltx,:], axis=(1,2))*requiredvl),1), 0.)
+        thistransit[:,trans['usvlstay']] *= (1.-svlprob)[:,None,None] # Probability of not receiving a VL test & thus remaining failed
+        thistransit[:,trans['usvlmove']] *= svlprob[:,None,None] # Probability of receiving a VL test, switching to a new regime & becoming suppressed
+
+        # Check that probabilities all sum to 1
+        if debug:
+            transsums = zeros((nsims,nstates,npops))
+            addat(transsums, (slice(None),edgefrom), thistransit)
+            transtest = array([(abs(transsums[:,j]/(1.-background[:,:,t])+deathprob[:,j]-ones(npops))>eps).any() for j in range(nstates)])
+            if any(transtest):
+                wrongstatesindices = findinds(transtest)
+                wrongstates = [settings.statelabels[j] for j in wrongstatesindices]
+                wrongprobs = array([transsums[:,j]/(1.-background[:,:,t])+deathprob[:,j] for j in wrongstatesindices])
+                errormsg = label + 'Transitions do not sum to 1 at time t=%f for states %s: sums are \n%s' % (tvec[t], wrongstates, wrongprobs)
+                raise OptimaException(errormsg)
+
+        # Check that no probabilities are less than 0
+        if debug and (thistransit<0).any():
+            wrongedges = findinds((thistransit<0).any(axis=(0,2)))
+            wrongstates = [settings.statelabels[j]+'->'+settings.statelabels[k] for j,k in zip(edgefrom[wrongedges], trans['to'][wrongedges])]
+            wrongprobs = thistransit[:,wrongedges]
+            errormsg = label + 'Transitions are less than 0 at time t=%f for states %s: probabilities are \n%s' % (tvec[t], wrongstates, wrongprobs)
+            raise OptimaException(errormsg)
+
+        ## Shift people as required
+        if t<npts-1:
+            nextpeople = people[:,:,:,t+1] # People at the next timestep -- a view, so modifying this modifies people
+            flows = thispeople[:,edgefrom,:]*thistransit
+            for layer in trans['layers']: # Each layer has at most one edge going into each state, so this is safe to do in one step
+                nextpeople[:,trans['to'][layer],:] += flows[:,layer]
+
+
+        ##############################################################################################################
+        ### Calculate births
+        ##############################################################################################################
+
+        # Precalculate proportion on PMTCT, whether numpmtct or proppmtct is used
+        numhivpospregwomen = zeros(nsims) # Initialize
+        timestepsonpmtct = 1./dt # Specify the number of timesteps on which mothers are on PMTCT -- # WARNING: remove hard-coding
+        fsums = dict() # Has to be a dict rather than an odict since the populations are numeric
+        for p1 in motherpops: # Pull these out of the loop to speed computation
+            fsumpop = thispeople[:, :, p1] # Pull out the people who will be summed
+            fsums[p1] = dict() # Use another dict, since only referring to by key
+            fsums[p1]['all']       = fsumpop.sum(axis=1)
+            fsums[p1]['allplhiv']  = total(fsumpop[:,allplhiv], axis=1)
+            fsums[p1]['undx']      = total(fsumpop[:,undx], axis=1)
+            fsums[p1]['alldx']     = total(fsumpop[:,alldx], axis=1)
+            fsums[p1]['alltx']     = total(fsumpop[:,alltx], axis=1)
+        for p1,p2,birthrates in birthslist: # p1 is mothers, p2 is children
+            numhivpospregwomen += birthrates[:,t] * fsums[p1]['alldx'] * timestepsonpmtct # Divide by dt to get number of women
+        calcproppmtct = where(isnan(proppmtct[:,t]), numpmtct[:,t]/(eps+numhivpospregwomen), proppmtct[:,t]) # If the proportion on PMTCT is not specified, use the number
+        calcproppmtct = minimum(calcproppmtct, 1.)
+
+        undxhivbirths = zeros((nsims,npops)) # Store undiagnosed HIV+ births for this timestep
+        dxhivbirths = zeros((nsims,npops)) # Store diagnosed HIV+ births for this timestep
+
+        # Calculate actual births, MTCT, and PMTCT
+        for p1,p2,birthrates in birthslist:
+            thisbirthrate = birthrates[:,t]
+            popbirths      = thisbirthrate * fsums[p1]['all']
+            mtctundx       = thisbirthrate * fsums[p1]['undx'] * effmtct[:,t] # Births to undiagnosed mothers
+            mtcttx         = thisbirthrate * fsums[p1]['alltx'] * pmtcteff[:,t] # Births to mothers on treatment
+            thiseligbirths = thisbirthrate * fsums[p1]['alldx'] # Births to diagnosed mothers eligible for PMTCT
+
+            mtctdx = (thiseligbirths * (1-calcproppmtct)) * effmtct[:,t] # MTCT from those diagnosed not receiving PMTCT
+            mtctpmtct = (thiseligbirths * calcproppmtct) * pmtcteff[:,t] # MTCT from those receiving PMTCT
+            thisreceivepmtct = thiseligbirths * calcproppmtct
+            thispopmtct = mtctundx + mtctdx + mtcttx + mtctpmtct # Total MTCT, adding up all components
+
+            undxhivbirths[:,p2] += mtctundx                       # Births to add to undx
+            dxhivbirths[:,p2]   += (mtctdx + mtcttx + mtctpmtct)   # Births add to dx
+
+            raw_receivepmtct[:, p1, t] += thisreceivepmtct * timestepsonpmtct
+            raw_mtct[:, p2, t] += thispopmtct/dt
+            raw_mtctfrom[:, p1, t] += thispopmtct/dt
+            raw_births[:, p2, t] += popbirths/dt
+            raw_hivbirths[:, p1, t] += thisbirthrate * fsums[p1]['allplhiv'] / dt
+
+        raw_inci[:,:,t] += raw_mtct[:,:,t] # Update infections acquired based on PMTCT calculation
+        raw_incibypop[:,:,t] += raw_mtctfrom[:,:,t] # Update infections caused based on PMTCT calculation
+
+        if debug and (abs(raw_inci[:,:,t].sum(axis=1) - raw_incibypop[:,:,t].sum(axis=1)) > eps).any():
+            errormsg = label + 'Number of infections received (%s) is not equal to the number of infections caused (%s) at time %i' % (raw_inci[:,:,t].sum(axis=1), raw_incibypop[:,:,t].sum(axis=1), t)
+            if die: raise OptimaException(errormsg)
+            else: printv(errormsg, 1, verbose)
+
+        ###############################################################################
+        ## Shift numbers of people (circs, treatment, age transitions, risk transitions, prop scenarios)
+        ###############################################################################
+        if t<npts-1:
+
+            ## Births
+            nextpeople[:, si, :]      += raw_births[:,:,t]*dt - undxhivbirths - dxhivbirths # HIV- babies assigned to uncircumcised compartment
+            nextpeople[:, undx[0], :] += undxhivbirths # HIV+ babies born to undiagnosed mothers assigned to undiagnosed compartment
+            nextpeople[:, dx[0], :]   += dxhivbirths   # HIV+ babies born to diagnosed mothers assigned to diagnosed compartment
+
+            ## Circumcision
+            circppl = minimum(numcirc[:,:,t+1], nextpeople[:,si,:])
+            nextpeople[:,si,:] -= circppl
+            nextpeople[:,pi,:] += circppl
+
+
+            ## Age-related transitions
+            for p1,p2,thisagetransprob in agetransitlist:
+                peopleleaving = einsum('ki,k->ki', nextpeople[:, :, p1], thisagetransprob)
+                if debug and (peopleleaving > nextpeople[:, :, p1]).any():
+                    errormsg = label + 'Age transitions between pops %s and %s at time %i are too high: the age transitions you specified say that %s%% of the population should age in a single time-step.' % (popkeys[p1], popkeys[p2], t+1, agetransit[:, p1, p2]*100.)
+                    if die: raise OptimaException(errormsg)
+                    else:   printv(errormsg, 1, verbose)
+                    peopleleaving = minimum(peopleleaving, thispeople[:, :, p1]) # Ensure positive
+
+
+                nextpeople[:, :, p1] -= peopleleaving # Take away from pop1...
+                nextpeople[:, :, p2] += peopleleaving # ... then add to pop2
+
+
+            ## Risk-related transitions
+            for p1,p2,thisrisktransprob in risktransitlist:
+                peoplemoving1 = einsum('ki,k->ki', nextpeople[:, :, p1], thisrisktransprob)  # Number of other people who are moving pop1 -> pop2
+                peoplemoving2 = einsum('ki,k->ki', nextpeople[:, :, p2], thisrisktransprob * (nextpeople[:, :, p1].sum(axis=1)/nextpeople[:, :, p2].sum(axis=1))) # Number of people who moving pop2 -> pop1, correcting for population size
+                # Symmetric flow in totality, but the state distribution will ideally change.
+                nextpeople[:, :, p1] += peoplemoving2 - peoplemoving1 # NOTE: this should not cause negative people; peoplemoving1 is guaranteed to be strictly greater than 0 and strictly less that people[:, p1, t+1]
+                nextpeople[:, :, p2] += peoplemoving1 - peoplemoving2 # NOTE: this should not cause negative people; peoplemoving2 is guaranteed to be strictly greater than 0 and strictly less that people[:, p2, t+1]
+
+
+            ###############################################################################
+            ## Reconcile population sizes
+            ###############################################################################
+
+            # Reconcile population sizes for populations with no inflows
+            thissusreg = nextpeople[:,si,noinflows] # WARNING, will break if susreg is not a scalar index!
+            thisprogcirc = nextpeople[:,pi,noinflows]
+            allsus = thissusreg+thisprogcirc
+            if debug and not (allsus>0).all():
+                errormsg = label + '100%% prevalence detected (t=%f, pop=%s)' % (t+1, array(popkeys)[noinflows][findinds((allsus<=0).any(axis=0))][0])
+                raise OptimaException(errormsg)
+            newpeople = popsize[:,noinflows,t+1] - total(nextpeople[:,:,noinflows], axis=1) # Number of people to add according to simpars['popsize'] (can be negative)
+            nextpeople[:,si,noinflows] += newpeople*thissusreg/allsus # Add new people
+            nextpeople[:,pi,noinflows] += newpeople*thisprogcirc/allsus # Add new people
+
+            # Check population sizes are correct
+            actualpeople = total(nextpeople[:,:,noinflows], axis=(1,2))
+            wantedpeople = total(popsize[:,noinflows,t+1], axis=1)
+            if debug and (abs(actualpeople-wantedpeople)>1.0).any(): # Nearest person is fiiiiine
+                errormsg = label + 'Population size inconsistent at time t=%f: %s vs. %s' % (tvec[t+1], actualpeople, wantedpeople)
+                raise OptimaException(errormsg)
+
+            # If required, scale population sizes to exactly match the parameters
+            if forcepopsize:
+                relerr = 0.1 # Set relative error tolerance
+                susnotonart = cat([sus,notonart])
+                for p in range(npops):
+                    actualpeople = total(nextpeople[:,susnotonart,p], axis=1)
+                    wantedpeople = popsize[:,p,t+1] - total(nextpeople[:,alltx,p], axis=1)
+                    if (actualpeople==0).any(): raise Exception("ERROR: no people.")
+                    ratio = wantedpeople/actualpeople
+                    if (abs(ratio-1)>relerr).any(): # It's not OK
+                        errormsg = label + 'Warning, expected population size is nowhere near calculated population size (t=%f, pop=%s, wanted=%s, actual=%s, ratio=%s)' % (t, popkeys[p], wantedpeople, actualpeople, ratio)
+                        if die: raise OptimaException(errormsg)
+                        else: printv(errormsg, 1, verbose=verbose)
+                    nextpeople[:,susnotonart,p] *= ratio[:,None] # It's OK, so scale to match
+
+
+            #######################################################################################
+            ## Proportions -- these happen after the Euler step, which is why it's t+1 instead of t
+            #######################################################################################
+
+            for name,proplist in propstruct.items():
+                prop, lowerstate, tostate, numer, denom, raw_new, fixyear = proplist
+
+                for k in [k for k in range(nsims) if fixyear[k]==t]: # Fixing the proportion from this timepoint
+                    calcprop = people[k,numer,:,t].sum()/(eps+people[k,denom,:,t].sum()) # This is the value we fix it at
+                    fixproportion(prop[k], t, calcprop)
+                    fixedprops[name][k] = calcprop
+
+                # Figure out how many people we currently have...
+                actual    = total(nextpeople[:,numer,:], axis=(1,2)) # ... in the higher cascade state
+                available = total(nextpeople[:,denom,:], axis=(1,2)) # ... waiting to move up
+
+                # Move the people who started treatment last timestep from usvl to svl
+                finite = isfinite(prop[:,t+1])
+                if name == 'proptx': # If proptx is nan, we use numtx
+                    wanted = where(finite, prop[:,t+1]*available, numtx[:,t+1])
+                    haswanted = ones(nsims, dtype=bool)
+                else: # If a proportion or number isn't specified, skip this
+                    wanted = where(finite, prop[:,t+1]*available, 0.)
+                    haswanted = finite
+
+                # Reconcile the differences between the number we have and the number we want -- newmovers is zero for simulations that don't need to move
+                diff = wanted - actual # Wanted number minus actual number
+                moveup = haswanted & (diff>eps) # We need to move people forwards along the cascade
+                movedown = haswanted & (diff<-eps) # We need to move people backwards along the cascade
+                if moveup.any():
+                    ppltomoveup = ascontiguousarray(nextpeople[:,lowerstate,:]) # Contiguous, so sums are in the same order however many simulations there are
+                    totalppltomoveup = ppltomoveup.sum(axis=(1,2))
+                    moveup &= totalppltomoveup>eps
+                    if moveup.any():
+                        diffup = where(moveup, minimum(diff, totalppltomoveup-eps), 0.) # Make sure we don't move more people than are available
+                        totalppltomoveup[~moveup] = 1. # Avoid dividing by zero for simulations that aren't moving anyone
+                        if name == 'proptx': # For treatment, we move people in lower CD4 states first
+                            if treatbycd4:
+                                tmpdiff = diffup
+                                newmovers = zeros((nsims,ncd4,npops))
+                                for cd4 in reversed(range(ncd4)): # Going backwards so that lower CD4 counts move up the cascade first
+                                    ppltomoveupcd4 = ppltomoveup[:,cd4,:]
+                                    totalppltomoveupcd4 = ppltomoveupcd4.sum(axis=1)
+                                    movecd4 = (tmpdiff>eps) & (totalppltomoveupcd4>eps) # Move people until you have the right proportions
+                                    if movecd4.any():
+                                        tmpdiffcd4 = minimum(tmpdiff[movecd4], totalppltomoveupcd4[movecd4]-eps)
+                                        newmovers[movecd4,cd4,:] = einsum('k,ki->ki', tmpdiffcd4, ppltomoveupcd4[movecd4])/totalppltomoveupcd4[movecd4,None] # Pull out evenly from each population
+                                        tmpdiff = tmpdiff - where(movecd4, newmovers[:,cd4,:].sum(axis=1), 0.) # Adjust the number of available spots
+                            else:
+                                newmovers = einsum('k,kij->kij', diffup, ppltomoveup)/totalppltomoveup[:,None,None]
+                            # Need to handle USVL and SVL separately
+                            nextpeople[:,care,:] -= newmovers # Shift people out of care
+                            nextpeople[:,usvl,:] += einsum('kij,k->kij', newmovers, 1.0-treatvs) # ... and onto treatment, according to existing proportions
+                            nextpeople[:,svl,:]  += einsum('kij,k->kij', newmovers, treatvs) # Likewise for SVL
+                        else: # For everything else, we use a distribution based on the distribution of people waiting to move up the cascade
+                            newmovers = einsum('k,kij->kij', diffup, ppltomoveup)/totalppltomoveup[:,None,None]
+                            nextpeople[:,lowerstate,:] -= newmovers # Shift people out of the less progressed state...
+                            nextpeople[:,tostate,:]    += newmovers # ... and into the more progressed state
+                        raw_new[:,:,t+1] += newmovers.sum(axis=1)/dt # Save new movers
+                if movedown.any():
+                    ppltomovedown = ascontiguousarray(nextpeople[:,tostate,:])
+                    totalppltomovedown = ppltomovedown.sum(axis=(1,2))
+                    movedown &= totalppltomovedown>eps # To avoid having to add eps
+                    if movedown.any():
+                        diffdown = where(movedown, minimum(-diff, totalppltomovedown-eps), 0.) # Flip it around so we have positive people
+                        totalppltomovedown[~movedown] = 1. # Avoid dividing by zero for simulations that aren't moving anyone
+                        newmovers = einsum('k,kij->kij', diffdown, ppltomovedown)/totalppltomovedown[:,None,None]
+                        if name == 'proptx': # Handle SVL and USVL separately
+                            newmoversusvl = newmovers[:,:ncd4,:] # First group of movers are from USVL
+                            newmoverssvl  = newmovers[:,ncd4:,:] # Second group is SVL
+                            nextpeople[:,usvl,:] -= newmoversusvl # Shift people out of USVL treatment
+                            nextpeople[:,svl,:]  -= newmoverssvl  # Shift people out of SVL treatment
+                            nextpeople[:,care,:] += newmoversusvl+newmoverssvl # Add both groups of movers into care
+                        else:
+                            nextpeople[:,tostate,:]    -= newmovers # Shift people out of the more progressed state...
+                            nextpeople[:,lowerstate,:] += newmovers # ... and into the less progressed state
+                        raw_new[:,:,t+1] -= newmovers.sum(axis=1)/dt # Save new movers, inverting again
+            if debug: checkfornegativepeople(people, tind=t+1) # If ebugging, check for negative people on every timestep
+
+    checkfornegativepeople(people) # Check only once for negative people, right before finishing
+
+    rawlist = []
+    for k in range(nsims):
+        raw                 = odict()    # Sim output structure
+        raw['tvec']         = tvec
+        raw['popkeys']      = popkeys
+        raw['people']       = people[k]
+        raw['inci']         = raw_inci[k]
+        raw['incibypop']    = raw_incibypop[k]
+        raw['mtct']         = raw_mtct[k]
+        raw['births']       = raw_births[k]
+        raw['hivbirths']    = raw_hivbirths[k]
+        raw['pmtct']        = raw_receivepmtct[k]
+        raw['diag']         = raw_diag[k]
+        raw['newtreat']     = raw_newtreat[k]
+        raw['death']        = raw_death[k]
+        raw['otherdeath']   = raw_otherdeath[k]
+        if savecheckpoints: raw['checkpoints'] = savedcheckpoints[k]
+        if checkpoint is not None: raw['resumedfrom'] = resumedfrom
+        rawlist.append(raw)
+
+    return rawlist # Return raw results
+
+
+
+
+def fixproportion(prop=None, t=None, calcprop=None):
+    '''
+    Fix a proportion (e.g. propdx) from timestep t onwards: nans after t are replaced by calcprop, and
+    infinities are replaced by a linear scale-up/down from calcprop to the first finite value. Modifies prop.
+    '''
+    npts = len(prop)
+    naninds    = findinds(isnan(prop)) # Find the indices that are nan -- to be replaced by current values
+    infinds    = findinds(isinf(prop)) # Find indices that are infinite -- to be scaled up/down to a target value
+    finiteinds = findinds(isfinite(prop)) # Find indices that are defined
+    finiteind = npts-1 if not len(finiteinds) else finiteinds[0] # Get first finite index, or else just last point -- latter should not actually matter
+    naninds = naninds[naninds>t] # Trim ones that are less than the current point
+    infinds = infinds[infinds>t] # Trim ones that are less than the current point
+    ninterppts = len(infinds) # Number of points to interpolate over
+    if len(naninds): prop[naninds] = calcprop # Replace nans with current proportion
+    if len(infinds): prop[infinds] = interp(range(ninterppts), [0,ninterppts-1], [calcprop,prop[finiteind]]) # Replace infinities with scale-up/down
+    return None
+
+
+
+def checkpointkey(simpars=None, ind=None, settings=None, initpeople=None, initind=None):
+    '''
+    Fingerprint everything the state of the model at the start of timestep ind depends on: the simulation
+    parameters up to and including ind, the settings used by the model, and the initial people, if supplied.
+    Simulations with the same key are identical up to ind, so a checkpoint from one can be used for the other.
+    '''
+    npts = len(simpars['tvec'])
+    fingerprint = sha1()
+
+    def update(key, val):
+        fingerprint.update(repr(key).encode())
+        if isinstance(val, dict):
+            for subkey,subval in val.items(): update(subkey, subval)
+        elif isinstance(val, ndarray):
+            if val.ndim and val.shape[-1]==npts: val = val[...,:ind+1] # Later time points don't affect the state at ind
+            fingerprint.update(repr((val.shape, val.dtype.str)).encode())
+            fingerprint.update(ascontiguousarray(val).tobytes())
+        else:
+            fingerprint.update(repr(val).encode())
+        return None
+
+    for key,val in simpars.items():
+        if key!='parsetname': update(key, val) # The name doesn't affect the results
+    update('settings', [settings.nstates, settings.eps, settings.forcepopsize, settings.treatbycd4])
+    if initpeople is not None:
+        update('initpeople', array(initpeople, dtype=float))
+        update('initind', initind)
+    return fingerprint.hexdigest()
+
+
+
+def findcheckpoint(simparslist=None, checkpoint=None, settings=None, initpeople=None, initind=None):
+    '''
+    Find the latest checkpoint that is valid for every simulation. checkpoint can be a single checkpoint, or a
+    list or dict of them, from any of the simulations. Returns a list with one checkpoint per simulation, or
+    None if there isn't a timestep with a valid checkpoint for all of them.
+    '''
+    if isinstance(checkpoint, dict) and 'people' in checkpoint: candidates = [checkpoint] # It's a single checkpoint
+    elif isinstance(checkpoint, dict):                          candidates = list(checkpoint.values()) # It's a dict of checkpoints
+    else:                                                       candidates = promotetolist(checkpoint)
+    npts = len(simparslist[0]['tvec'])
+    inds = sorted(set([candidate['ind'] for candidate in candidates if candidate['ind']<npts]), reverse=True) # Try the latest first
+    for ind in inds:
+        checkpointlist = []
+        for k,simpars in enumerate(simparslist):
+            key = checkpointkey(simpars, ind, settings=settings, initpeople=initpeople[k], initind=initind)
+            matches = [candidate for candidate in candidates if candidate['ind']==ind and candidate['key']==key]
+            if not matches: break # No valid checkpoint for this simulation, so try an earlier one
+            checkpointlist.append(matches[0])
+        if len(checkpointlist)==len(simparslist):
+            return checkpointlist
+    return None
+
+
+
+def initmodel(simpars=None, settings=None, initpeople=None, verbose=2, die=False, debug=False, label=''):
+    '''
+    Set up a single simulation for model_batch(): convert the simulation parameters into the probabilities used in
+    the time loop, make the time-constant transitions, and set the initial epidemic conditions.
+
+    Version: 2026oct18
+    '''
+
+    # Extract key items
+    popkeys         = simpars['popkeys']
+    npops           = len(popkeys)
+    tvec            = simpars['tvec']
+    dt              = float(simpars['dt'])          # Shorten dt and make absolutely sure it's a float
+    npts            = len(tvec)                     # Number of time points
+    ncd4            = settings.ncd4                 # Shorten number of CD4 states
+    nstates         = settings.nstates              # Shorten number of health states
+    eps             = settings.eps                  # Define another small number to avoid divide-by-zero errors
+    fromto          = simpars['fromto']             # States to and from
+    transmatrix     = dcp(simpars['transmatrix'])   # Raw transitions matrix -- modified below, so has to be dcp'd
+
     # Biological and failure parameters
     prog            = maximum(eps,1-exp(-dt/array([simpars['progacute'], simpars['proggt500'], simpars['proggt350'], simpars['proggt200'], simpars['proggt50'], 1./simpars['deathlt50']]) ))
     svlrecov        = maximum(eps,1-exp(-dt/array([inf,inf,simpars['svlrecovgt350'], simpars['svlrecovgt200'], simpars['svlrecovgt50'], simpars['svlrecovlt50']])))
@@ -84,20 +765,14 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
     leavecare       = simpars['leavecare']*dt                             # Proportion of people lost to follow-up per year
     aidsleavecare   = simpars['aidsleavecare']*dt                         # Proportion of people with AIDS being lost to follow-up per year
     regainvs         = simpars['regainvs']                                  # Proportion of people who switch regimens when found to be failing
-        
+
     # Disease state indices
     susreg          = settings.susreg               # Susceptible, regular
     progcirc        = settings.progcirc             # Susceptible, programmatically circumcised
     sus             = settings.sus                  # Susceptible, both circumcised and uncircumcised
-    nsus            = settings.nsus                 # Number of susceptible states
-    undx            = settings.undx                 # Undiagnosed
-    dx              = settings.dx                   # Diagnosed
-    alldx           = settings.alldx                # All diagnosed
-    allcare         = settings.allcare              # All in care
-    alltx           = settings.alltx                # All on treatment
-    allplhiv        = settings.allplhiv             # All PLHIV
-    notonart        = settings.notonart             # All PLHIV who are not on ART    
-    dxnotincare     = settings.dxnotincare          # Diagnosed people not in care
+    undx            = settings.undx                 # Undiagnosed
+    dx              = settings.dx                   # Diagnosed
+    notonart        = settings.notonart             # All PLHIV who are not on ART
     care            = settings.care                 # In care
     usvl            = settings.usvl                 # On treatment - Unsuppressed Viral Load
     svl             = settings.svl                  # On treatment - Suppressed Viral Load
@@ -110,29 +785,11 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
     lt50            = settings.lt50                 # <50
     aidsind         = settings.aidsind              # AIDS
     allcd4          = [acute,gt500,gt350,gt200,gt50,lt50]
-    
+
     if debug and len(sus)!=2:
         errormsg = label + 'Definition of susceptibles has changed: expecting regular circumcised + VMMC, but actually length %i' % len(sus)
         raise OptimaException(errormsg)
 
-    # Births, deaths and transitions
-    birth           = simpars['birth']*dt           # Multiply birth rates by dt
-    agetransit      = simpars['agetransit']         # Multiply age transition rates by dt
-    risktransit     = simpars['risktransit']        # Don't multiply risk trnsitions by dt! These are stored as the mean number of years before transitioning, and we incorporate dt later
-    birthtransit    = simpars['birthtransit']       # Don't multiply the birth transitions by dt as have already multiplied birth rates by dt
-    
-    # Shorten to lists of key tuples so don't have to iterate over every population twice for every timestep
-    risktransitlist,agetransitlist = [],[]
-    for p1 in range(npops):
-        for p2 in range(npops):
-            if agetransit[p1,p2]:   agetransitlist.append((p1,p2, (1.-exp(-dt/agetransit[p1,p2]))))
-            if risktransit[p1,p2]:  risktransitlist.append((p1,p2, (1.-exp(-dt/risktransit[p1,p2]))))
-    
-    # Figure out which populations have age inflows -- don't force population
-    ageinflows   = agetransit.sum(axis=0)               # Find populations with age inflows
-    birthinflows = birthtransit.sum(axis=0)             # Find populations with birth inflows
-    noinflows = findinds(ageinflows+birthinflows==0)    # Find populations with no inflows
-
     # Begin calculation of transmission probabilities -- continued in time loop
     cd4trans *= simpars['transnorm']                    # Normalize CD4 transmission
     dxfactor = (1.-simpars['effdx'])                    # Include diagnosis efficacy
@@ -145,77 +802,44 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
     alltrans[usvl] = cd4trans*dxfactor*efftxunsupp
     alltrans[svl] = cd4trans*dxfactor*efftxsupp
     alltrans[lost] = cd4trans*dxfactor
-    
-    # Proportion aware and treated (for 90/90/90) -- these are the only arrays that get used directly, so have to be dcp'd
-    propdx      = dcp(simpars['propdx'])
-    propcare    = dcp(simpars['propcare'])
-    proptx      = dcp(simpars['proptx'])
-    propsupp    = dcp(simpars['propsupp'])
-    proppmtct   = dcp(simpars['proppmtct'])
-    
+
     #  Years to fix proportions
     def findfixind(fixyearname):
         fixyearpar = simpars[fixyearname]
-        tvec = simpars['tvec']
         if isnan(fixyearpar) or     fixyearpar is None: fixind = nan # It's not defined, skip
         elif fixyearpar > tvec[-1]: fixind = nan # It's after the end, skip
         elif fixyearpar < tvec[0]:  fixind = 0 # It's before the beginning, set to beginning
         else:                       fixind = findinds(tvec>=fixyearpar)[0] # Main usage case
         return fixind
-        
-    fixpropdx      = findfixind('fixpropdx')
-    fixpropcare    = findfixind('fixpropcare')
-    fixproptx      = findfixind('fixproptx')
-    fixpropsupp    = findfixind('fixpropsupp')
-    
-#    # These all have the same format, so we put them in tuples of (proptype, data structure for storing output, state below, state in question, states above (including state in question), numerator, denominator, data structure for storing new movers)
-#    #                    name,       prop,    lower, to,    num,     denom,   raw_new,        fixyear
-    propstruct = odict([('propdx',   [propdx,   undx, dx,    alldx,   allplhiv, raw_diag,       fixpropdx]),
-                        ('propcare', [propcare, dx,   care,  allcare, alldx,    raw_newcare,    fixpropcare]),
-                        ('proptx',   [proptx,   care, alltx, alltx,   allcare,  raw_newtreat,   fixproptx]),
-                        ('propsupp', [propsupp, usvl, svl,   svl,     alltx,    raw_newsupp,    fixpropsupp])])
-    
-    # Population sizes
-    popsize = dcp(simpars['popsize'])
-    
+
     # Population characteristics
     male    = simpars['male']       # Boolean array, true for males
     female  = simpars['female']     # Boolean array, true for females
     injects = simpars['injects']    # Boolean array, true for PWID
+    popsize = simpars['popsize']    # Population sizes
 
-    # Intervention uptake (P=proportion, N=number)
-    sharing   = simpars['sharing']      # Sharing injecting equiptment (P)
-    numtx     = simpars['numtx']        # 1st line treatement (N) -- tx already used for index of people on treatment [npts]
-    numvlmon  = simpars['numvlmon']     # Number of viral load tests done per year (N)
-    hivtest   = simpars['hivtest']*dt   # HIV testing (P) [npop,npts]
-    aidstest  = simpars['aidstest']*dt  # HIV testing in AIDS stage (P) [npts]
-    numcirc   = simpars['numcirc']*dt   # Number of programmatic circumcisions performed (N)
-    numpmtct  = simpars['numpmtct']     # Number of people receiving PMTCT (N)
-    
     # Uptake of OST
     numost    = simpars['numost']                  # Number of people on OST (N)
     if any(injects):
         numpwid = popsize[injects,:].sum(axis=0)  # Total number of PWID
-        try: 
+        try:
             ostprev = numost/numpwid # Proportion of PWID on OST (P)
             ostprev = minimum(ostprev, 1.0) # Don't let more than 100% of PWID be on OST :)
-        except: 
+        except:
             errormsg = label + 'Cannot divide by the number of PWID (numost=%f, numpwid=5f' % (numost, numpwid)
             if die: raise OptimaException(errormsg)
             else:   printv(errormsg, 1, verbose)
             ostprev = zeros(npts) # Reset to zero
     else: # No one injects
-        if numost.sum(): 
+        if numost.sum():
             errormsg = label + 'You have entered non-zero value for the number of PWID on OST, but you have not specified any populations who inject'
             if die: raise OptimaException(errormsg)
             else:   printv(errormsg, 1, verbose)
             ostprev = zeros(npts)
         else: # No one on OST
             ostprev = zeros(npts)
-    
+
     # Other interventions
-    transinj  = simpars['transinj']                         # Injecting transition probability
-    effcondom = simpars['effcondom']                        # Condom effect
     circeff   = 1 - simpars['propcirc']*simpars['effcirc']  # Circumcision efficacy in group where a certain proportion of people are circumcised (susreg group)
     circconst = 1 - simpars['effcirc']                      # Circumcision efficacy in group where everyone is circumcised (progcirc group)
     prepeff   = 1 - simpars['effprep']*simpars['prep']      # PrEP effect
@@ -227,34 +851,73 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
     allcirceff = einsum('i,j',[1,circconst],male)+einsum('i,j',[1,1],female)
     alleff = einsum('ab,ab,ab,ca->abc',prepeff,stieff,circeff,allcirceff)
 
-    # Force of infection metaparameter
-    force = simpars['force']
-    inhomopar = simpars['inhomo']
+    # Store everything the time loop needs -- these are stacked across simulations by model_batch()
+    sim = odict()
+    sim['deathprob']      = deathprob
+    sim['background']     = background
+    sim['alltrans']       = alltrans
+    sim['requiredvl']     = requiredvl
+    sim['treatvs']        = treatvs
+    sim['treatfail']      = treatfail
+    sim['linktocare']     = linktocare
+    sim['aidslinktocare'] = aidslinktocare
+    sim['leavecare']      = leavecare
+    sim['aidsleavecare']  = aidsleavecare
+    sim['regainvs']       = regainvs
+    sim['birth']          = simpars['birth']*dt         # Multiply birth rates by dt
+    sim['agetransit']     = simpars['agetransit']       # Don't multiply age transitions by dt! These are stored as the mean number of years before transitioning, and we incorporate dt later
+    sim['risktransit']    = simpars['risktransit']      # Likewise for risk transitions
+    sim['birthtransit']   = simpars['birthtransit']     # Don't multiply the birth transitions by dt as have already multiplied birth rates by dt
+    sim['propdx']         = simpars['propdx']           # Proportion aware and treated (for 90/90/90)
+    sim['propcare']       = simpars['propcare']
+    sim['proptx']         = simpars['proptx']
+    sim['propsupp']       = simpars['propsupp']
+    sim['proppmtct']      = simpars['proppmtct']
+    sim['fixpropdx']      = findfixind('fixpropdx')
+    sim['fixpropcare']    = findfixind('fixpropcare')
+    sim['fixproptx']      = findfixind('fixproptx')
+    sim['fixpropsupp']    = findfixind('fixpropsupp')
+    sim['popsize']        = popsize
+    sim['sharing']        = simpars['sharing']          # Sharing injecting equiptment (P)
+    sim['numtx']          = simpars['numtx']            # 1st line treatement (N) -- tx already used for index of people on treatment [npts]
+    sim['numvlmon']       = simpars['numvlmon']         # Number of viral load tests done per year (N)
+    sim['hivtest']        = simpars['hivtest']*dt       # HIV testing (P) [npop,npts]
+    sim['aidstest']       = simpars['aidstest']*dt      # HIV testing in AIDS stage (P) [npts]
+    sim['numcirc']        = simpars['numcirc']*dt       # Number of programmatic circumcisions performed (N)
+    sim['numpmtct']       = simpars['numpmtct']         # Number of people receiving PMTCT (N)
+    sim['transinj']       = simpars['transinj']         # Injecting transition probability
+    sim['prepeff']        = prepeff
+    sim['osteff']         = osteff
+    sim['effmtct']        = effmtct
+    sim['pmtcteff']       = pmtcteff
+    sim['alleff']         = alleff
+    sim['force']          = simpars['force']            # Force of infection metaparameter
+    sim['inhomopar']      = simpars['inhomo']
 
 
 
     ##################################################################################################################
-    ### Make time-constant, dt-dependent transitions 
+    ### Make time-constant, dt-dependent transitions
     ##################################################################################################################
 
     ## Progression and deaths for people not on ART
     for fromstate in notonart:
         fromhealthstate = [(fromstate in j) for j in allcd4].index(True) # CD4 count of fromstate
-        for tostate in fromto[fromstate]: # Iterate over the states you could be going to  
+        for tostate in fromto[fromstate]: # Iterate over the states you could be going to
             if fromstate not in lt50: # Cannot progress from this state
                 if any([(tostate in j) and (fromstate in j) for j in allcd4]):
                     transmatrix[fromstate,tostate,:] *= 1.-prog[fromhealthstate]
                 else:
                     transmatrix[fromstate,tostate,:] *= prog[fromhealthstate]
-    
+
             # Death probabilities
-            transmatrix[fromstate,tostate,:] *= 1.-deathhiv[fromhealthstate]*relhivdeath*dt 
+            transmatrix[fromstate,tostate,:] *= 1.-deathhiv[fromhealthstate]*relhivdeath*dt
             deathprob[fromstate,:] = deathhiv[fromhealthstate]*relhivdeath*dt
-            
+
     ## Recovery and deaths for people on suppressive ART
     for fromstate in svl:
         fromhealthstate = [(fromstate in j) for j in allcd4].index(True) # CD4 count of fromstate
-        for tostate in fromto[fromstate]: # Iterate over the states you could be going to  
+        for tostate in fromto[fromstate]: # Iterate over the states you could be going to
             if (fromstate not in acute) and (fromstate not in gt500): # You don't recover from these states
                 if any([(tostate in j) and (fromstate in j) for j in allcd4]):
                     transmatrix[fromstate,tostate,:] = 1.-svlrecov[fromhealthstate]
@@ -265,24 +928,24 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
                     transmatrix[fromstate,tostate,:] = 1.-prog[0]
                 elif tostate in gt500:
                     transmatrix[fromstate,tostate,:] = prog[0]
-    
+
             # Death probabilities
-            transmatrix[fromstate,tostate,:] *= (1.-deathhiv[fromhealthstate]*relhivdeath*deathsvl*dt)    
+            transmatrix[fromstate,tostate,:] *= (1.-deathhiv[fromhealthstate]*relhivdeath*deathsvl*dt)
             deathprob[fromstate,:] = deathhiv[fromhealthstate]*relhivdeath*deathsvl*dt
-            
+
 
     # Recovery and progression and deaths for people on unsuppressive ART
     for fromstate in usvl:
         fromhealthstate = [(fromstate in j) for j in allcd4].index(True) # CD4 count of fromstate
-    
-        # Iterate over the states you could be going to  
+
+        # Iterate over the states you could be going to
         for tostate in fromto[fromstate]:
             if fromstate in acute: # You can progress from acute
                 if tostate in acute:
                     transmatrix[fromstate,tostate,:] = 1.-prog[0]
                 elif tostate in gt500:
                     transmatrix[fromstate,tostate,:] = prog[0]
-            elif fromstate in gt500: 
+            elif fromstate in gt500:
                 if tostate in gt500:
                     transmatrix[fromstate,tostate,:] = 1.-simpars['usvlproggt500']*dt
                 elif tostate in gt350:
@@ -313,17 +976,19 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
                     transmatrix[fromstate,tostate,:] = simpars['usvlrecovlt50']*dt
                 elif tostate in lt50:
                     transmatrix[fromstate,tostate,:] = 1.-simpars['usvlrecovlt50']*dt
-                                    
+
             # Death probabilities
             transmatrix[fromstate,tostate,:] *= 1.-deathhiv[fromhealthstate]*relhivdeath*deathusvl*dt
             deathprob[fromstate,:] = deathhiv[fromhealthstate]*relhivdeath*deathusvl*dt
-  
 
-  
+    sim['transmatrix'] = transmatrix
+
+
+
     #################################################################################################################
-    ### Set initial epidemic conditions 
+    ### Set initial epidemic conditions
     #################################################################################################################
-    
+
     # WARNING: Set parameters, remove hard-coding
     averagedurationinfected = 10.0/2.0   # Assumed duration of undiagnosed HIV pre-AIDS...used for calculating ratio of diagnosed to undiagnosed
     averagedurationdiagnosed = 1.   # Assumed duration of diagnosed HIV pre-treatment...used for calculating ratio of lost to in care
@@ -337,7 +1002,7 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
             if die: raise OptimaException(errormsg)
             else:   printv(errormsg, 1, verbose)
             initpeople = None
-                
+
     # If it wasn't specified, or if there's something wrong with it, determine what it should be here
     if initpeople is None:
 
@@ -353,7 +1018,7 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
             if die: raise OptimaException(errormsg)
             else:   printv(errormsg, 1, verbose)
             treatment = maximum(allinfected, treatment)
-                
+
         treatment = initnumtx * fractotal # Number of people on 1st-line treatment
         nevertreated = allinfected - treatment
 
@@ -367,13 +1032,13 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
             lossrates[cd4,:] = minimum(simpars['aidsleavecare'][0],simpars['leavecare'][:,0])
         dxfrac = 1.-exp(-averagedurationinfected*testingrates)
         linktocarefrac = linkagerates
-        lostfrac = 1.-exp(-averagedurationincare*lossrates) # WARNING, this is not technically correct, but seems to work ok in practice 
+        lostfrac = 1.-exp(-averagedurationincare*lossrates) # WARNING, this is not technically correct, but seems to work ok in practice
         undxdist = 1.-dxfrac
         dxdist = dxfrac*(1.-linktocarefrac)
         incaredist = dxfrac*linktocarefrac*(1.-lostfrac)
         lostdist = dxfrac*linktocarefrac*lostfrac
 
-        # Set initial distributions within treated & untreated 
+        # Set initial distributions within treated & untreated
         untxdist    = (1./prog) / sum(1./prog) # Normalize progression rates to get initial distribution
         txdist      = cat([[1.,1.], svlrecov[2:]]) # Use 1s for the first two entries so that the proportion of people on tx with acute infection is v small
         txdist      = (1./txdist)  / sum(1./txdist) # Normalize
@@ -385,7 +1050,7 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
         initlost    = einsum('ij,j,i->ij',lostdist,nevertreated,untxdist)
         initusvl    = (1.-treatvs)*einsum('i,j->ji',treatment,txdist)
         initsvl     = treatvs*einsum('i,j->ji',treatment,txdist)
- 
+
         # Populated equilibrated array
         initpeople[susreg, :]      = uninfected
         initpeople[progcirc, :]    = zeros(npops) # This is just to make it explicit that the circ compartment only keeps track of people who are programmatically circumcised while the model is running
@@ -401,519 +1066,252 @@ def model(simpars=None, settings=None, initpeople=None, verbose=None, die=False,
         if die: raise OptimaException(errormsg)
         else:   printv(errormsg, 1, verbose)
         initpeople[initpeople<0] = 0.0
-            
-    people[:,:,startind] = initpeople
 
+    sim['initpeople'] = initpeople
+
+    return sim
+
+
+
+def makeforceinf(simpars=None, label=None, die=False, debug=False, verbose=2):
+    '''
+    Precompute everything about the force of infection that doesn't change over the course of a run: the
+    partnership index arrays and the per-act parameters (acts, condom use, transmissibility). Partnerships are
+    stored as arrays of shape (nsims, npartnerships, npts) so that calcforceinf() can evaluate all of them for a
+    given timestep as a single tensor operation. simpars can be a single set of simulation parameters or a list
+    of them; in the latter case, they must all have the same partnerships.
     
-    ##################################################################################################################
-    ### Compute the effective numbers of acts outside the time loop
-    ##################################################################################################################
-    sexactslist = []
-    injactslist = []
+    Since the same pair of populations can appear more than once (e.g. both regular and casual partnerships),
+    partnerships are also split into "layers" in which each (pop1,pop2) pair appears at most once. This allows
+    the results to be multiplied into the force-of-infection array without collisions, and in the same order as
+    the original loop over partnerships.
     
-    # Sex
-    for act in ['reg','cas','com']:
-        for key in simpars['acts'+act]:
-            this = odict()
-            this['wholeacts'] = floor(dt*simpars['acts'+act][key])
-            this['fracacts'] = dt*simpars['acts'+act][key] - this['wholeacts'] # Probability of an additional act
-
-            if simpars['cond'+act].get(key) is not None:
-                condkey = simpars['cond'+act][key]
-            elif simpars['cond'+act].get((key[1],key[0])) is not None:
-                condkey = simpars['cond'+act][(key[1],key[0])]
-            else:
-                errormsg = label + 'Cannot find condom use between "%s" and "%s", assuming there is none.' % (key[0], key[1]) # NB, this might not be the most reasonable assumption
-                if die: raise OptimaException(errormsg)
-                else:   printv(errormsg, 1, verbose)
-                condkey = 0.0
-                    
-            this['cond'] = 1.0 - condkey*effcondom
-            this['pop1'] = popkeys.index(key[0])
-            this['pop2'] = popkeys.index(key[1])
-            if     male[this['pop1']] and   male[this['pop2']]: this['trans'] = (simpars['transmmi'] + simpars['transmmr'])/2.0 
-            elif   male[this['pop1']] and female[this['pop2']]: this['trans'] = simpars['transmfi']  
-            elif female[this['pop1']] and   male[this['pop2']]: this['trans'] = simpars['transmfr']
-            else:
-                errormsg = label + 'Not able to figure out the sex of "%s" and "%s"' % (key[0], key[1])
-                printv(errormsg, 3, verbose)
-                this['trans'] = (simpars['transmmi'] + simpars['transmmr'] + simpars['transmfi'] + simpars['transmfr'])/4.0 # May as well just assume all transmissions apply equally - will undersestimate if pop is predominantly biologically male and oversestimate if pop is predominantly biologically female                     
-                    
-            sexactslist.append(this)
-            
-            # Error checking
-            for key in ['wholeacts', 'fracacts', 'cond']:
-                if debug and not(all(this[key]>=0)):
-                    errormsg = label + 'Invalid sexual behavior parameter "%s": values are:\n%s' % (key, this[key])
+    Version: 2026oct18
+    '''
+    if label is None: label = ''
+    simparslist = promotetolist(simpars)
+    popkeys = simparslist[0]['popkeys']
+    
+    def makeactslists(simpars):
+        ''' Make the lists of sexual and injecting partnerships for a single set of simulation parameters '''
+        dt        = float(simpars['dt'])
+        npts      = len(simpars['tvec'])
+        male      = simpars['male']
+        female    = simpars['female']
+        effcondom = simpars['effcondom']
+        sexactslist = []
+        injactslist = []
+        
+        # Sex
+        for act in ['reg','cas','com']:
+            for key in simpars['acts'+act]:
+                this = odict()
+                this['wholeacts'] = floor(dt*simpars['acts'+act][key])
+                this['fracacts'] = dt*simpars['acts'+act][key] - this['wholeacts'] # Probability of an additional act
+    
+                if simpars['cond'+act].get(key) is not None:
+                    condkey = simpars['cond'+act][key]
+                elif simpars['cond'+act].get((key[1],key[0])) is not None:
+                    condkey = simpars['cond'+act][(key[1],key[0])]
+                else:
+                    errormsg = label + 'Cannot find condom use between "%s" and "%s", assuming there is none.' % (key[0], key[1]) # NB, this might not be the most reasonable assumption
                     if die: raise OptimaException(errormsg)
                     else:   printv(errormsg, 1, verbose)
-                    this[key][this[key]<0] = 0.0 # Reset values
+                    condkey = zeros(npts) # So that it has the same shape as the other partnerships
                         
-    # Injection
-    for key in simpars['actsinj']:
-        this = odict()
-        this['wholeacts'] = floor(dt*simpars['actsinj'][key])
-        this['fracacts'] = dt*simpars['actsinj'][key] - this['wholeacts']
-        
-        this['pop1'] = popkeys.index(key[0])
-        this['pop2'] = popkeys.index(key[1])
-        injactslist.append(this)
-    
-    # Convert from dicts to tuples to be faster
-    for i,this in enumerate(sexactslist): sexactslist[i] = tuple([this['pop1'],this['pop2'],this['wholeacts'],this['fracacts'],this['cond'],this['trans']])
-    for i,this in enumerate(injactslist): injactslist[i] = tuple([this['pop1'],this['pop2'],this['wholeacts'],this['fracacts']])
-    
-    
-    ## Births precalculation
-    birthslist = []
-    for p1 in range(npops): 
-        alleligbirthrate = einsum('i,j->j',birthtransit[p1, :],birth[p1, :])
-        for p2 in range(npops):
-            birthrates = birthtransit[p1, p2] * birth[p1, :]
-            if birthrates.any():
-                birthslist.append(tuple([p1,p2,birthrates,alleligbirthrate]))
-    motherpops = set([thisbirth[0] for thisbirth in birthslist]) # Get the list of all populations who are mothers
-    
-    
-    ##################################################################################################################
-    ### Define error checking
-    ##################################################################################################################
-    
-    def checkfornegativepeople(people, tind=None):
-        tvec = simpars['tvec']
-        if tind is None: tind = Ellipsis
-        if not((people[:,:,tind]>=0).all()): # If not every element is a real number >0, throw an error
-            for t in range(len(tvec)):
-                for errstate in range(nstates): # Loop over all heath states
-                    for errpop in range(npops): # Loop over all populations
-                        if not(people[errstate,errpop,t]>=0):
-                            errormsg = label + 'WARNING, Non-positive people found!\npeople[%i, %i, %i] = people[%s, %s, %s] = %s' % (errstate, errpop, t, settings.statelabels[errstate], popkeys[errpop], simpars['tvec'][t], people[errstate,errpop,t])
-                            if die: raise OptimaException(errormsg)
-                            else:   printv(errormsg, 1, verbose=verbose)
-                            people[errstate,errpop,t] = 0.0 # Reset
-                
-
-    ##################################################################################################################
-    ### Run the model 
-    ##################################################################################################################
-    
-    # Preallocate here -- supposedly the most computationally efficient way to do this
-    alltransmatrices = zeros((npts, transmatrix.shape[0], transmatrix.shape[1], transmatrix.shape[2]))
-    alltransmatrices[:] = transmatrix
-    
-    for t in range(startind, npts): # Loop over time
-        printv('Timestep %i of %i' % (t+1, npts), 4, verbose)
-        
-        ###############################################################################
-        ## Initial steps
-        ###############################################################################
-
-        ## Pull out the transitions for this timestep
-        thistransit = alltransmatrices[t]
-        
-        ## Calculate "effective" HIV prevalence -- taking diagnosis and treatment into account
-        allpeople[:,t] = people[:, :, t].sum(axis=0)
-        if debug and not( all(allpeople[:,t]>0)):
-            errormsg = label + 'No people in populations %s at timestep %i (time %0.1f)' % (findinds(allpeople[:,t]<=0), t, tvec[t])
-            if die: raise OptimaException(errormsg)
-            else: printv(errormsg, 1, verbose)
-                
-        effallprev = einsum('i,ij->ij',alltrans,people[:,:,t]) / allpeople[:,t]                            
-        if debug and not((effallprev[:,:]>=0).all()): 
-            errormsg = label + 'HIV prevalence invalid at time %s' % (t)
-            if die: raise OptimaException(errormsg)
-            else:   printv(errormsg, 1, verbose)
-            effallprev = minimum(effallprev,eps)
+                this['cond'] = 1.0 - condkey*effcondom
+                this['pop1'] = popkeys.index(key[0])
+                this['pop2'] = popkeys.index(key[1])
+                if     male[this['pop1']] and   male[this['pop2']]: this['trans'] = (simpars['transmmi'] + simpars['transmmr'])/2.0 
+                elif   male[this['pop1']] and female[this['pop2']]: this['trans'] = simpars['transmfi']  
+                elif female[this['pop1']] and   male[this['pop2']]: this['trans'] = simpars['transmfr']
+                else:
+                    errormsg = label + 'Not able to figure out the sex of "%s" and "%s"' % (key[0], key[1])
+                    printv(errormsg, 3, verbose)
+                    this['trans'] = (simpars['transmmi'] + simpars['transmmr'] + simpars['transmfi'] + simpars['transmfr'])/4.0 # May as well just assume all transmissions apply equally - will undersestimate if pop is predominantly biologically male and oversestimate if pop is predominantly biologically female                     
+                        
+                sexactslist.append(this)
                 
-        ## Calculate inhomogeneity in the force-of-infection based on prevalence
-        thisprev = people[allplhiv,:,t].sum(axis=0) / allpeople[:,t] 
-        inhomo = (inhomopar+eps) / (exp(inhomopar+eps)-1) * exp(inhomopar*(1-thisprev)) # Don't shift the mean, but make it maybe nonlinear based on prevalence
-        
-
-        ###############################################################################
-        ## Calculate probability of getting infected
-        ###############################################################################
-        
-        # Probability of getting infected. In the first stage of construction, we actually store this as the probability of NOT getting infected
-        # First dimension: infection acquired by (circumcision status). Second dimension:  infection acquired by (pop). Third dimension: infection caused by (pop). Fourth dimension: infection caused by (health/treatment state)
-        forceinffull = ones((len(sus), npops, nstates, npops))
-
-        # Loop over all acts (partnership pairs) -- probability of pop1 getting infected by pop2
-        for pop1,pop2,wholeacts,fracacts,cond,thistrans in sexactslist:
-
-            thisforceinfsex = (1-fracacts[t]*thistrans*cond[t]*einsum('a,b',alleff[pop1,t,:],effallprev[:,pop2]))
-            if wholeacts[t]: thisforceinfsex  *= npow((1-thistrans*cond[t]*einsum('a,b',alleff[pop1,t,:],effallprev[:,pop2])), int(wholeacts[t]))
-            forceinffull[:,pop1,:,pop2] *= thisforceinfsex 
-            
-            if debug and not((forceinffull[:,pop1,:,pop2]>=0).all()):
-                errormsg = label + 'Sexual force-of-infection is invalid between populations %s and %s, time %0.1f, FOI:\n%s)' % (popkeys[pop1], popkeys[pop2], tvec[t], forceinffull[:,pop1,:,pop2])
-                for var in ['thistrans', 'circeff[pop1,t]', 'prepeff[pop1,t]', 'stieff[pop1,t]', 'cond', 'wholeacts', 'fracacts', 'effallprev[:,pop2]']:
-                    errormsg += '\n%20s = %f' % (var, eval(var)) # Print out extra debugging information
-                raise OptimaException(errormsg)
-
-        # Injection-related infections -- probability of pop1 getting infected by pop2
-        for pop1,pop2,wholeacts,fracacts in injactslist:
-            
-            thisforceinfinj = 1-transinj*sharing[pop1,t]*osteff[t]*prepeff[pop1,t]*fracacts[t]*effallprev[:,pop2]
-            if wholeacts[t]: thisforceinfinj *= npow((1-transinj*sharing[pop1,t]*osteff[t]*prepeff[pop1,t]*effallprev[:,pop2]), int(wholeacts[t]))
-
-            for index in sus: # Assign the same probability of getting infected by injection to both circs and uncircs, as it doesn't matter
-                forceinffull[index,pop1,:,pop2] *= thisforceinfinj
+                # Error checking
+                for key in ['wholeacts', 'fracacts', 'cond']:
+                    if debug and not(all(this[key]>=0)):
+                        errormsg = label + 'Invalid sexual behavior parameter "%s": values are:\n%s' % (key, this[key])
+                        if die: raise OptimaException(errormsg)
+                        else:   printv(errormsg, 1, verbose)
+                        this[key][this[key]<0] = 0.0 # Reset values
+                            
+        # Injection
+        for key in simpars['actsinj']:
+            this = odict()
+            this['wholeacts'] = floor(dt*simpars['actsinj'][key])
+            this['fracacts'] = dt*simpars['actsinj'][key] - this['wholeacts']
             
-            if debug and not((forceinffull[:,pop1,:,pop2]>=0).all()):
-                errormsg = label + 'Injecting force-of-infection is invalid between populations %s and %s, time %0.1f, FOI:\n%s)' % (popkeys[pop1], popkeys[pop2], tvec[t], forceinffull[:,pop1,:,pop2])
-                for var in ['transinj', 'sharing[pop1,t]', 'wholeacts', 'fracacts', 'osteff[t]', 'effallprev[:,pop2]']:
-                    errormsg += '\n%20s = %f' % (var, eval(var)) # Print out extra debugging information
-                raise OptimaException(errormsg)
+            this['pop1'] = popkeys.index(key[0])
+            this['pop2'] = popkeys.index(key[1])
+            injactslist.append(this)
         
-        # Probability of getting infected is one minus forceinffull times any scaling factors
-        forceinffull  = einsum('ijkl,j,j,j->ijkl', 1.-forceinffull, force, inhomo,(1.-background[:,t]))
-        infections_to = forceinffull.sum(axis=(2,3)) # Infections acquired through sex and injecting - by population who gets infected
-        infections_to = minimum(infections_to, 1.0-eps-background[:,t].max()) # Make sure it never exceeds the limit
-
-        # Add these transition probabilities to the main array
-        si = susreg[0] # susreg is a single element, but needs an index since can't index a list with an array
-        pi = progcirc[0] # as above 
-        ui = undx[0]
-        thistransit[si,si,:] *= (1.-background[:,t]) - infections_to[si] # Index for moving from sus to sus
-        thistransit[si,ui,:] *= infections_to[si] # Index for moving from sus to infection
-        thistransit[pi,pi,:] *= (1.-background[:,t]) - infections_to[pi] # Index for moving from circ to circ
-        thistransit[pi,ui,:] *= infections_to[pi] # Index for moving from circ to infection
-
-        # Calculate infections acquired and transmitted
-        raw_inci[:,t]       = einsum('ij,ijkl->j', people[sus,:,t], forceinffull)/dt
-        raw_incibypop[:,t]  = einsum('ij,ijkl->l', people[sus,:,t], forceinffull)/dt
-
-            
-        ##############################################################################################################
-        ### Calculate deaths
-        ##############################################################################################################
-
-        # Adjust transition rates
-        thistransit[nsus:,:,:] *= (1.-background[:,t]) 
-
-        # Store deaths
-        raw_death[:,:,t]    = einsum('ij,ij->ij', people[:,:,t], deathprob)/dt
-        raw_otherdeath[:,t] = einsum('ij,j->j',   people[:,:,t], background[:,t])/dt
-
-
-        ##############################################################################################################
-        ### Calculate probabilities of shifting along cascade (if programmatically determined)
-        ##############################################################################################################
-
-        def userate(prop,t):
-            if   t==0:             return True # Never force a proportion on the first timestep
-            elif isnan(prop[t-1]): return True # The previous timestep had a rate, so keep the rate here
-            else:                  return False # Neither: use a proportion instead of a rate
+        return sexactslist, injactslist
+    
+    # Split partnerships into layers with unique population pairs, preserving the order they were defined in
+    def makelayers(actslist):
+        counts = odict()
+        layers = []
+        for i,this in enumerate(actslist):
+            pair = (this['pop1'], this['pop2'])
+            layer = counts.get(pair, 0)
+            counts[pair] = layer+1
+            if layer==len(layers): layers.append([])
+            layers[layer].append(i)
+        return [array(layer, dtype=int) for layer in layers]
+    
+    # Convert from lists of dicts to arrays -- one row per partnership, stacked across simulations
+    actslists = [makeactslists(thissimpars) for thissimpars in simparslist]
+    sexactslist, injactslist = actslists[0] # The partnerships themselves are the same for every simulation
+    foi = odict()
+    foi['sexpop1']  = array([this['pop1'] for this in sexactslist], dtype=int)
+    foi['sexpop2']  = array([this['pop2'] for this in sexactslist], dtype=int)
+    foi['sexwhole'] = array([[this['wholeacts'] for this in sexacts] for sexacts,injacts in actslists])
+    foi['sexfrac']  = array([[this['fracacts'] for this in sexacts] for sexacts,injacts in actslists])
+    foi['sexcond']  = array([[this['cond'] for this in sexacts] for sexacts,injacts in actslists])
+    foi['sextrans'] = array([[this['trans'] for this in sexacts] for sexacts,injacts in actslists], dtype=float)
+    foi['sexlayers'] = makelayers(sexactslist)
+    foi['injpop1']  = array([this['pop1'] for this in injactslist], dtype=int)
+    foi['injpop2']  = array([this['pop2'] for this in injactslist], dtype=int)
+    foi['injwhole'] = array([[this['wholeacts'] for this in injacts] for sexacts,injacts in actslists])
+    foi['injfrac']  = array([[this['fracacts'] for this in injacts] for sexacts,injacts in actslists])
+    foi['injlayers'] = makelayers(injactslist)
+    foi['popkeys']  = popkeys
+    foi['npops']    = len(popkeys)
+    foi['nsims']    = len(simparslist)
+    return foi
 
-        # Undiagnosed to diagnosed
-        if userate(propdx,t): # Need to project forward one year to avoid mismatch
-            dxprob = [hivtest[:,t]]*ncd4
-            for cd4 in range(aidsind, ncd4): dxprob[cd4] = maximum(aidstest[t],hivtest[:,t])
-        else: dxprob = zeros(ncd4)
-        
-        for cd4, fromstate in enumerate(undx):
-            for tostate in fromto[fromstate]:
-                if tostate in undx: # Probability of not being tested
-                    thistransit[fromstate,tostate,:] *= (1.-dxprob[cd4])
-                else: # Probability of being tested
-                    thistransit[fromstate,tostate,:] *= dxprob[cd4]
-                    raw_diag[:,t] += people[fromstate,:,t]*thistransit[fromstate,tostate,:]/dt
 
-        # Diagnosed/lost to care
-        if userate(propcare,t):
-            careprob = [linktocare[:,t]]*ncd4
-            for cd4 in range(aidsind, ncd4): careprob[cd4] = maximum(aidslinktocare[t],linktocare[:,t])
-        else: careprob = zeros(ncd4)
-        for cd4ind, fromstate in enumerate(dxnotincare):  # 2 categories x 6 states per category = 12 states
-            cd4 = cd4ind%ncd4 # Convert from state index to actual CD4 index
-            for tostate in fromto[fromstate]:
-                if tostate in dxnotincare: # Probability of not moving into care
-                    thistransit[fromstate,tostate,:] *= (1.-careprob[cd4])
-                else: # Probability of moving into care
-                    thistransit[fromstate,tostate,:] *= careprob[cd4]
 
-        # Care/USVL/SVL to lost
-        if userate(propcare,t):
-            lossprob = [leavecare[:,t]]*ncd4 
-            for cd4 in range(aidsind, ncd4): lossprob[cd4] = minimum(aidsleavecare[t],leavecare[:,t])
-        else: lossprob = zeros(ncd4)
-        for cd4ind, fromstate in enumerate(allcare): # 3 categories x 6 states per category = 18 states
-            cd4 = cd4ind%ncd4 # Convert from state index to actual CD4 index
-            for tostate in fromto[fromstate]:
-                if tostate in allcare: # Probability of not being lost and remaining in care
-                    thistransit[fromstate,tostate,:] *= (1.-lossprob[cd4])
-                else: # Probability of being lost
-                    thistransit[fromstate,tostate,:] *= lossprob[cd4]
+def calcforceinf(foi=None, t=None, alleff=None, effallprev=None, transinj=None, sharing=None, osteff=None, prepeff=None, nsus=None, label=None, debug=False):
+    '''
+    Calculate the probability of NOT getting infected for a single timestep, using the arrays precomputed by
+    makeforceinf(). All inputs have a leading simulation axis, e.g. effallprev has shape (nsims, nstates, npops).
+    The output has the dimensions:
+        simulation x infection acquired by (circumcision status) x infection acquired by (pop) x infection caused by (health/treatment state) x infection caused by (pop)
     
-        # SVL to USVL
-        usvlprob = treatfail[t] if userate(propsupp,t) else 0.
-        for fromstate in svl:
-            for tostate in fromto[fromstate]:
-                if tostate in svl: # Probability of remaining suppressed
-                    thistransit[fromstate,tostate,:] *= (1.-usvlprob)
-                elif tostate in usvl: # Probability of becoming unsuppressed
-                    thistransit[fromstate,tostate,:] *= usvlprob
-        
-        # USVL to SVL
-        svlprob = min(regainvs[t]*numvlmon[t]/(eps+people[alltx,:,t].sum()*requiredvl),1) if userate(propsupp,t) else 0.
-        for fromstate in usvl:
-            for tostate in fromto[fromstate]:
-                if tostate in usvl: # Probability of not receiving a VL test & thus remaining failed
-                    thistransit[fromstate,tostate,:] *= (1.-svlprob)
-                elif tostate in svl: # Probability of receiving a VL test, switching to a new regime & becoming suppressed
-                    thistransit[fromstate,tostate,:] *= svlprob
+    Version: 2026oct18
+    '''
+    if label is None: label = ''
+    npops = foi['npops']
+    nsims, nstates = effallprev.shape[:2]
+    forceinffull = ones((nsims, nsus, npops, nstates, npops))
+    
+    # Sexual partnerships -- probability of pop1 getting infected by pop2. Intermediate arrays have partnerships first, then simulations
+    if len(foi['sexpop1']):
+        pop1, pop2 = foi['sexpop1'], foi['sexpop2']
+        transcond = (foi['sextrans']*foi['sexcond'][:,:,t]).T
+        effprod = einsum('kia,kbi->ikab', alleff[:,:,t,:][:,pop1,:], effallprev[:,:,pop2]) # Shape: partnerships x simulations x circumcision status x health state
+        wholeacts = foi['sexwhole'][:,:,t].T
+        thisforceinfsex = 1-(foi['sexfrac'][:,:,t]*foi['sextrans']*foi['sexcond'][:,:,t]).T[:,:,None,None]*effprod
+        if wholeacts.any(): thisforceinfsex *= npow(1-transcond[:,:,None,None]*effprod, wholeacts[:,:,None,None])
+        for layer in foi['sexlayers']:
+            forceinffull[:,:,pop1[layer],:,pop2[layer]] *= thisforceinfsex[layer]
         
-        # Check that probabilities all sum to 1
-        if debug:
-            transtest = array([(abs(thistransit[j,:,:].sum(axis=0)/(1.-background[:,t])+deathprob[j]-ones(npops))>eps).any() for j in range(nstates)])
-            if any(transtest):
-                wrongstatesindices = findinds(transtest)
-                wrongstates = [settings.statelabels[j] for j in wrongstatesindices]
-                wrongprobs = array([thistransit[j,:,:].sum(axis=0)/(1.-background[:,t])+deathprob[j] for j in wrongstatesindices])
-                errormsg = label + 'Transitions do not sum to 1 at time t=%f for states %s: sums are \n%s' % (tvec[t], wrongstates, wrongprobs)
-                raise OptimaException(errormsg)
-                
-        # Check that no probabilities are less than 0
-        if debug and any([(thistransit[k]<0).any() for k in range(nstates)]):
-            wrongstatesindices = [k for k in range(nstates) if (thistransit[k]<0.).any()]
-            wrongstates = [settings.statelabels[j] for j in wrongstatesindices]
-            wrongprobs = array([thistransit[j][1] for j in wrongstatesindices])
-            errormsg = label + 'Transitions are less than 0 at time t=%f for states %s: sums are \n%s' % (tvec[t], wrongstates, wrongprobs)
+        if debug and not((thisforceinfsex>=0).all()):
+            i,k = [inds[0] for inds in findinds((thisforceinfsex<0).any(axis=(2,3)))]
+            errormsg = label + 'Sexual force-of-infection is invalid between populations %s and %s, time index %i, FOI:\n%s)' % (foi['popkeys'][pop1[i]], foi['popkeys'][pop2[i]], t, thisforceinfsex[i,k])
+            for var,val in [('trans',foi['sextrans'][k,i]), ('alleff',alleff[k,pop1[i],t,:]), ('cond',foi['sexcond'][k,i,t]), ('wholeacts',wholeacts[i,k]), ('fracacts',foi['sexfrac'][k,i,t]), ('effallprev',effallprev[k,:,pop2[i]])]:
+                errormsg += '\n%20s = %s' % (var, val) # Print out extra debugging information
             raise OptimaException(errormsg)
-            
-        ## Shift people as required
-        if t<npts-1:
-            for fromstate,tostates in enumerate(fromto):
-                people[tostates,:,t+1] += people[fromstate,:,t]*thistransit[fromstate,tostates,:]
-
-
-        ##############################################################################################################
-        ### Calculate births
-        ##############################################################################################################
-
-        # Precalculate proportion on PMTCT, whether numpmtct or proppmtct is used
-        numhivpospregwomen = 0 # Initialize
-        timestepsonpmtct = 1./dt # Specify the number of timesteps on which mothers are on PMTCT -- # WARNING: remove hard-coding
-        fsums = dict() # Has to be a dict rather than an odict since the populations are numeric
-        for p1 in motherpops: # Pull these out of the loop to speed computation
-            fsumpop = people[:, p1, t] # Pull out the people who will be summed
-            fsums[p1] = dict() # Use another dict, since only referring to by key
-            fsums[p1]['all']       = fsumpop[:].sum()
-            fsums[p1]['allplhiv']  = fsumpop[allplhiv].sum()
-            fsums[p1]['undx']      = fsumpop[undx].sum()
-            fsums[p1]['alldx']     = fsumpop[alldx].sum()
-            fsums[p1]['alltx']     = fsumpop[alltx].sum()
-        for p1,p2,birthrates,alleligbirthrate in birthslist: # p1 is mothers, p2 is children
-            numhivpospregwomen += birthrates[t] * fsums[p1]['alldx'] * timestepsonpmtct # Divide by dt to get number of women
-        if isnan(proppmtct[t]): calcproppmtct = numpmtct[t]/(eps+numhivpospregwomen) # Proportion on PMTCT is not specified: use number
-        else:                   calcproppmtct = proppmtct[t] # Else, just use the proportion specified
-        calcproppmtct = min(calcproppmtct, 1.)
-        
-        undxhivbirths = zeros(npops) # Store undiagnosed HIV+ births for this timestep
-        dxhivbirths = zeros(npops) # Store diagnosed HIV+ births for this timestep
+    
+    # Injection-related infections -- probability of pop1 getting infected by pop2
+    if len(foi['injpop1']):
+        pop1, pop2 = foi['injpop1'], foi['injpop2']
+        injscale = (transinj[:,None]*sharing[:,:,t][:,pop1]*osteff[:,t,None]*prepeff[:,:,t][:,pop1]).T
+        thisprev = effallprev[:,:,pop2].transpose(2,0,1) # Shape: partnerships x simulations x health state
+        wholeacts = foi['injwhole'][:,:,t].T
+        thisforceinfinj = 1-(injscale*foi['injfrac'][:,:,t].T)[:,:,None]*thisprev
+        if wholeacts.any(): thisforceinfinj *= npow(1-injscale[:,:,None]*thisprev, wholeacts[:,:,None])
+        for layer in foi['injlayers']:
+            for index in range(nsus): # Assign the same probability of getting infected by injection to both circs and uncircs, as it doesn't matter
+                forceinffull[:,index,pop1[layer],:,pop2[layer]] *= thisforceinfinj[layer]
         
-        # Calculate actual births, MTCT, and PMTCT
-        for p1,p2,birthrates,alleligbirthrate in birthslist:
-            thisbirthrate = birthrates[t]
-            popbirths      = thisbirthrate * fsums[p1]['all']
-            mtctundx       = thisbirthrate * fsums[p1]['undx'] * effmtct[t] # Births to undiagnosed mothers
-            mtcttx         = thisbirthrate * fsums[p1]['alltx'] * pmtcteff[t] # Births to mothers on treatment
-            thiseligbirths = thisbirthrate * fsums[p1]['alldx'] # Births to diagnosed mothers eligible for PMTCT
-
-            mtctdx = (thiseligbirths * (1-calcproppmtct)) * effmtct[t] # MTCT from those diagnosed not receiving PMTCT
-            mtctpmtct = (thiseligbirths * calcproppmtct) * pmtcteff[t] # MTCT from those receiving PMTCT
-            thisreceivepmtct = thiseligbirths * calcproppmtct
-            thispopmtct = mtctundx + mtctdx + mtcttx + mtctpmtct # Total MTCT, adding up all components         
-
-            undxhivbirths[p2] += mtctundx                       # Births to add to undx  
-            dxhivbirths[p2]   += (mtctdx + mtcttx + mtctpmtct)   # Births add to dx
-            
-            raw_receivepmtct[p1, t] += thisreceivepmtct * timestepsonpmtct
-            raw_mtct[p2, t] += thispopmtct/dt
-            raw_mtctfrom[p1, t] += thispopmtct/dt
-            raw_births[p2, t] += popbirths/dt
-            raw_hivbirths[p1, t] += thisbirthrate * fsums[p1]['allplhiv'] / dt
-            
-        raw_inci[:,t] += raw_mtct[:,t] # Update infections acquired based on PMTCT calculation
-        raw_incibypop[:,t] += raw_mtctfrom[:,t] # Update infections caused based on PMTCT calculation
-
-        if debug and abs(raw_inci[:,t].sum() - raw_incibypop[:,t].sum()) > eps:
-            errormsg = label + 'Number of infections received (%f) is not equal to the number of infections caused (%f) at time %i' % (raw_inci[:,t].sum(), raw_incibypop[:,t].sum(), t)
-            if die: raise OptimaException(errormsg)
-            else: printv(errormsg, 1, verbose)
-
-        ###############################################################################
-        ## Shift numbers of people (circs, treatment, age transitions, risk transitions, prop scenarios)
-        ###############################################################################
-        if t<npts-1:
-            
-            ## Births 
-            people[susreg, :, t+1] += raw_births[:,t]*dt - undxhivbirths - dxhivbirths # HIV- babies assigned to uncircumcised compartment
-            people[undx[0], :, t+1] += undxhivbirths # HIV+ babies born to undiagnosed mothers assigned to undiagnosed compartment 
-            people[dx[0], :, t+1]   += dxhivbirths   # HIV+ babies born to diagnosed mothers assigned to diagnosed compartment
-
-            ## Circumcision 
-            circppl = minimum(numcirc[:,t+1], people[susreg,:,t+1])
-            people[susreg,:,t+1]   -= circppl
-            people[progcirc,:,t+1] += circppl 
-
-
-            ## Age-related transitions
-            for p1,p2,thisagetransprob in agetransitlist:
-                peopleleaving = people[:, p1, t+1] * thisagetransprob
-                if debug and (peopleleaving > people[:, p1, t+1]).any():
-                    errormsg = label + 'Age transitions between pops %s and %s at time %i are too high: the age transitions you specified say that %f%% of the population should age in a single time-step.' % (popkeys[p1], popkeys[p2], t+1, agetransit[p1, p2]*100.)
-                    if die: raise OptimaException(errormsg)
-                    else:   printv(errormsg, 1, verbose)
-                    peopleleaving = minimum(peopleleaving, people[:, p1, t]) # Ensure positive  
-                        
-                                           
-                people[:, p1, t+1] -= peopleleaving # Take away from pop1...
-                people[:, p2, t+1] += peopleleaving # ... then add to pop2
-
-
-            ## Risk-related transitions
-            for p1,p2,thisrisktransprob in risktransitlist:
-                peoplemoving1 = people[:, p1, t+1] * thisrisktransprob  # Number of other people who are moving pop1 -> pop2
-                peoplemoving2 = people[:, p2, t+1] * thisrisktransprob * (sum(people[:, p1, t+1])/sum(people[:, p2, t+1])) # Number of people who moving pop2 -> pop1, correcting for population size
-                # Symmetric flow in totality, but the state distribution will ideally change.                
-                people[:, p1, t+1] += peoplemoving2 - peoplemoving1 # NOTE: this should not cause negative people; peoplemoving1 is guaranteed to be strictly greater than 0 and strictly less that people[:, p1, t+1]
-                people[:, p2, t+1] += peoplemoving1 - peoplemoving2 # NOTE: this should not cause negative people; peoplemoving2 is guaranteed to be strictly greater than 0 and strictly less that people[:, p2, t+1]
-            
+        if debug and not((thisforceinfinj>=0).all()):
+            i,k = [inds[0] for inds in findinds((thisforceinfinj<0).any(axis=2))]
+            errormsg = label + 'Injecting force-of-infection is invalid between populations %s and %s, time index %i, FOI:\n%s)' % (foi['popkeys'][pop1[i]], foi['popkeys'][pop2[i]], t, thisforceinfinj[i,k])
+            for var,val in [('transinj',transinj[k]), ('sharing',sharing[k,pop1[i],t]), ('wholeacts',wholeacts[i,k]), ('fracacts',foi['injfrac'][k,i,t]), ('osteff',osteff[k,t]), ('effallprev',effallprev[k,:,pop2[i]])]:
+                errormsg += '\n%20s = %s' % (var, val) # Print out extra debugging information
+            raise OptimaException(errormsg)
+    
+    return forceinffull
 
-            ###############################################################################
-            ## Reconcile population sizes
-            ###############################################################################
-            
-            # Reconcile population sizes for populations with no inflows
-            thissusreg = people[susreg,noinflows,t+1] # WARNING, will break if susreg is not a scalar index!
-            thisprogcirc = people[progcirc,noinflows,t+1]
-            allsus = thissusreg+thisprogcirc
-            if debug and not all(allsus>0): 
-                errormsg = label + '100%% prevalence detected (t=%f, pop=%s)' % (t+1, array(popkeys)[findinds(allsus>0)][0])
-                raise OptimaException(errormsg)
-            newpeople = popsize[noinflows,t+1] - people[:,:,t+1][:,noinflows].sum(axis=0) # Number of people to add according to simpars['popsize'] (can be negative)
-            people[susreg,noinflows,t+1]   += newpeople*thissusreg/allsus # Add new people
-            people[progcirc,noinflows,t+1] += newpeople*thisprogcirc/allsus # Add new people
-            
-            # Check population sizes are correct
-            actualpeople = people[:,:,t+1][:,noinflows].sum()
-            wantedpeople = popsize[noinflows,t+1].sum()
-            if debug and abs(actualpeople-wantedpeople)>1.0: # Nearest person is fiiiiine
-                errormsg = label + 'Population size inconsistent at time t=%f: %f vs. %f' % (tvec[t+1], actualpeople, wantedpeople)
-                raise OptimaException(errormsg)
-            
-            # If required, scale population sizes to exactly match the parameters
-            if forcepopsize:
-                relerr = 0.1 # Set relative error tolerance
-                for p in range(npops):
-                    susnotonart = cat([sus,notonart])
-                    actualpeople = people[susnotonart,p,t+1].sum()
-                    wantedpeople = popsize[p,t+1] - people[alltx,p,t+1].sum()
-                    if actualpeople==0: raise Exception("ERROR: no people.")
-                    ratio = wantedpeople/actualpeople
-                    if abs(ratio-1)>relerr: # It's not OK
-                        errormsg = label + 'Warning, expected population size is nowhere near calculated population size (t=%f, pop=%s, wanted=%f, actual=%f, ratio=%f)' % (t, popkeys[p], wantedpeople, actualpeople, ratio)
-                        if die: raise OptimaException(errormsg)
-                        else: printv(errormsg, 1, verbose=verbose)
-                    people[susnotonart,p,t+1] *= ratio # It's OK, so scale to match
-            
 
-            #######################################################################################
-            ## Proportions -- these happen after the Euler step, which is why it's t+1 instead of t
-            #######################################################################################
 
-            for name,proplist in propstruct.items():
-                prop, lowerstate, tostate, numer, denom, raw_new, fixyear = proplist
 
-                calcprop = people[numer,:,t].sum()/(eps+people[denom,:,t].sum()) # This is the value we fix it at
-                if fixyear==t: # Fixing the proportion from this timepoint
-                    naninds    = findinds(isnan(prop)) # Find the indices that are nan -- to be replaced by current values
-                    infinds    = findinds(isinf(prop)) # Find indices that are infinite -- to be scaled up/down to a target value
-                    finiteinds = findinds(isfinite(prop)) # Find indices that are defined
-                    finiteind = npts-1 if not len(finiteinds) else finiteinds[0] # Get first finite index, or else just last point -- latter should not actually matter
-                    naninds = naninds[naninds>t] # Trim ones that are less than the current point
-                    infinds = infinds[infinds>t] # Trim ones that are less than the current point
-                    ninterppts = len(infinds) # Number of points to interpolate over
-                    if len(naninds): prop[naninds] = calcprop # Replace nans with current proportion
-                    if len(infinds): prop[infinds] = interp(range(ninterppts), [0,ninterppts-1], [calcprop,prop[finiteind]]) # Replace infinities with scale-up/down
-                
-                # Figure out how many people we currently have...
-                actual    = people[numer,:,t+1].sum() # ... in the higher cascade state
-                available = people[denom,:,t+1].sum() # ... waiting to move up
-                
-                # Move the people who started treatment last timestep from usvl to svl
-                if ~isfinite(prop[t+1]):
-                    if name == 'proptx': wanted = numtx[t+1] # If proptx is nan, we use numtx
-                    else:                wanted = None # If a proportion or number isn't specified, skip this
-                else: # If the prop value is finite, we use it
-                    wanted = prop[t+1]*available
-                
-                # Reconcile the differences between the number we have and the number we want
-                if wanted is not None:
-                    diff = wanted - actual # Wanted number minus actual number 
-                    if diff>eps: # We need to move people forwards along the cascade 
-                        ppltomoveup = people[lowerstate,:,t+1]
-                        totalppltomoveup = ppltomoveup.sum()
-                        if totalppltomoveup>eps:
-                            diff = min(diff, totalppltomoveup-eps) # Make sure we don't move more people than are available
-                            if name == 'proptx': # For treatment, we move people in lower CD4 states first
-                                if treatbycd4:
-                                    tmpdiff = diff
-                                    newmovers = zeros((ncd4,npops))
-                                    for cd4 in reversed(range(ncd4)): # Going backwards so that lower CD4 counts move up the cascade first
-                                        if tmpdiff>eps: # Move people until you have the right proportions
-                                            ppltomoveupcd4 = ppltomoveup[cd4,:]
-                                            totalppltomoveupcd4 = ppltomoveupcd4.sum()
-                                            if totalppltomoveupcd4>eps:
-                                                tmpdiffcd4 = min(tmpdiff, totalppltomoveupcd4-eps)
-                                                newmovers[cd4,:] = tmpdiffcd4*ppltomoveupcd4/totalppltomoveupcd4 # Pull out evenly from each population
-                                                tmpdiff -= newmovers[cd4,:].sum() # Adjust the number of available spots
-                                else:
-                                    newmovers = diff*ppltomoveup/totalppltomoveup
-                                # Need to handle USVL and SVL separately
-                                people[care,:,t+1] -= newmovers # Shift people out of care
-                                people[usvl,:,t+1]  += newmovers*(1.0-treatvs) # ... and onto treatment, according to existing proportions
-                                people[svl,:,t+1]   += newmovers*treatvs # Likewise for SVL
-                            else: # For everything else, we use a distribution based on the distribution of people waiting to move up the cascade
-                                newmovers = diff*ppltomoveup/totalppltomoveup
-                                people[lowerstate,:,t+1] -= newmovers # Shift people out of the less progressed state... 
-                                people[tostate,:,t+1]    += newmovers # ... and into the more progressed state
-                            raw_new[:,t+1]               += newmovers.sum(axis=0)/dt # Save new movers
-                    elif diff<-eps: # We need to move people backwards along the cascade
-                        ppltomovedown = people[tostate,:,t+1]
-                        totalppltomovedown = ppltomovedown.sum()
-                        if totalppltomovedown>eps: # To avoid having to add eps
-                            diff = min(-diff, totalppltomovedown-eps) # Flip it around so we have positive people
-                            newmovers = diff*ppltomovedown/totalppltomovedown
-                            if name == 'proptx': # Handle SVL and USVL separately
-                                newmoversusvl = newmovers[:ncd4,:] # First group of movers are from USVL
-                                newmoverssvl  = newmovers[ncd4:,:] # Second group is SVL
-                                people[usvl,:,t+1] -= newmoversusvl # Shift people out of USVL treatment
-                                people[svl,:,t+1]  -= newmoverssvl  # Shift people out of SVL treatment
-                                people[care,:,t+1] += newmoversusvl+newmoverssvl # Add both groups of movers into care
-                            else:
-                                people[tostate,:,t+1]    -= newmovers # Shift people out of the more progressed state... 
-                                people[lowerstate,:,t+1] += newmovers # ... and into the less progressed state
-                            raw_new[:,t+1]               -= newmovers.sum(axis=0)/dt # Save new movers, inverting again
-            if debug: checkfornegativepeople(people, tind=t+1) # If ebugging, check for negative people on every timestep
-        
-    raw                 = odict()    # Sim output structure
-    raw['tvec']         = tvec
-    raw['popkeys']      = popkeys
-    raw['people']       = people
-    raw['inci']         = raw_inci
-    raw['incibypop']    = raw_incibypop
-    raw['mtct']         = raw_mtct
-    raw['births']       = raw_births
-    raw['hivbirths']    = raw_hivbirths
-    raw['pmtct']        = raw_receivepmtct
-    raw['diag']         = raw_diag
-    raw['newtreat']     = raw_newtreat
-    raw['death']        = raw_death
-    raw['otherdeath']   = raw_otherdeath
+def maketransitions(fromto=None, transmatrix=None, settings=None):
+    '''
+    Compile the state graph into a sparse list of edges, one for each (fromstate, tostate) pair in fromto, so
+    that the model only has to store and rescale the transitions that can actually happen, rather than the full
+    nstates x nstates x npops matrix on every timestep. Edges are stored in the order of fromto. The output
+    contains:
+        from, to: the states at either end of each edge
+        prob: the time-constant transition probabilities for each edge, of shape (nedges, npops) -- or
+              (nsims, nedges, npops) if transmatrix is stacked across simulations
+        layers: groups of edges such that each tostate appears at most once per group, in the original order
+    plus the indices of the edges that get rescaled on each timestep (and the CD4 count of the fromstate, for
+    the cascade transitions).
     
-    checkfornegativepeople(people) # Check only once for negative people, right before finishing
+    Version: 2026oct18
+    '''
+    ncd4 = settings.ncd4
+    edgefrom, edgeto = [], []
+    for fromstate,tostates in enumerate(fromto):
+        for tostate in tostates:
+            edgefrom.append(fromstate)
+            edgeto.append(tostate)
+    edgeinds = odict([((fromstate,tostate),e) for e,(fromstate,tostate) in enumerate(zip(edgefrom,edgeto))])
+    
+    def findedge(fromstate, tostate):
+        ''' Find the index of a single edge; use an empty index if it doesn't exist, so rescaling does nothing '''
+        return array([edgeinds[(fromstate,tostate)]] if (fromstate,tostate) in edgeinds else [], dtype=int)
+    
+    def cascadeedges(fromstates, stay, move=None):
+        ''' Split the edges leaving each fromstate into those that stay within the given states, and those that move to the others '''
+        stayinds, staycd4, moveinds, movecd4 = [], [], [], []
+        for cd4ind,fromstate in enumerate(fromstates):
+            for tostate in fromto[fromstate]:
+                e = edgeinds[(fromstate,tostate)]
+                if tostate in stay:
+                    stayinds.append(e)
+                    staycd4.append(cd4ind%ncd4) # Convert from state index to actual CD4 index
+                elif move is None or tostate in move:
+                    moveinds.append(e)
+                    movecd4.append(cd4ind%ncd4)
+        return [array(inds, dtype=int) for inds in [stayinds, staycd4, moveinds, movecd4]]
+    
+    trans = odict()
+    trans['from'] = array(edgefrom, dtype=int)
+    trans['to']   = array(edgeto, dtype=int)
+    trans['prob'] = transmatrix[..., trans['from'], trans['to'], :]
+    
+    # Group edges so each state receives at most one inflow per group
+    counts = zeros(settings.nstates, dtype=int)
+    layers = []
+    for e,tostate in enumerate(edgeto):
+        if counts[tostate]==len(layers): layers.append([])
+        layers[counts[tostate]].append(e)
+        counts[tostate] += 1
+    trans['layers'] = [array(layer, dtype=int) for layer in layers]
+    
+    # Edges for infection and background death
+    si, pi, ui = settings.susreg[0], settings.progcirc[0], settings.undx[0]
+    trans['sisi'] = findedge(si, si)
+    trans['siui'] = findedge(si, ui)
+    trans['pipi'] = findedge(pi, pi)
+    trans['piui'] = findedge(pi, ui)
+    trans['infected'] = findinds(trans['from']>=settings.nsus)
+    
+    # Edges along the cascade
+    for key,fromstates,stay,move in [('undx', settings.undx,        settings.undx,        None),
+                                     ('dx',   settings.dxnotincare, settings.dxnotincare, None),
+                                     ('care', settings.allcare,     settings.allcare,     None),
+                                     ('svl',  settings.svl,         settings.svl,         settings.usvl),
+                                     ('usvl', settings.usvl,        settings.usvl,        settings.svl)]:
+        trans[key+'stay'], trans[key+'staycd4'], trans[key+'move'], trans[key+'movecd4'] = cascadeedges(fromstates, stay, move)
     
-    return raw # Return raw results
\ No newline at end of file
+    return trans
@@ -4,19 +4,23 @@ Functions for running optimizations.
 Version: 2019dec02
 """
 
-from optima import OptimaException, Link, Multiresultset, ICER, asd, getresults # Main functions
-from optima import printv, dcp, odict, findinds, today, getdate, uuid, objrepr, promotetoarray, findnearest, sanitize, inclusiverange # Utilities
+from optima import OptimaException, Link, Multiresultset, ICER, asd, objdict, getresults, calcoutcomes # Main functions
+from optima import printv, dcp, odict, findinds, today, getdate, uuid, objrepr, promotetoarray, findnearest, inclusiverange # Utilities
 
-from numpy import zeros, ones, empty, arange, array, inf, isfinite, argmin, argsort, nan, floor, concatenate, exp, sqrt, logical_and
-from numpy.random import random, seed, randint
+from numpy import zeros, ones, arange, array, inf, isfinite, argmin, argsort, nan, floor, concatenate, exp, sqrt, logical_and, int64
+from numpy.random import random, seed, randint, get_state, set_state
 from time import time
+from collections import OrderedDict
 import optima as op # Used by minmoney, at some point should make syntax consistent
 
 # Import dependencies here so no biggie if they fail
-try:    from multiprocessing import Process, Queue
-except: Process, Queue = None, None # OK to skip these if batch is False
+try:    from multiprocessing import Process, Queue, Event
+except: Process, Queue, Event = None, None, None # OK to skip these if batch is False
+try:    from concurrent.futures import ProcessPoolExecutor, wait
+except: ProcessPoolExecutor, wait = None, None # OK to skip these if ncpus is not set
 
 import six
+from six.moves.queue import Empty
 if six.PY3:
     basestring = str
     unicode = str
@@ -74,6 +78,91 @@ class Optim(object):
 
 
 
+class Outcomecache(object):
+    '''
+    A least-recently-used cache of the objective values calculated by outcomecalc(), so a budget that has already
+    been evaluated -- e.g. an ASD step that constrainbudget() clamps back to a previous budget -- doesn't rerun the
+    model. Budgets are compared after constraining, to within a relative tolerance. When pickled (e.g. to send
+    back from a worker process), the statistics are kept but the stored values are not.
+    
+    Version: 2026oct18
+    '''
+
+    def __init__(self, maxsize=10000, tolerance=1e-9):
+        self.maxsize   = maxsize # Maximum number of objective values to store
+        self.tolerance = tolerance # Budgets are rounded to this fraction of the total budget
+        self.hits      = 0 # Number of evaluations found in the cache
+        self.misses    = 0 # Number of evaluations that had to be calculated
+        self.values    = OrderedDict() # The cached values, least recently used first
+
+
+    def __repr__(self):
+        ''' Print out useful information when called '''
+        output = 'Outcome cache: %i of %i values stored; %i hits, %i misses\n' % (len(self.values), self.maxsize, self.hits, self.misses)
+        return output
+
+
+    def __getstate__(self):
+        ''' Don't send the cached values between processes '''
+        state = dict(self.__dict__)
+        state['values'] = OrderedDict()
+        return state
+
+
+    def makekey(self, budget=None, *args):
+        ''' Make a key from a budget (an odict of floats or arrays) and any other hashable arguments the outcome depends on '''
+        budgetvec = concatenate([promotetoarray(val).ravel() for val in budget.values()]).astype(float)
+        scale = abs(budgetvec).sum() or 1.0
+        quantized = (budgetvec/(scale*self.tolerance)).round().astype(int64)
+        return (quantized.tobytes(),) + args
+
+
+    def objectiveskey(self, objectives=None):
+        ''' Make a hashable key from the objectives, skipping the labels (the only dicts) '''
+        key = tuple([(k, tuple(promotetoarray(v).tolist()) if isinstance(v, (list, tuple)) else v) for k,v in objectives.items() if not isinstance(v, dict)])
+        return key
+
+
+    def get(self, key=None):
+        ''' Return the stored value for this key, or None if it hasn't been calculated '''
+        value = self.values.pop(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.values[key] = value # Reinsert to mark as most recently used
+        return value
+
+
+    def set(self, key=None, value=None):
+        ''' Store a value, removing the least recently used one if the cache is full '''
+        self.values.pop(key, None)
+        self.values[key] = value
+        while len(self.values)>self.maxsize: self.values.popitem(last=False)
+        return None
+
+
+    def merge(self, other=None):
+        ''' Add the statistics from another cache, e.g. one used by a worker process '''
+        self.hits   += other.hits
+        self.misses += other.misses
+        return None
+
+
+    def new(self):
+        ''' Make an empty cache with the same settings, e.g. for a worker process '''
+        return Outcomecache(maxsize=self.maxsize, tolerance=self.tolerance)
+
+
+    def stats(self):
+        ''' Return the hit/miss statistics '''
+        total = self.hits + self.misses
+        output = odict([('hits',self.hits), ('misses',self.misses), ('hitrate',self.hits/float(total) if total else 0.0), ('size',len(self.values))])
+        return output
+
+
+
+
 
 ################################################################################################################################################
 ### Helper functions
@@ -376,8 +465,17 @@ def separatetv(inputvec=None, optiminds=None):
 def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progsetname=None, 
                 objectives=None, constraints=None, totalbudget=None, optiminds=None, origbudget=None, tvec=None, 
                 initpeople=None, outputresults=False, verbose=2, ccsample='best', doconstrainbudget=True, 
-                tvsettings=None, tvcontrolvec=None, origoutcomes=None, penalty=1e9, **kwargs):
-    ''' Function to evaluate the objective for a given budget vector (note, not time-varying) '''
+                tvsettings=None, tvcontrolvec=None, origoutcomes=None, penalty=1e9, checkpoint=None, cache=None, compiledprogset=None, **kwargs):
+    '''
+    Function to evaluate the objective for a given budget vector (note, not time-varying). If a checkpoint
+    from makecheckpoint() is supplied, the model is only run from the latest saved timestep whose parameters
+    match this budget's; the results are identical either way. Unless outputresults is True, only the outcomes
+    needed for the objective are calculated, without making a full Resultset, and if an Outcomecache is supplied,
+    budgets that have already been evaluated aren't run again. If a program set compiled with Programset.compile()
+    for these years is supplied, it's used to calculate the parameters from the budget, which is much faster. Like
+    the cache, it's taken to be made from the parset as it is now -- e.g. at the start of the optimization -- so its
+    parameters aren't compared with the parset's each time (see Compiledprogset.matches()).
+    '''
 
     # Set up defaults
     if which is None: 
@@ -432,21 +530,47 @@ def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progs
                 constrainedbudget = constrainbudget(origbudget=origbudget, budgetvec=budgetvec, totalbudget=totalbudget, budgetlims=constraints, optiminds=optiminds, outputtype='odict')
                 budgetarray.toeach(ind=y, val=constrainedbudget[:])
     
+    # Check whether this budget has already been evaluated
+    if cache is not None and not outputresults:
+        if origoutcomes: origkey = tuple(origoutcomes.rawoutcomes[:]) # The penalty depends on these
+        else:            origkey = None
+        cachekey = cache.makekey(budgetarray, which, parset.uid, progset.uid, cache.objectiveskey(objectives), tuple(promotetoarray(paryears)), ccsample, penalty, origkey)
+        output = cache.get(cachekey)
+        if output is not None: 
+            return output
+    
     # Get coverage and actual dictionary, in preparation for running
-    thiscoverage = progset.getprogcoverage(budget=budgetarray, t=paryears, parset=parset, sample=ccsample)
-    thisparsdict = progset.getpars(coverage=thiscoverage, t=paryears, parset=parset, sample=ccsample)
+    if compiledprogset is not None and compiledprogset.matches(t=paryears, parset=parset, progset=progset, sample=ccsample, checkpars=False):
+        thiscoverage = compiledprogset.getprogcoverage(budget=budgetarray)
+        thisparsdict = compiledprogset.getpars(coverage=thiscoverage)
+    else:
+        thiscoverage = progset.getprogcoverage(budget=budgetarray, t=paryears, parset=parset, sample=ccsample)
+        thisparsdict = progset.getpars(coverage=thiscoverage, t=paryears, parset=parset, sample=ccsample)
     
     # Figure out which indices to run for and actually run the model
     tvec       = project.settings.maketvec(end=objectives['end'])
-    initpeople = None # WARNING, unfortunately initpeople is still causing mismatches -- turning off for now despite the large (2.5x) performance penalty
+    initpeople = None # WARNING, initpeople causes mismatches since the parameters before the start year depend on the budget -- use checkpoint instead
     if initpeople is None: startind = None
     else:                  startind = findnearest(tvec, objectives['start']) # Only start running the simulation from the starting point
-    results = project.runsim(pars=thisparsdict, parsetname=parsetname, progsetname=progsetname, coverage=thiscoverage, budget=budgetarray, budgetyears=paryears, tvec=tvec, initpeople=initpeople, startind=startind, verbose=0, label=project.name+'-optim-outcomecalc', doround=False, addresult=False, **kwargs)
+    randstate = get_state() # Running the model draws a random seed (see Project.runsim()) that isn't used, since the parameters aren't sampled, so restore the state: then evaluating a budget never changes the random numbers the optimization uses, whether it's cached or not
+    try:
+        results = project.runsim(pars=thisparsdict, parsetname=parsetname, progsetname=progsetname, coverage=thiscoverage, budget=budgetarray, budgetyears=paryears, tvec=tvec, initpeople=initpeople, startind=startind, checkpoint=checkpoint, verbose=0, label=project.name+'-optim-outcomecalc', doround=False, addresult=False, rawonly=not(outputresults), **kwargs)
+    finally:
+        set_state(randstate)
+    
+    # Pull out the outcomes -- if the full results aren't needed, calculate just these from the raw output
+    outcomekeys = ['num'+key for key in objectives['keys']] + objectives['cascadekeys']
+    if outputresults:
+        outcometvec = results.tvec
+        main = odict([(key, results.main[key].tot[0]) for key in outcomekeys]) # 0 is since best
+    else:
+        outcometvec, main = calcoutcomes(raw=results[0], keys=outcomekeys, pars=thisparsdict, settings=project.settings)
+    dt = outcometvec[1] - outcometvec[0] # Annual, so the same as results.dt
 
     # Figure out which indices to use
-    initialind = findnearest(results.tvec, objectives['start'])
-    finalind   = findnearest(results.tvec, objectives['end'])
-    if which=='money': baseind = findnearest(results.tvec, objectives['base']) # Only used for money minimization
+    initialind = findnearest(outcometvec, objectives['start'])
+    finalind   = findnearest(outcometvec, objectives['end'])
+    if which=='money': baseind = findnearest(outcometvec, objectives['base']) # Only used for money minimization
     if which=='outcomes': indices = arange(initialind, finalind) # Only used for outcomes minimization
     
     ## Here, we split depending on whether it's a outcomes or money minimization:
@@ -458,9 +582,9 @@ def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progs
         # Calculate the outcome
         for key in objectives['keys']:
             thisweight = objectives[key+'weight'] # e.g. objectives['inciweight'] #CKCHANGE
-            thisoutcome = results.main['num'+key].tot[0][indices].sum() # The instantaneous outcome e.g. main['numdeath'] -- 0 is since best
-            rawoutcomes['num'+key] = thisoutcome*results.dt
-            outcome += thisoutcome*thisweight*results.dt # Calculate objective
+            thisoutcome = main['num'+key][indices].sum() # The instantaneous outcome e.g. main['numdeath']
+            rawoutcomes['num'+key] = thisoutcome*dt
+            outcome += thisoutcome*thisweight*dt # Calculate objective
             if origoutcomes and penalty and thisweight>0:
                 if rawoutcomes['num'+key]>origoutcomes.rawoutcomes['num'+key]:
                     outcome += penalty # Impose a large penalty if the solution is worse
@@ -468,7 +592,7 @@ def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progs
         # Include cascade values
         for key in objectives['cascadekeys']:
             thisweight = objectives[key] # e.g. objectives['proptreat']
-            thisoutcome = 1.0 - results.main[key].tot[0][-1] # e.g. main['proptreat'] -- 0 is since best, subtract from 1 to invert, use final value
+            thisoutcome = 1.0 - main[key][-1] # e.g. main['proptreat'] -- subtract from 1 to invert, use final value
             rawoutcomes[key] = thisoutcome
             outcome += thisoutcome*thisweight # Calculate objective
             if origoutcomes and penalty and thisweight>0:
@@ -504,7 +628,7 @@ def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progs
         target = odict()
         targetfrac = odict([(key,objectives[key+'frac']) for key in objectives['keys']]) # e.g. {'inci':objectives['incifrac']} = 0.4 = 40% reduction in incidence
         for key in objectives['keys']:
-            thisresult = results.main['num'+key].tot[0] # the instantaneous outcome e.g. objectives['numdeath'] -- 0 is since best #CKCHANGE
+            thisresult = main['num'+key] # the instantaneous outcome e.g. objectives['numdeath'] #CKCHANGE
             baseline[key] = float(thisresult[baseind])
             final[key] = float(thisresult[finalind])
             if targetfrac[key] is not None:
@@ -514,7 +638,7 @@ def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progs
         
         targetprops = odict([(key,objectives[key]) for key in objectives['cascadekeys']])
         for key in objectives['cascadekeys']:
-            thisresult = 1 - results.main[key].tot[0] # the instantaneous outcome e.g. objectives['numdeath'] -- 0 is since best #CKCHANGE
+            thisresult = 1 - main[key] # the instantaneous outcome e.g. objectives['numdeath'] #CKCHANGE
             final[key] = float(thisresult[finalind])
             if objectives[key] is not None:
                 target[key] = 1 - objectives[key]
@@ -534,10 +658,191 @@ def outcomecalc(budgetvec=None, which=None, project=None, parsetname=None, progs
             summary = 'Baseline: %0.0f %0.0f %0.0f | Target: %0.0f %0.0f %0.0f | Final: %0.0f %0.0f %0.0f' % tuple(baseline.values()+target.values()+final.values())
             output = (targetsmet, summary)
     
+    if cache is not None and not outputresults: cache.set(cachekey, output)
+    
+    return output
+
+
+
+def makecheckpoint(budgetvec=None, objectives=None, nyears=2, **kwargs):
+    '''
+    Run outcomecalc() for a budget, saving model checkpoints at the start year of the optimization and each of
+    the nyears years before it. Pass the output to outcomecalc() as the checkpoint argument to skip rerunning
+    the years before the start for other budgets. Since the program parameters are smoothed, a budget change
+    usually changes the parameters slightly before the start year, so the checkpoint used is typically from
+    the year before. Like any run of outcomecalc(), it leaves the random number state unchanged.
+    
+    Version: 2026oct18
+    '''
+    for key in ['outputresults', 'keepraw', 'checkpoint', 'savecheckpoints']: kwargs.pop(key, None) # These are set here
+    tvec = kwargs['project'].settings.maketvec(end=objectives['end']) # Same as in outcomecalc()
+    saveinds = sorted(set([findnearest(tvec, objectives['start']-year) for year in range(nyears+1)]))
+    results = outcomecalc(budgetvec, objectives=objectives, outputresults=True, keepraw=True, savecheckpoints=saveinds, **kwargs)
+    return results.raw[0]['checkpoints']
+
+
+
+## Worker processes for running optimizations in parallel -- tasks have to be standalone functions, see batchtools.py
+poolproject   = None # The project used by tasks in a worker process, set by initpool_task()
+poolstopevent = None # Set by the main process to stop ASD runs in progress
+
+def initpool_task(project=None, stopevent=None):
+    ''' Store the project once per worker process, rather than sending it with every task; it is treated as read-only '''
+    global poolproject, poolstopevent
+    poolproject   = project
+    poolstopevent = stopevent
+    return None
+
+
+def outcomecalc_task(budgetvec=None, kwargs=None):
+    ''' Run outcomecalc() in a worker process '''
+    output = outcomecalc(budgetvec, **dict(kwargs, project=poolproject))
+    if kwargs.get('outputresults'): output.projectref = Link() # Don't send the project back with the results -- restored by the main process
     return output
 
 
+def asd_task(budgetvec=None, args=None, kwargs=None):
+    ''' Run one optimization in a worker process, as in the loop over starting budgets in minoutcomes() '''
+    args = dict(args, project=poolproject)
+    args['origoutcomes'] = outcomecalc(outputresults=True, **args) # Calculate the initial outcome and pass it back in
+    res = asd(outcomecalc, budgetvec, args=args, stoppingfunc=poolstopevent.is_set, **kwargs)
+    return (res.x, res.details.fvals, args['cache']) # The cache is sent back with its statistics but not its values
+
+
+def makepool(project=None, ncpus=None):
+    '''
+    Create a pool of ncpus worker processes for running the parts of an optimization that are independent of each
+    other. Each worker gets a copy of the project when it starts. Use waitforpool() to get the outputs of tasks,
+    and closepool() when done.
+    
+    Version: 2026oct18
+    '''
+    if ProcessPoolExecutor is None or Event is None:
+        raise OptimaException('Running an optimization in parallel requires the concurrent.futures and multiprocessing modules')
+    stopevent = Event()
+    pool = ProcessPoolExecutor(max_workers=ncpus, initializer=initpool_task, initargs=(project, stopevent))
+    pool.stopevent = stopevent # Store with the pool, so the main process can stop the tasks
+    return pool
+
+
+def waitforpool(pool=None, futures=None, stoppingfunc=None, interval=1.0):
+    '''
+    Wait for tasks submitted to a pool from makepool() to finish, and return their outputs in order. The stopping
+    function is checked every interval seconds; if it returns True, the optimizations in progress are stopped,
+    the tasks not yet started are cancelled, and a CancelException is raised, as when running in series.
+    '''
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=interval)
+        if pending and stoppingfunc and stoppingfunc():
+            pool.stopevent.set()
+            for future in pending: future.cancel()
+            raise op.CancelException
+    return [future.result() for future in futures]
+
+
+def closepool(pool=None):
+    ''' Stop any tasks that are still running and shut down the worker processes '''
+    pool.stopevent.set()
+    pool.shutdown(wait=False)
+    return None
+
 
+def chain_task(chain=None, args=None, asdkwargs=None, randseed=None, inqueue=None, outqueue=None, stopevent=None):
+    '''
+    Run one chain of a multi-chain optimization in a worker process. The worker is started once, and then optimizes
+    from each budget vector it receives until it receives None. The ASD step sizes and parameter selection
+    probabilities are kept from one block to the next, as is the random number stream.
+    '''
+    try:
+        seed(randseed) # Seed once, rather than for every block
+        args = dict(args)
+        args['origoutcomes'] = outcomecalc(outputresults=True, **args) # Calculate the initial outcome once
+        pinitial, sinitial = None, None
+        while True:
+            budgetvec = inqueue.get()
+            if budgetvec is None: break
+            res = asd(outcomecalc, budgetvec, args=args, pinitial=pinitial, sinitial=sinitial, stoppingfunc=stopevent.is_set, **asdkwargs)
+            pinitial, sinitial = res.details.probabilities, res.details.stepsizes
+            outqueue.put((chain, res.x, res.details.fvals, args['cache']))
+    except Exception as E:
+        outqueue.put((chain, E, None, None)) # Pass the error back, rather than leaving the main process waiting
+    return None
+
+
+def runchains(budgetvec=None, args=None, asdkwargs=None, nchains=None, nblocks=None, blockiters=None, randseed=None, 
+              stoppingfunc=None, verbose=2, interval=1.0):
+    '''
+    Run a multi-chain optimization from a budget vector: nchains workers each run blockiters iterations of ASD, then
+    all chains restart from the best budget vector found, for nblocks blocks. The workers are started once, and only
+    the budget vectors and objective function values are sent between them and the main process. Returns the best
+    budget vector, the objective function values for the chain it came from, and an array of the values for all
+    chains.
+    
+    Version: 2026oct18
+    '''
+    if Process is None:
+        raise OptimaException('Running a multi-chain optimization requires the multiprocessing module')
+    if randseed is None: randseed = int((time()-floor(time()))*1e4) # Make sure a seed is used
+    fvalarray = zeros((nchains,blockiters*nblocks+1)) + nan
+    caches = [None]*nchains # The latest cache statistics from each chain
+    bestfvals = [] # The objective function values of the chain that ended up best, over all blocks so far
+    
+    # Start the workers
+    inqueues = [Queue() for chain in range(nchains)]
+    outqueue = Queue()
+    stopevent = Event()
+    processes = []
+    for chain in range(nchains):
+        thisseed = randseed + (chain+1)*(2**10-1) # Pseudorandom seeds
+        thisargs = dict(args, cache=args['cache'].new() if args.get('cache') is not None else None) # Each chain keeps its own cache
+        chainargs = (chain, thisargs, dict(asdkwargs, maxiters=blockiters, randseed=None, label='%s chain %i' % (asdkwargs.get('label',''), chain+1)), thisseed, inqueues[chain], outqueue, stopevent)
+        prc = Process(target=chain_task, args=chainargs)
+        prc.start()
+        processes.append(prc)
+    
+    try:
+        # Loop over the optimization blocks
+        for block in range(nblocks):
+            printv('Running block %i/%i of a %i-chain optimization with %i iterations per block' % (block+1, nblocks, nchains, blockiters), 2, verbose)
+            for inqueue in inqueues: inqueue.put(budgetvec) # All chains start from the best budget so far -- this is key!
+            
+            # Gather the results, checking the stopping function while waiting
+            outputs = [None]*nchains
+            for i in range(nchains):
+                while True:
+                    try:
+                        chain, x, fvals, cache = outqueue.get(timeout=interval)
+                        break
+                    except Empty:
+                        if stoppingfunc and stoppingfunc():
+                            stopevent.set()
+                            raise op.CancelException
+                if isinstance(x, Exception): raise x
+                outputs[chain] = (x, fvals)
+                caches[chain] = cache
+            
+            # Figure out which one did best
+            leftbound = block*blockiters
+            for chain,(x,fvals) in enumerate(outputs): fvalarray[chain,leftbound:leftbound+len(fvals)] = fvals # Overwrites the last value of the previous block with the same value
+            bestchain = argmin([fvals[-1] for x,fvals in outputs])
+            budgetvec = outputs[bestchain][0]
+            bestfvals = list(bestfvals[:-1]) + list(outputs[bestchain][1]) # The first value of each block is the last of the previous one
+            
+            if stoppingfunc and stoppingfunc():
+                raise op.CancelException
+    finally:
+        stopevent.set()
+        for inqueue in inqueues: inqueue.put(None) # Tell the workers to finish
+        for prc in processes: prc.join(timeout=interval)
+        for prc in processes: 
+            if prc.is_alive(): prc.terminate()
+    
+    if args.get('cache') is not None:
+        for cache in caches:
+            if cache is not None: args['cache'].merge(cache) # Include the evaluations in the workers
+    
+    return budgetvec, array(bestfvals), fvalarray
 
 
 
@@ -561,8 +866,9 @@ def optimize(optim=None, maxiters=None, maxtime=None, verbose=2, stoppingfunc=No
         randseed = optionally reset the seed
         mc = how many Monte Carlo seeds to run for (if negative, randomize the start location as well)
         label = a string to append to error messages to make it clear where things went wrong
+        ncpus = for outcome minimization, how many worker processes to run the extreme budgets and the Monte Carlo optimizations in (default 1, i.e. in series)
 
-    Version: 1.4 (2017apr01)
+    Version: 1.5 (2026oct18)
     '''
 
     ## Input validation
@@ -611,8 +917,13 @@ def optimize(optim=None, maxiters=None, maxtime=None, verbose=2, stoppingfunc=No
 
     # Run outcomes minimization
     if which=='outcomes':
-        multires = minoutcomes(project=project, optim=optim, tvec=tvec, verbose=verbose, maxtime=maxtime, maxiters=maxiters, 
-                               origbudget=origbudget, randseed=randseed, mc=mc, label=label, die=die, stoppingfunc=stoppingfunc, **kwargs)
+        ncpus = kwargs.pop('ncpus', None)
+        pool = makepool(project=project, ncpus=ncpus) if ncpus and ncpus>1 else None
+        try:
+            multires = minoutcomes(project=project, optim=optim, tvec=tvec, verbose=verbose, maxtime=maxtime, maxiters=maxiters, 
+                                   origbudget=origbudget, randseed=randseed, mc=mc, label=label, die=die, stoppingfunc=stoppingfunc, pool=pool, **kwargs)
+        finally:
+            if pool is not None: closepool(pool)
 
     # Run money minimization
     elif which=='money':
@@ -646,6 +957,12 @@ def multioptimize(optim=None, nchains=None, nblocks=None, blockiters=None,
     
     You can see how after 10 iterations, the blocks talk to each other, and the optimization
     for each thread restarts from the best solution found for each.
+    
+    Each chain is run in its own worker process, which is started once and keeps its ASD step sizes and
+    probabilities from one block to the next; the baseline and extreme budgets are only run once, by the main
+    process. maxtime applies to each block.
+    
+    Version: 2026oct18
     '''
     
     # Set defaults
@@ -656,63 +973,11 @@ def multioptimize(optim=None, nchains=None, nblocks=None, blockiters=None,
     if abs(mc)>0:
         errormsg = 'Monte Carlo optimization with multithread optimization has not been implemented'
         raise OptimaException(errormsg)
-    totaliters = blockiters*nblocks
-    fvalarray = zeros((nchains,totaliters+1)) + nan
     
     printv('Starting a parallel optimization with %i threads for %i iterations each for %i blocks' % (nchains, blockiters, nblocks), 2, verbose)
-    
-    # Loop over the optimization blocks
-    for block in range(nblocks):
-        
-        # Set up the parallel process
-        outputqueue = Queue()
-        outputlist = empty(nchains, dtype=object)
-        processes = []
-            
-        # Loop over the threads, starting the processes
-        for thread in range(nchains):
-            blockrand = (block+1)*(2**6-1) # Pseudorandom seeds
-            threadrand = (thread+1)*(2**10-1) 
-            randtime = int((time()-floor(time()))*1e4)
-            if randseed is None: thisseed = (blockrand+threadrand)*randtime # Get a random number based on both the time and the thread
-            else:                thisseed = randseed + blockrand+threadrand
-            optim._threadindex = thread # Store the thread index 
-            optimargs = (optim, blockiters, maxtime, verbose, stoppingfunc, die, origbudget, thisseed, mc, label, outputqueue, kwargs)
-            prc = Process(target=optimize, args=optimargs)
-            prc.start()
-            processes.append(prc)
-        
-        # Tidy up: close the threads and gather the results
-        for i in range(nchains):
-            result = outputqueue.get() # This is needed or else the process never finishes
-            threadindex = result.optim._threadindex # To ensure a robust ordering
-            outputlist[threadindex] = result
-            if block==0 and threadindex==0: origresults = dcp(result) # Copy the original results from the first optimization
-        for prc in processes:
-            prc.join() # Wait for them to finish
-        
-        # Figure out which one did best
-        bestfvalval = inf
-        bestfvalind = None
-        for i in range(nchains):
-            if block==0 and i==0: fvalarray[:,0] = outputlist[i].improvement[0][0] # Store the initial value
-            thischain = outputlist[i].improvement[0][1:] # The chain to store the improvement of -- NB, improvement is an odict
-            leftbound = block * blockiters + 1
-            rightbound = block * blockiters + len(thischain) + 1
-            fvalarray[i,leftbound:rightbound] = thischain
-            thisbestval = outputlist[i].outcome
-            if thisbestval<bestfvalval:
-                bestfvalval = thisbestval
-                bestfvalind = i
-        
-        origbudget = outputlist[bestfvalind].budgets[-1] # Update the budget and use it as the input for the next block -- this is key!
-    
-    # Assemble final results object from the initial and final run
-    results = dcp(outputlist[bestfvalind]) # Use best results as the basis for the output
-    results.improvement[0] = sanitize(fvalarray[bestfvalind,:]) # Store fval vector in normal format
-    results.multiimprovement = fvalarray # Store full fval array
-    try:    results.budgets['Baseline'] = origresults.budgets['Baseline'] # Assume it's called baseline
-    except: results.budgets[0]          = origresults.budgets[0] # If that fails, just use the first entry
+    chains = {'nchains':nchains, 'nblocks':nblocks, 'blockiters':blockiters}
+    results = optimize(optim=optim, maxiters=blockiters, maxtime=maxtime, verbose=verbose, stoppingfunc=stoppingfunc, die=die, 
+                       origbudget=origbudget, randseed=randseed, mc=mc, label=label, chains=chains, **kwargs)
     
     return results
 
@@ -740,8 +1005,7 @@ def tvoptimize(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
     # Do a preliminary non-time-varying optimization
     optim.tvsettings['timevarying'] = False # Turn off for the first run
     prelim = optimize(optim=optim, maxtime=maxtime, maxiters=maxiters, verbose=verbose, origbudget=origbudget,
-                ccsample=ccsample, randseed=randseed, mc=mc, label=label, die=die, keepraw=True, **kwargs)
-    rawresults = prelim.raw['Baseline'][0] # Store the raw results; "Baseline" vs. "Optimized" shouldn't matter, and [0] is the first/best run -- not sure if there is a more robut way
+                ccsample=ccsample, randseed=randseed, mc=mc, label=label, die=die, **kwargs)
     
     # Add in the time-varying component
     origtotalbudget = dcp(optim.objectives['budget']) # Should be a float, but dcp just in case
@@ -772,7 +1036,9 @@ def tvoptimize(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
             'tvec':tvec, 
             'ccsample':ccsample, 
             'verbose':verbose, 
-            'initpeople':None, # For now, run full time series
+            'checkpoint':None, # For now, run full time series
+            'cache':Outcomecache(), # Don't rerun the model for budgets that have already been evaluated
+            'compiledprogset':progset.compile(t=inclusiverange(start=optim.objectives['start'], stop=optim.objectives['end'], step=optim.tvsettings['tvstep']), parset=project.parsets[optim.parsetname], sample=ccsample), # For the time-varying budgets
             'tvsettings':optim.tvsettings} # Complicated; see below
     
     tmpresults = odict()
@@ -807,10 +1073,8 @@ def tvoptimize(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
     sinitial = concatenate([stepbudget]*2+[steptvcontrol]*2) # Set the step size -- duplicate for +/-
     args['origbudget'] = optimconstbudget
     
-    # Set the initial people
-    initialind = findinds(rawresults['tvec'], optim.objectives['start'])
-    initpeople = rawresults['people'][:,:,initialind] # Pull out the people array corresponding to the start of the optimization -- there shouldn't be multiple raw arrays here
-    args['initpeople'] = initpeople
+    # Save checkpoints, so the optimization only has to run the model from around the start year
+    args['checkpoint'] = makecheckpoint(tvvec, **args)
     
     # Now run the optimization
     origoutcomes = outcomecalc(outputresults=True, **args) # Calculate the initial outcome and pass it back in
@@ -824,8 +1088,7 @@ def tvoptimize(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
         bestkey = key # Reset key
         bestfval = fvals[-1] # Reset fval
     
-    ## Calculate outcomes
-    args['initpeople'] = None # Turn off again to get full results
+    ## Calculate outcomes -- full results, since the model copies everything before the checkpoint
     new = outcomecalc(asdresults[bestkey]['budget'], tvcontrolvec=tvcontrolvec, outputresults=True, **args)
     new.name = 'Time-varying' # Note: could all be simplified
     tmpresults[new.name] = new
@@ -838,6 +1101,7 @@ def tvoptimize(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
     multires.improvement = tmpimprovements # Store full function evaluation information -- only use last one
     multires.fullruninfo = tmpfullruninfo # And the budgets/outcomes for every different run
     multires.outcomes = dcp(multires.outcome) # Copy to more robust place, and...
+    multires.cachestats = args['cache'].stats() # How many evaluations were found in the cache
     optim.resultsref = multires.name # Store the reference for this result
     
     # Store optimization settings
@@ -852,8 +1116,20 @@ def tvoptimize(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
 
 
 def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None, maxiters=1000, 
-                origbudget=None, ccsample='best', randseed=None, mc=3, label=None, die=False, timevarying=None, keepraw=False, stoppingfunc=None, **kwargs):
-    ''' Split out minimize outcomes '''
+                origbudget=None, ccsample='best', randseed=None, mc=3, label=None, die=False, timevarying=None, keepraw=False, stoppingfunc=None, pool=None, chains=None, 
+                startbudget=None, progressfunc=None, **kwargs):
+    '''
+    Split out minimize outcomes -- if a pool from makepool() is supplied, the extreme budgets and optimizations are run
+    in parallel; if chains is supplied (a dict of nchains, nblocks and blockiters), a multi-chain optimization is run
+    from the baseline budget instead of the Monte Carlo optimizations
+    
+    If startbudget is supplied (e.g. the best budget from an interrupted optimization), the optimizations start from it
+    instead of origbudget, which is still used for the baseline. If progressfunc is supplied, it is called with the
+    progress events from asd(), with the constrained budget added as "budget"; optimizations run in a pool or in chains
+    report only when they finish.
+    
+    Version: 2026oct18
+    '''
 
     ## Handle budget and remove fixed costs
     if project is None or optim is None: raise OptimaException('An optimization requires both a project and an optimization object to run')
@@ -876,14 +1152,6 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
     xmin = zeros(noptimprogs)
     if label is None: label = ''
 
-    # Calculate the initial people distribution
-    results = project.runsim(pars=parset.pars, parsetname=optim.parsetname, progsetname=optim.progsetname, tvec=tvec, keepraw=True, verbose=0, label=project.name+'-minoutcomes', addresult=False)
-    initialind = findnearest(results.raw[0]['tvec'], optim.objectives['start'])
-    initpeople = results.raw[0]['people'][:,:,initialind] # Pull out the people array corresponding to the start of the optimization -- there shouldn't be multiple raw arrays here
-
-    if stoppingfunc and stoppingfunc():
-        raise op.CancelException
-
     # Calculate original things
     constrainedbudgetorig, constrainedbudgetvecorig, lowerlim, upperlim = constrainbudget(origbudget=origbudget, budgetvec=budgetvec, totalbudget=origtotalbudget, budgetlims=optim.constraints, optiminds=optiminds, outputtype='full')
 
@@ -900,10 +1168,18 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
             'tvec':       tvec, 
             'ccsample':   ccsample, 
             'verbose':    verbose, 
-            'initpeople': initpeople, # Complicated; see below
+            'checkpoint': None, # Complicated; see below
             'keepraw':    keepraw,
+            'cache':      Outcomecache(), # Don't rerun the model for budgets that have already been evaluated
+            'compiledprogset': progset.compile(t=optim.objectives['start'], parset=parset, sample=ccsample), # Calculate the parameters from the budget quickly
             }
     
+    # Save checkpoints from the baseline budget, so all other runs only have to run the model from around the start year
+    args['checkpoint'] = makecheckpoint(constrainedbudgetvecorig, **args)
+
+    if stoppingfunc and stoppingfunc():
+        raise op.CancelException
+    
     # Set up extremes
     extremebudgets = odict()
     extremebudgets['Baseline'] = zeros(nprogs)
@@ -921,20 +1197,25 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
     # Set up storage for extreme budgets
     extremeresults  = odict()
     extremeoutcomes = odict()
-
-    for key,exbudget in extremebudgets.items():
-
-        if stoppingfunc and stoppingfunc():
-            raise op.CancelException
-
-        doconstrainbudget = False # Budget is specified fully, don't constrain
-        if key=='Baseline': 
-            args['initpeople'] = None # Do this so it runs for the full time series, and is comparable to the optimization result
-            args['totalbudget'] = origbudget[:].sum() # Need to reset this since constraining the budget
-        else:
-            args['initpeople'] = initpeople # Do this so saves a lot of time (runs twice as fast for all the budget scenarios)
-            args['totalbudget'] = origtotalbudget
-        extremeresults[key] = outcomecalc(exbudget[optiminds], outputresults=True, doconstrainbudget=doconstrainbudget, **args)
+    extremeargs     = odict()
+    for key in extremebudgets.keys():
+        if key=='Baseline': thistotalbudget = origbudget[:].sum() # Need to reset this since constraining the budget
+        else:               thistotalbudget = origtotalbudget
+        extremeargs[key] = dict(args, totalbudget=thistotalbudget, outputresults=True, doconstrainbudget=False) # Budget is specified fully, don't constrain
+
+    if pool is None: # Run them one at a time
+        for key,exbudget in extremebudgets.items():
+    
+            if stoppingfunc and stoppingfunc():
+                raise op.CancelException
+    
+            extremeresults[key] = outcomecalc(exbudget[optiminds], **extremeargs[key])
+    else: # Run them all at once
+        futures = [pool.submit(outcomecalc_task, exbudget[optiminds], dict(extremeargs[key], project=None)) for key,exbudget in extremebudgets.items()] # Workers already have the project
+        for key,result in zip(extremebudgets.keys(), waitforpool(pool, futures, stoppingfunc=stoppingfunc)):
+            result.projectref = Link(project) # Restore link
+            extremeresults[key] = result
+    for key in extremebudgets.keys():
         extremeresults[key].name = key
         extremeoutcomes[key] = extremeresults[key].outcome
     if mc: bestprogram = argmin(extremeoutcomes[:][len(firstkeys):])+len(firstkeys) # Don't include no funding or infinite funding examples
@@ -964,10 +1245,19 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
             if die: raise OptimaException(errormsg)
             else:   print(errormsg)
             
+    # Add the budget to the progress events, for reporting and for restarting from
+    def reportprogress(event):
+        event['budget'] = constrainbudget(origbudget=origbudget, budgetvec=dcp(event['x']), totalbudget=args['totalbudget'], budgetlims=optim.constraints, optiminds=optiminds, outputtype='odict')
+        progressfunc(event)
+    
+    def reportfinished(key, budgetvecnew, fvals):
+        reportprogress(objdict([('label',key), ('iteration',len(fvals)-1), ('maxiters',maxiters), ('fval',fvals[-1]), ('fvalorig',fvals[0]), ('x',budgetvecnew), ('elapsed',None), ('eta',0)]))
+    
     ## Loop over budget scale factors
     tmpresults = odict()
     tmpimprovements = odict()
     tmpfullruninfo = odict()
+    multiimprovement = None
     tmpresults['Baseline'] = extremeresults['Baseline'] # Include un-optimized original
     scalefactors = promotetoarray(optim.objectives['budgetscale']) # Ensure it's a list
     for scalefactor in scalefactors:
@@ -976,7 +1266,10 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
         totalbudget = origtotalbudget*scalefactor
         constrainedbudget, constrainedbudgetvec, lowerlim, upperlim = constrainbudget(origbudget=origbudget, budgetvec=budgetvec, totalbudget=totalbudget, budgetlims=optim.constraints, optiminds=optiminds, outputtype='full')
         args['totalbudget'] = totalbudget
-        args['initpeople'] = initpeople # Reset initpeople
+        
+        if startbudget is not None and totalbudget: # Start the optimizations from here instead
+            startbudgetvec = array(startbudget[:] if isinstance(startbudget, odict) else startbudget, dtype=float)[optiminds]
+            constrainedbudgetvec = constrainbudget(origbudget=origbudget, budgetvec=startbudgetvec, totalbudget=totalbudget, budgetlims=optim.constraints, optiminds=optiminds, outputtype='vec')
         
         # Set up budgets to run
         if totalbudget: # Budget is nonzero, run
@@ -1005,18 +1298,41 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
             # Actually run the optimizations
             bestfval = inf # Value of outcome
             asdresults = odict()
-            for k,key in enumerate(allbudgetvecs.keys()):
-
-                if stoppingfunc and stoppingfunc():
-                    raise op.CancelException
-
-                printv('Running optimization "%s" (%i/%i) with maxtime=%s, maxiters=%s' % (key, k+1, len(allbudgetvecs), maxtime, maxiters), 2, verbose)
-                if label: thislabel = '"'+label+'-'+key+'"'
-                else: thislabel = '"'+key+'"'
-                origoutcomes = outcomecalc(outputresults=True, **args) # Calculate the initial outcome and pass it back in
-                args['origoutcomes'] = origoutcomes
-                res = asd(outcomecalc, allbudgetvecs[key], args=args, xmin=xmin, maxtime=maxtime, maxiters=maxiters, verbose=verbose, randseed=allseeds[k], label=thislabel, stoppingfunc=stoppingfunc, **kwargs)
-                budgetvecnew, fvals = res.x, res.details.fvals
+            asdoutputs = odict()
+            if chains is not None: # Run the chains from the baseline budget, reusing the setup above
+                printv('Running multi-chain optimization with maxtime=%s per block' % maxtime, 2, verbose)
+                asdkwargs = dict(kwargs, xmin=xmin, maxtime=maxtime, verbose=verbose, label=label)
+                budgetvecnew, fvals, multiimprovement = runchains(allbudgetvecs['Baseline'], args=args, asdkwargs=asdkwargs, randseed=randseed, stoppingfunc=stoppingfunc, verbose=verbose, **chains)
+                asdoutputs['Baseline'] = (budgetvecnew, fvals)
+                if progressfunc: reportfinished(label, budgetvecnew, fvals)
+                args['origoutcomes'] = outcomecalc(outputresults=True, **args) # Still needed for the final outcome
+            elif pool is None: # Run them one at a time
+                args['origoutcomes'] = outcomecalc(outputresults=True, **args) # Calculate the initial outcome once, since it's the same for each optimization
+                for k,key in enumerate(allbudgetvecs.keys()):
+    
+                    if stoppingfunc and stoppingfunc():
+                        raise op.CancelException
+    
+                    printv('Running optimization "%s" (%i/%i) with maxtime=%s, maxiters=%s' % (key, k+1, len(allbudgetvecs), maxtime, maxiters), 2, verbose)
+                    if label: thislabel = '"'+label+'-'+key+'"'
+                    else: thislabel = '"'+key+'"'
+                    res = asd(outcomecalc, allbudgetvecs[key], args=args, xmin=xmin, maxtime=maxtime, maxiters=maxiters, verbose=verbose, randseed=allseeds[k], label=thislabel, stoppingfunc=stoppingfunc, progressfunc=reportprogress if progressfunc else None, **kwargs)
+                    asdoutputs[key] = (res.x, res.details.fvals)
+            else: # Run them all at once, each with its own seed so the results are the same as in series
+                futures = []
+                for k,key in enumerate(allbudgetvecs.keys()):
+                    printv('Starting optimization "%s" (%i/%i) with maxtime=%s, maxiters=%s' % (key, k+1, len(allbudgetvecs), maxtime, maxiters), 2, verbose)
+                    if label: thislabel = '"'+label+'-'+key+'"'
+                    else: thislabel = '"'+key+'"'
+                    asdkwargs = dict(kwargs, xmin=xmin, maxtime=maxtime, maxiters=maxiters, verbose=verbose, randseed=allseeds[k], label=thislabel)
+                    futures.append(pool.submit(asd_task, allbudgetvecs[key], dict(args, project=None, origoutcomes=None, cache=args['cache'].new()), asdkwargs)) # Workers already have the project
+                args['origoutcomes'] = outcomecalc(outputresults=True, **args) # Still needed for the final outcome; calculated while the workers run
+                for key,(budgetvecnew,fvals,cache) in zip(allbudgetvecs.keys(), waitforpool(pool, futures, stoppingfunc=stoppingfunc)):
+                    asdoutputs[key] = (budgetvecnew, fvals)
+                    args['cache'].merge(cache) # Include the evaluations in the worker
+                    if progressfunc: reportfinished(key, budgetvecnew, fvals)
+            
+            for key,(budgetvecnew,fvals) in asdoutputs.items():
                 constrainedbudgetnew, constrainedbudgetvecnew, lowerlim, upperlim = constrainbudget(origbudget=origbudget, budgetvec=budgetvecnew, totalbudget=totalbudget, budgetlims=optim.constraints, optiminds=optiminds, outputtype='full')
                 asdresults[key] = {'budget':constrainedbudgetnew, 'fvals':fvals}
                 if fvals[-1]<bestfval: 
@@ -1024,7 +1340,6 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
                     bestfval = fvals[-1] # Reset fval
             
             ## Calculate final outcomes for the full time vector
-            args['initpeople'] = None # Set to None to get full results, not just from start year
             new = outcomecalc(asdresults[bestkey]['budget'], outputresults=True, **args)
             
             ## Name and store outputs
@@ -1048,6 +1363,8 @@ def minoutcomes(project=None, optim=None, tvec=None, verbose=None, maxtime=None,
     multires.outcomes = dcp(multires.outcome) # Initialize
     multires.outcome = multires.outcomes[-1] # Store these defaults in a convenient place
     multires.optim = optim # Store the optimization object as well
+    if chains is not None: multires.multiimprovement = multiimprovement # Store the objective function values of all chains
+    multires.cachestats = args['cache'].stats() # How many evaluations were found in the cache
     
     
     # Store optimization settings
@@ -1097,7 +1414,9 @@ def minmoney(project=None, optim=None, tvec=None, verbose=None, maxtime=None, ma
             'verbose':    verbose,
             'keepraw':    keepraw,
             'doconstrainbudget': True,
+            'compiledprogset': progset.compile(t=optim.objectives['start'], parset=parset, sample=ccsample), # Calculate the parameters from the budget quickly
             }
+    args['checkpoint'] = makecheckpoint(budgetvec, totalbudget=totalbudget, **args) # Only run the model from around the start year
 
     #%% Preliminaries
     start = op.tic()
@@ -1610,14 +1929,13 @@ def icers(name=None, project=None, parsetname=None, progsetname=None, objective=
     keys = defaultbudget.keys() # Get the program keys
     nkeys = len(keys)
     
-    # Calculate the initial people distribution
-    initresults = project.runsim(parsetname=parsetname, progsetname=progsetname, keepraw=True, verbose=0, label=project.name+'-minoutcomes', addresult=False)
-    initialind  = findnearest(initresults.raw[0]['tvec'], objectives['start'])
-    initpeople  = initresults.raw[0]['people'][:,:,initialind] # Pull out the people array corresponding to the start of the optimization -- there shouldn't be multiple raw arrays here
-
     # Define arguments that don't change in the loop
     defaultargs = {'which':'outcomes', 'project':project, 'parsetname':parsetname, 'progsetname':progsetname, 'objectives':objectives, 
-                   'origbudget':origbudget, 'outputresults':False, 'verbose':verbose, 'doconstrainbudget':False, 'initpeople':initpeople}
+                   'origbudget':origbudget, 'outputresults':False, 'verbose':verbose, 'doconstrainbudget':False}
+    defaultargs['compiledprogset'] = project.progsets[progsetname].compile(t=objectives['start'], parset=project.parsets[parsetname]) # Calculate the parameters from the budget quickly
+    
+    # Save checkpoints from the baseline budget, so the other budgets only have to be run from around the start year
+    defaultargs['checkpoint'] = makecheckpoint(defaultbudget[:], **defaultargs)
     
     # Calculate baseline
     baseliney = outcomecalc(budgetvec=defaultbudget[:], **defaultargs)
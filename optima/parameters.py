@@ -6,7 +6,9 @@ parameters, the Parameterset class.
 Version: 2.1 (2017apr04)
 """
 
-from numpy import array, nan, isnan, isfinite, zeros, argmax, mean, log, polyfit, exp, maximum, minimum, Inf, linspace, median, shape
+from numpy import array, nan, isnan, isfinite, zeros, argmax, mean, log, polyfit, exp, maximum, minimum, Inf, linspace, median, shape, ndarray
+from weakref import WeakKeyDictionary
+from copy import copy
 from numpy.random import uniform, normal, seed
 from optima import OptimaException, Link, odict, dataframe, printv, sanitize, uuid, today, getdate, makefilepath, smoothinterp, dcp, defaultrepr, isnumber, findinds, getvaliddata, promotetoarray, promotetolist, inclusiverange # Utilities 
 from optima import Settings, getresults, convertlimits, gettvecdt, loadpartable, loadtranstable # Heftier functions
@@ -15,6 +17,8 @@ import optima as op
 defaultsmoothness = 1.0 # The number of years of smoothing to do by default
 generalkeys = ['male', 'female', 'popkeys', 'injects', 'fromto', 'transmatrix'] # General parameter keys that are just copied
 staticmatrixkeys = ['birthtransit','agetransit','risktransit'] # Static keys that are also copied, but differently :)
+interpattrs = ['t', 'y', 'i', 'e', 'm', 'start', 'limits', 'by'] # Par attributes that the interpolated values depend on
+interpcache = WeakKeyDictionary() # The most recent unsampled interpolation of each Par -- see cachedinterp()
 
 
 #################################################################################################################################
@@ -84,6 +88,22 @@ class Parameterset(object):
         return parslist
     
     
+    def overlay(self):
+        ''' 
+        Return a copy of the parameter set that can be changed without changing this one, without copying every 
+        parameter: its pars are a Parsoverlay of these pars, so use pars.override() to get a parameter to change.
+        All its other attributes are copied.
+        
+        Version: 2026oct18
+        '''
+        parset = copy(self)
+        for attr,val in self.__dict__.items():
+            if attr=='pars':             parset.pars = Parsoverlay(self.pars)
+            elif isinstance(val, Link):  setattr(parset, attr, Link(val.obj)) # Copying a link breaks it, so make a new one to the same object
+            else:                        setattr(parset, attr, dcp(val))
+        return parset
+    
+    
     def makepars(self, data=None, fix=True, verbose=2, start=None, end=None):
         self.pars = makepars(data=data, verbose=verbose) # Initialize as list with single entry
         self.fixprops(fix=fix)
@@ -433,6 +453,42 @@ class Parameterset(object):
 
 
 
+class Parsoverlay(odict):
+    '''
+    A copy-on-write version of a pars odict, e.g. for a scenario: it starts off holding the same parameter objects as
+    the pars it was made from, which are treated as read-only, and a parameter is only copied when override() is
+    called to get a version of it that can be changed. Otherwise it is an ordinary odict, so makesimpars(), the model
+    and Resultset don't notice the difference.
+    
+    When pickled or copied with dcp(), it becomes an ordinary odict with its own copies of the shared parameters, so
+    saved projects don't depend on this class, and a loaded or copied project has no parameters shared between
+    parsets.
+    
+    Version: 2026oct18
+    '''
+    
+    def __init__(self, *args, **kwargs):
+        odict.__init__(self, *args, **kwargs) # A shallow copy of the pars
+        self.overridden = set() # Keys of the parameters that have been copied
+        return None
+    
+    def __reduce__(self):
+        ''' Pickle and copy as an ordinary odict, copying the shared parameters -- otherwise the pickle or deepcopy memo would keep them shared '''
+        return (odict, ([(key, val if key in self.overridden else dcp(val)) for key,val in self.items()],))
+    
+    def override(self, key):
+        ''' Return the parameter for this key, copying it first if it's still shared with the original pars '''
+        if isnumber(key): key = self.keys()[key]
+        if key not in self.overridden:
+            self[key] = dcp(self[key])
+            self.overridden.add(key)
+        return self[key]
+
+
+
+
+
+
 #################################################################################################################################
 ### Define the other classes
 #################################################################################################################################
@@ -1241,9 +1297,10 @@ def makepars(data=None, verbose=2, die=True, fixprops=None):
 def makesimpars(pars, name=None, keys=None, start=None, end=None, dt=None, tvec=None, settings=None, smoothness=None, asarray=True, sample=None, tosample=None, randseed=None, verbose=2):
     ''' 
     A function for taking a single set of parameters and returning the interpolated versions -- used
-    very directly in Parameterset.
+    very directly in Parameterset. Unsampled interpolations are reused if the parameter hasn't changed
+    (see cachedinterp()), but each simpars gets its own writable arrays.
     
-    Version: 2017mar01
+    Version: 2026oct18
     '''
     
     # Handle inputs and initialization
@@ -1259,6 +1316,7 @@ def makesimpars(pars, name=None, keys=None, start=None, end=None, dt=None, tvec=
     if smoothness is None: smoothness = int(defaultsmoothness/dt)
     tosample = promotetolist(tosample) # Convert to list
     popkeys = pars['popkeys'] # Used for interpolation
+    settingskey = (interpkey(simpars['tvec']), dt, smoothness, asarray, tuple(popkeys)) # For reusing unsampled interpolations
     
     # Copy default keys by default
     for key in generalkeys: simpars[key] = dcp(pars[key])
@@ -1270,7 +1328,8 @@ def makesimpars(pars, name=None, keys=None, start=None, end=None, dt=None, tvec=
             thissample = sample # Make a copy of it to check it against the list of things we are sampling
             if tosample and tosample[0] is not None and key not in tosample: thissample = False # Don't sample from unselected parameters -- tosample[0] since it's been promoted to a list
             try:
-                simpars[key] = pars[key].interp(tvec=simpars['tvec'], dt=dt, popkeys=popkeys, smoothness=smoothness, asarray=asarray, sample=thissample, randseed=randseed)
+                if thissample: simpars[key] = pars[key].interp(tvec=simpars['tvec'], dt=dt, popkeys=popkeys, smoothness=smoothness, asarray=asarray, sample=thissample, randseed=randseed)
+                else:          simpars[key] = cachedinterp(pars[key], settingskey=settingskey, tvec=simpars['tvec'], dt=dt, popkeys=popkeys, smoothness=smoothness, asarray=asarray)
             except OptimaException as E: 
                 errormsg = 'Could not figure out how to interpolate parameter "%s"' % key
                 errormsg += 'Error: "%s"' % repr(E)
@@ -1281,6 +1340,50 @@ def makesimpars(pars, name=None, keys=None, start=None, end=None, dt=None, tvec=
 
 
 
+def interpkey(val):
+    ''' Convert the value of a parameter attribute into something that can be compared cheaply, for cachedinterp() '''
+    if isinstance(val, dict):                 return tuple([(key, interpkey(subval)) for key,subval in val.items()])
+    elif isinstance(val, ndarray):            return (val.dtype.str, val.shape, val.tobytes())
+    elif isinstance(val, (list, tuple)):      return tuple([interpkey(item) for item in val])
+    else:                                     return val
+
+
+
+def parkey(par):
+    ''' The data (t, y, m, etc.) that interpolating a parameter depends on, in a form that can be compared cheaply '''
+    return tuple([interpkey(getattr(par, attr, None)) for attr in interpattrs])
+
+
+
+def cachedinterp(par, settingskey=None, **kwargs):
+    '''
+    Interpolate a parameter without sampling, reusing its previous interpolation if neither the parameter's
+    data (t, y, m, etc.) nor the interpolation settings have changed since. Since the data are checked each
+    time, in-place changes -- e.g. from manualfit(), Parameterset.update() or autofit() -- are picked up
+    without needing to clear anything. The cache keeps its own read-only copy of the output and each call
+    gets a writable copy of it, so changing the returned arrays doesn't affect other simpars.
+    
+    Version: 2026oct18
+    '''
+    key = (settingskey, parkey(par))
+    cached = interpcache.get(par)
+    if cached is None or cached[0]!=key:
+        output = copyinterp(par.interp(sample=False, **kwargs))
+        for val in (output.values() if isinstance(output, dict) else [output]):
+            if isinstance(val, ndarray): val.flags.writeable = False
+        cached = (key, output)
+        interpcache[par] = cached
+    return copyinterp(cached[1])
+
+
+
+def copyinterp(output):
+    ''' Copy the arrays of an interpolated parameter, which is either an array or a dict of them, for cachedinterp() '''
+    if isinstance(output, dict): return type(output)([(key, val.copy() if isinstance(val, ndarray) else val) for key,val in output.items()])
+    elif isinstance(output, ndarray): return output.copy()
+    else: return output
+
+
 
 def applylimits(y, par=None, limits=None, dt=None, warn=True, verbose=2):
     ''' 
@@ -1322,7 +1425,7 @@ def applylimits(y, par=None, limits=None, dt=None, warn=True, verbose=2):
         newy[newy<limits[0]] = limits[0]
         newy[newy>limits[1]] = limits[1]
         newy[infiniteinds] = infinitevals # And stick them back in
-        if warn and any(newy!=array(y)):
+        if warn and verbose>=3 and any(newy!=array(y)): # Check verbose first, since formatting the arrays is slow
             printv('Note, parameter "%s" value reset from:\n%s\nto:\n%s' % (parname, y, newy), 3, verbose)
     else:
         if warn: raise OptimaException('Data type "%s" not understood for applying limits for parameter "%s"' % (type(y), parname))
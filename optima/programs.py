@@ -6,7 +6,7 @@ set of programs, respectively.
 Version: 2019jan09
 """
 
-from optima import OptimaException, Link, printv, uuid, today, sigfig, getdate, dcp, smoothinterp, findinds, odict, Settings, sanitize, defaultrepr, isnumber, promotetoarray, vec2obj, asd, convertlimits
+from optima import OptimaException, Link, printv, uuid, today, sigfig, getdate, dcp, smoothinterp, findinds, odict, Settings, sanitize, defaultrepr, isnumber, promotetoarray, vec2obj, asd, convertlimits, Par, Parsoverlay, parkey
 from numpy import ones, prod, array, zeros, exp, log, append, nan, isnan, maximum, minimum, sort, concatenate as cat, transpose, mean, argsort
 from random import uniform
 import six
@@ -551,50 +551,11 @@ class Programset(object):
                             
                     # NESTED CALCULATION
                     elif self.covout[thispartype][thispop].interaction == 'nested':
-                        # Outcome += c3*max(delta_out1,delta_out2,delta_out3) + (c2-c3)*max(delta_out1,delta_out2) + (c1 -c2)*delta_out1, where c3<c2<c1.
-                        for yr in range(nyrs):
-                            cov,delt = [],[]
-                            for thisprog in thiscov.keys():
-                                cov.append(thiscov[thisprog][yr])
-                                delt.append(delta[thisprog][yr])
-                            cov_tuple = sorted(zip(cov,delt)) # A tuple storing the coverage and delta out, ordered by coverage
-                            for j in range(len(cov_tuple)): # For each entry in here
-                                if j == 0: c1 = cov_tuple[j][0]
-                                else: c1 = cov_tuple[j][0]-cov_tuple[j-1][0]
-                                outcomes[thispartype][thispop][yr] += c1*max([ct[1] for ct in cov_tuple[j:]])                
+                        nestedoutcome(outcomes[thispartype][thispop], thiscov, delta, nyrs)
                 
                     # RANDOM CALCULATION
                     elif self.covout[thispartype][thispop].interaction == 'random':
-                        # Outcome += c1(1-c2)* delta_out1 + c2(1-c1)*delta_out2 + c1c2* max(delta_out1,delta_out2)
-    
-                        for prog1 in thiscov.keys():
-                            product = ones(thiscov[prog1].shape)
-                            for prog2 in thiscov.keys():
-                                if prog1 != prog2:
-                                    product *= (1-thiscov[prog2])
-            
-                            outcomes[thispartype][thispop] += delta[prog1]*thiscov[prog1]*product 
-    
-                        # Recursion over overlap levels
-                        def overlap_calc(indexes,target_depth):
-                            if len(indexes) < target_depth:
-                                accum = 0
-                                for j in range(indexes[-1]+1,len(thiscov)):
-                                    accum += overlap_calc(indexes+[j],target_depth)
-                                output = list(thiscov.values())[indexes[-1]]*accum
-                                return output
-                            else:
-                                deltalist = list(delta.values())
-                                output = list(thiscov.values())[indexes[-1]]* max(deltalist[0][0],0) # TODO WARNING, consider replacing with output = thiscov.values()[indexes[-1]] * max(delta.values()[0], 0)
-                                return output
-    
-                        # Iterate over overlap levels
-                        for i in range(2,len(thiscov)): # Iterate over numbers of overlapping programs
-                            for j in range(0,len(thiscov)-1): # Iterate over the index of the first program in the sum
-                                outcomes[thispartype][thispop] += overlap_calc([j],i)[0]
-
-                        # All programs together
-                        outcomes[thispartype][thispop] += prod(array(list(thiscov.values())),0)*[max([c[j] for c in list(delta.values())]) for j in range(nyrs)]
+                        randomoutcome(outcomes[thispartype][thispop], thiscov, delta, nyrs)
                     
 
                     else: raise OptimaException('Unknown reachability type "%s"',self.covout[thispartype][thispop].interaction)
@@ -610,7 +571,7 @@ class Programset(object):
         
         
     def getpars(self, coverage, t=None, parset=None, results=None, sample='best', die=False, verbose=2):
-        ''' Make pars'''
+        ''' Make pars -- returned as a Parsoverlay of the parset's, so only the parameters the programs affect are copied '''
         
         years = t # WARNING, not renaming in the function definition for now so as to not break things
         
@@ -629,9 +590,9 @@ class Programset(object):
         outcomes = self.getoutcomes(coverage=coverage, t=years, parset=parset, results=results, sample=sample)
 
         # Create a parset and copy over parameter changes
-        pars = dcp(parset.pars)
+        pars = Parsoverlay(parset.pars)
         for outcome in outcomes.keys():
-            thispar = pars[outcome]
+            thispar = pars.override(outcome)
             
             # Find last good value -- WARNING, copied from scenarios.py!!! and shouldn't be in this loop!
             last_t = min(years) - settings.dt # Last timestep before the scenario starts
@@ -671,6 +632,16 @@ class Programset(object):
                 
 
         return pars
+
+    
+    def compile(self, t=None, parset=None, sample='best'):
+        '''
+        Prepare the program set for calculating the parameters for many budgets in the same years with the same
+        parameter set, as in an optimization: see Compiledprogset. Returns None if the sample is random, since then
+        the cost-coverage-outcome parameters change each time.
+        '''
+        if sample in ['random','rand','r']: return None
+        return Compiledprogset(progset=self, t=t, parset=parset, sample=sample)
     
     
     
@@ -817,6 +788,252 @@ def costfuncobjectivecalc(parmeans=None, pardict=None, progset=None, parset=None
 
 
 
+
+def nestedoutcome(outcome, thiscov, delta, nyrs):
+    ''' Add the effect of programs with nested interaction to an outcome (modified in place) -- see Programset.getoutcomes() '''
+    # Outcome += c3*max(delta_out1,delta_out2,delta_out3) + (c2-c3)*max(delta_out1,delta_out2) + (c1 -c2)*delta_out1, where c3<c2<c1.
+    for yr in range(nyrs):
+        cov,delt = [],[]
+        for thisprog in thiscov.keys():
+            cov.append(thiscov[thisprog][yr])
+            delt.append(delta[thisprog][yr])
+        cov_tuple = sorted(zip(cov,delt)) # A tuple storing the coverage and delta out, ordered by coverage
+        for j in range(len(cov_tuple)): # For each entry in here
+            if j == 0: c1 = cov_tuple[j][0]
+            else: c1 = cov_tuple[j][0]-cov_tuple[j-1][0]
+            outcome[yr] += c1*max([ct[1] for ct in cov_tuple[j:]])
+    return outcome
+
+
+def randomoutcome(outcome, thiscov, delta, nyrs):
+    ''' Add the effect of programs with random interaction to an outcome (modified in place) -- see Programset.getoutcomes() '''
+    # Outcome += c1(1-c2)* delta_out1 + c2(1-c1)*delta_out2 + c1c2* max(delta_out1,delta_out2)
+    for prog1 in thiscov.keys():
+        product = ones(thiscov[prog1].shape)
+        for prog2 in thiscov.keys():
+            if prog1 != prog2:
+                product *= (1-thiscov[prog2])
+
+        outcome += delta[prog1]*thiscov[prog1]*product 
+
+    # Recursion over overlap levels
+    def overlap_calc(indexes,target_depth):
+        if len(indexes) < target_depth:
+            accum = 0
+            for j in range(indexes[-1]+1,len(thiscov)):
+                accum += overlap_calc(indexes+[j],target_depth)
+            output = list(thiscov.values())[indexes[-1]]*accum
+            return output
+        else:
+            deltalist = list(delta.values())
+            output = list(thiscov.values())[indexes[-1]]* max(deltalist[0][0],0) # TODO WARNING, consider replacing with output = thiscov.values()[indexes[-1]] * max(delta.values()[0], 0)
+            return output
+
+    # Iterate over overlap levels
+    for i in range(2,len(thiscov)): # Iterate over numbers of overlapping programs
+        for j in range(0,len(thiscov)-1): # Iterate over the index of the first program in the sum
+            outcome += overlap_calc([j],i)[0]
+
+    # All programs together
+    outcome += prod(array(list(thiscov.values())),0)*[max([c[j] for c in list(delta.values())]) for j in range(nyrs)]
+    return outcome
+
+
+def parskey(pars):
+    ''' The data of all the parameters in a pars odict, for checking whether a Compiledprogset is out of date '''
+    return tuple([(key, parkey(par)) for key,par in pars.items() if isinstance(par, Par)])
+
+
+
+class Compiledprogset(object):
+    '''
+    A program set prepared for calculating the parameters for many budgets in the same years with the same parameter
+    set, e.g. for each evaluation of an optimization. Everything that doesn't depend on the budget -- the
+    cost-coverage-outcome parameters, target population sizes and compositions, and the parts of each parameter
+    before the budget years -- is calculated once, and the additive and coverage-only outcomes for all parameters
+    are calculated together from arrays. The results are identical to Programset.getprogcoverage() and getpars().
+    Create using Programset.compile(). If the parameter set is changed afterwards, including in place, matches()
+    returns False, so compile it again.
+    
+    Version: 2026oct18
+    '''
+
+    def __init__(self, progset=None, t=None, parset=None, sample='best'):
+        if t is None: raise OptimaException('To compile a program set, one must supply years')
+        if parset is None: raise OptimaException('To compile a program set, one must supply a parset')
+        t = promotetoarray(t)
+        nyrs = len(t)
+        settings = progset.getsettings()
+        self.t           = t # Years the budgets are for
+        self.sample      = sample # Which cost-coverage-outcome parameters to use
+        self.parsetuid   = parset.uid # For checking it's being used with the right parameter set...
+        self.progsetuid  = progset.uid # ...and program set
+        self.pars        = parset.pars # Parameters not affected by the budget are shared, not copied
+        self.parskey     = parskey(parset.pars) # For checking the parameters haven't changed since
+        self.coveragepars = parset.getcovpars() # List of coverage-only parameters
+        
+        # Cost-coverage functions for each program
+        self.progkeys = progset.programs.keys()
+        self.costcov = odict()
+        eps = Settings().eps # As used by Costcov.function()
+        for key,prog in progset.programs.items():
+            if prog.optimizable() and prog.costcovfn.ccopars:
+                totaltargeted = sum(list(prog.gettargetpopsize(t=t, parset=parset, total=False).values()))
+                self.costcov[key] = (prog.costcovfn, prog.costcovfn.getccopar(t=t, sample=sample), totaltargeted, eps)
+            else:
+                self.costcov[key] = None
+        targetpopsizes = progset.gettargetpopsizes(t=t, parset=parset)
+        self.targetpopsizes = [targetpopsizes[key] if key in targetpopsizes else None for key in self.progkeys]
+        
+        # Coverage-outcome functions: additive and coverage-only outcomes are calculated from padded arrays, others one by one
+        self.outcomekeys = odict() # The populations for each parameter, in order
+        self.none = [] # Outcomes that can't be calculated
+        self.others = [] # Outcomes with nested or random interactions
+        additive = [] # (partype, pop, intercept, list of rows of the coverage array, list of deltas)
+        nprogs = len(self.progkeys)
+        for thispartype in progset.targetpartypes:
+            self.outcomekeys[thispartype] = []
+            for thispop,progs in progset.progs_by_targetpar(thispartype).items():
+                self.outcomekeys[thispartype].append(thispop)
+                covout = progset.covout[thispartype][thispop]
+                ccopar = covout.getccopar(t=t, sample=sample)
+                intercept = array(ccopar['intercept'])
+                if thispartype in self.coveragepars: # Coverage-only: add the number covered from each population
+                    rows, deltas = [], []
+                    for prog in progs:
+                        rows.append(nprogs+self.progkeys.index(prog.short))
+                        if thispop == 'tot': deltas.append(ones(nyrs))
+                        else:                deltas.append(prog.gettargetcomposition(t=t, parset=parset)[thispop]*ones(nyrs))
+                    additive.append((thispartype, thispop, intercept, rows, deltas))
+                elif any([not covout.ccopars[prog.short] for prog in progs]):
+                    print('WARNING: no coverage-outcome function defined for a program targeting "%s" for "%s", skipping over... ' % (thispartype, thispop))
+                    self.none.append((thispartype, thispop))
+                else:
+                    delta = odict([(prog.short, array([ccopar[prog.short][j] - intercept[j] for j in range(nyrs)])) for prog in progs])
+                    if covout.interaction == 'additive' or len(progs)==1:
+                        additive.append((thispartype, thispop, intercept, [self.progkeys.index(prog.short) for prog in progs], delta.values()))
+                    elif covout.interaction in ['nested', 'random']:
+                        self.others.append((thispartype, thispop, covout.interaction, intercept, delta))
+                    else: raise OptimaException('Unknown reachability type "%s"',covout.interaction)
+        
+        # Pad the additive outcomes to the same number of programs, using a row of zeros in the coverage array
+        maxprogs = max([len(item[3]) for item in additive]) if additive else 0
+        self.additivekeys = [(item[0], item[1]) for item in additive]
+        self.intercepts = array([item[2] for item in additive]).reshape((len(additive), nyrs))
+        self.rows       = zeros((len(additive), maxprogs), dtype=int) + 2*nprogs # Index of the row of zeros
+        self.deltas     = zeros((len(additive), maxprogs, nyrs))
+        for i,item in enumerate(additive):
+            for j,(row,delta) in enumerate(zip(item[3], item[4])):
+                self.rows[i,j] = row
+                self.deltas[i,j,:] = delta
+        
+        # The parts of each parameter that don't depend on the budget
+        last_t = min(t) - settings.dt # Last timestep before the budget years, as in Programset.getpars()
+        self.parinfo = odict()
+        for outcome in self.outcomekeys.keys():
+            thispar = parset.pars[outcome]
+            last_y = thispar.interp(tvec=last_t, dt=settings.dt, asarray=False, usemeta=False) # Find what the model would get for this value
+            lower = float(thispar.limits[0])
+            upper = settings.convertlimits(limits=thispar.limits[1])
+            prefixes = odict()
+            for pop in self.outcomekeys[outcome]:
+                part, pary = thispar.t[pop], thispar.y[pop]
+                if last_t < max(part): # Remove years after the last good year
+                    part = part[findinds(part <= last_t)]
+                    pary = pary[findinds(part <= last_t)]
+                prefixes[pop] = (append(part, last_t), append(pary, last_y[pop]))
+            self.parinfo[outcome] = (lower, upper, prefixes)
+        return None
+
+
+    def __repr__(self):
+        ''' Print out useful information '''
+        output = defaultrepr(self)
+        return output
+
+
+    def matches(self, t=None, parset=None, progset=None, sample=None, checkpars=True):
+        '''
+        Check whether this can be used in place of the program set for these inputs. With checkpars=False, the
+        parameters aren't compared, which takes about as long as calculating them, e.g. for each budget in an
+        optimization that compiled this from the parset at the start.
+        '''
+        t = promotetoarray(t)
+        output = (parset.uid==self.parsetuid and progset.uid==self.progsetuid and sample==self.sample and len(t)==len(self.t) and all(t==self.t))
+        if output and checkpars: output = parskey(parset.pars)==self.parskey
+        return output
+
+
+    def getprogcoverage(self, budget=None):
+        ''' Return the number covered by each program for a budget, as Programset.getprogcoverage() '''
+        if isinstance(budget, list) or isinstance(budget,type(array([]))):
+            budget = odict(zip(self.progkeys, budget))
+        coverage = odict()
+        for key in self.progkeys:
+            if self.costcov[key] is None:
+                coverage[key] = None
+            else:
+                costcovfn, ccopar, popsize, eps = self.costcov[key]
+                x = promotetoarray(budget[key])
+                if len(x)!=len(self.t): raise OptimaException('Spending for program "%s" has %i values, but there are %i years' % (key, len(x), len(self.t)))
+                coverage[key] = costcovfn.function(x=x, ccopar=ccopar, popsize=popsize, eps=eps)
+        return coverage
+
+
+    def getoutcomes(self, coverage=None):
+        ''' Return the parameter values for the number covered by each program, as Programset.getoutcomes() '''
+        nyrs = len(self.t)
+        nprogs = len(self.progkeys)
+        
+        # Rows are the proportion covered, then the number covered, for each program, then zeros
+        covarray = zeros((2*nprogs+1, nyrs))
+        for p,key in enumerate(self.progkeys):
+            if coverage[key] is not None:
+                covarray[nprogs+p,:] = coverage[key]
+                if self.targetpopsizes[p] is not None: covarray[p,:] = coverage[key]/self.targetpopsizes[p]
+        
+        # Additive and coverage-only outcomes -- add each program in turn, as in the loop
+        values = self.intercepts.copy()
+        for j in range(self.rows.shape[1]):
+            values += covarray[self.rows[:,j],:]*self.deltas[:,j,:]
+        
+        # Assemble the outcomes
+        outcomes = odict()
+        for outcome in self.outcomekeys.keys(): outcomes[outcome] = odict.fromkeys(self.outcomekeys[outcome])
+        for i,(outcome,pop) in enumerate(self.additivekeys): outcomes[outcome][pop] = values[i,:]
+        for outcome,pop,interaction,intercept,delta in self.others:
+            thiscov = odict([(key, covarray[self.progkeys.index(key),:]) for key in delta.keys()])
+            if interaction=='nested': outcomes[outcome][pop] = nestedoutcome(intercept.copy(), thiscov, delta, nyrs)
+            else:                     outcomes[outcome][pop] = randomoutcome(intercept.copy(), thiscov, delta, nyrs)
+        return outcomes
+
+
+    def getpars(self, coverage=None, die=False, verbose=2):
+        '''
+        Return the parameters for the number covered by each program, as Programset.getpars() -- a Parsoverlay of
+        the parset's, so only the parameters affected by the programs are copied.
+        '''
+        outcomes = self.getoutcomes(coverage=coverage)
+        pars = Parsoverlay(self.pars)
+        for outcome in outcomes.keys():
+            thispar = pars.override(outcome)
+            lower, upper, prefixes = self.parinfo[outcome]
+            for pop in outcomes[outcome].keys():
+                thisoutcome = outcomes[outcome][pop]
+                if thisoutcome is not None:
+                    if any(array(thisoutcome<lower).flatten()) or any(array(thisoutcome>upper).flatten()):
+                        errormsg = 'Parameter value "%s" for population "%s" based on coverage is outside allowed limits: value=%s (%f, %f)' % (thispar.name, pop, thisoutcome, lower, upper)
+                        if die:
+                            raise OptimaException(errormsg)
+                        else:
+                            printv(errormsg, 3, verbose)
+                            thisoutcome = maximum(thisoutcome, lower) # Impose lower limit
+                            thisoutcome = minimum(thisoutcome, upper) # Impose upper limit
+                    thispar.t[pop] = append(prefixes[pop][0], self.t)
+                    thispar.y[pop] = append(prefixes[pop][1], thisoutcome)
+        return pars
+
+
 class Program(object):
     '''
     Defines a single program. 
@@ -1179,7 +1396,7 @@ class CCOF(object):
             if isinstance(t,list): ccopar[param] = ccopar[param].tolist()
 
         ccopar['t'] = t
-        printv('\nCalculated CCO parameters in year(s) %s to be %s' % (t, ccopar), 4, verbose)
+        if verbose>=4: printv('\nCalculated CCO parameters in year(s) %s to be %s' % (t, ccopar), 4, verbose) # Check first, since printing an odict is slow
         return ccopar
 
     def evaluate(self, x, popsize, t, toplot, inverse=False, sample='best', verbose=2):
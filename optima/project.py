@@ -1,9 +1,9 @@
-from optima import OptimaException, Settings, Parameterset, Programset, Resultset, BOC, Parscen, Budgetscen, Coveragescen, Progscen, Optim, Link # Import classes
+from optima import OptimaException, Settings, Parameterset, Programset, Resultset, BOC, bocreruns, closestBOCallocation, Parscen, Budgetscen, Coveragescen, Progscen, Optim, Link # Import classes
 from optima import odict, getdate, today, uuid, dcp, makefilepath, objrepr, printv, isnumber, saveobj, promotetolist, promotetoodict, sigfig # Import utilities
-from optima import loadspreadsheet, model, gitinfo, defaultscenarios, makesimpars, makespreadsheet
+from optima import loadspreadsheet, model, model_batch, gitinfo, defaultscenarios, makesimpars, makespreadsheet
 from optima import defaultobjectives, autofit, runscenarios, optimize, multioptimize, tvoptimize, outcomecalc, icers # Import functions
 from optima import version # Get current version
-from numpy import argmin, argsort, nan
+from numpy import argsort, nan
 from numpy.random import seed, randint
 import os
 
@@ -542,12 +542,14 @@ class Project(object):
     def runsim(self, name=None, pars=None, simpars=None, start=None, end=None, dt=None, tvec=None, 
                budget=None, coverage=None, budgetyears=None, data=None, n=1, sample=None, tosample=None, randseed=None,
                addresult=True, overwrite=True, keepraw=False, doround=True, die=True, debug=False, verbose=None, 
-               parsetname=None, progsetname=None, resultname=None, label=None, **kwargs):
+               parsetname=None, progsetname=None, resultname=None, label=None, rawonly=False, **kwargs):
         ''' 
         This function runs a single simulation, or multiple simulations if n>1. This is the
-        core function for actually running the model!!!!!!
+        core function for actually running the model!!!!!! Multiple simulations are run
+        together using model_batch(). Use rawonly=True to skip making a Resultset and just 
+        return the list of raw model outputs, e.g. for calcoutcomes().
         
-        Version: 2018jan13
+        Version: 2026oct18
         '''
         if dt      is None: dt      = self.settings.dt # Specify the timestep
         if verbose is None: verbose = self.settings.verbose
@@ -592,10 +594,11 @@ class Project(object):
             simparslist = promotetolist(simpars)
 
         # Run the model!
-        rawlist = []
-        for ind,simpars in enumerate(simparslist):
-            raw = model(simpars, self.settings, die=die, debug=debug, verbose=verbose, label=self.name, **kwargs) # ACTUALLY RUN THE MODEL
-            rawlist.append(raw)
+        if len(simparslist)>1: # Run all the simulations together
+            rawlist = model_batch(simparslist, self.settings, die=die, debug=debug, verbose=verbose, label=self.name, **kwargs) # ACTUALLY RUN THE MODEL
+        else:
+            rawlist = [model(simparslist[0], self.settings, die=die, debug=debug, verbose=verbose, label=self.name, **kwargs)]
+        if rawonly: return rawlist
 
         # Store results if required
         results = Resultset(name=resultname, pars=pars, parsetname=parsetname, progsetname=progsetname, raw=rawlist, simpars=simparslist, budget=budget, coverage=coverage, budgetyears=budgetyears, project=self, keepraw=keepraw, doround=doround, data=data, verbose=verbose) # Create structure for storing results
@@ -624,7 +627,13 @@ class Project(object):
 
 
     def autofit(self, name=None, orig=None, fitwhat='force', fitto='prev', method='wape', maxtime=None, maxiters=1000, verbose=2, doplot=False, randseed=None, **kwargs):
-        ''' Function to perform automatic fitting '''
+        ''' 
+        Function to perform automatic fitting -- see calibration.autofit() for the arguments, including nchains for
+        a multi-chain fit, e.g.
+            P.autofit(name='multi', orig='default', maxiters=200, nchains=4, nblocks=5)
+        
+        Version: 2026oct18
+        '''
         name, orig = self.reconcileparsets(name, orig) # Ensure that parset with the right name exists
         self.parsets[name] = autofit(project=self, name=name, fitwhat=fitwhat, fitto=fitto, method=method, maxtime=maxtime, maxiters=maxiters, verbose=verbose, doplot=doplot, randseed=randseed, **kwargs)
         results = self.runsim(name=name, addresult=False)
@@ -636,7 +645,12 @@ class Project(object):
     
     
     def runscenarios(self, scenlist=None, name=None, verbose=2, debug=False, nruns=None, base=None, ccsample=None, randseed=None, **kwargs):
-        ''' Function to run scenarios '''
+        ''' 
+        Function to run scenarios -- use ncpus to run them in parallel, e.g.
+            P.runscenarios(nruns=10, randseed=1, ncpus=4)
+        
+        Version: 2026oct18
+        '''
 
         if scenlist is not None: self.addscens(scenlist) # Replace existing scenario list with a new one
         if name is None: name = 'scenarios' 
@@ -755,6 +769,7 @@ class Project(object):
             P.optimize(optimname=-1) # Same as previous
             P.optimize(multi=True) # Do a multi-chain optimization
             P.optimize(multi=True, nchains=8, nblocks=10, blockiters=50) # Do a very large multi-chain optimization
+            P.optimize(mc=9, ncpus=8) # Run the extreme budgets and Monte Carlo optimizations in 8 worker processes
             P.optimize(timevarying=True, mc=0, maxiters=30) # Do a short time-varying optimization
             P.optimize(timevarying=True, mc=0, maxiters=200, tvconstrain=False, randseed=1) # Do a time-varying optimization, allowing total annual budget to vary
             
@@ -908,12 +923,9 @@ class Project(object):
         ''' Function to generate project-specific budget-outcome curve for geospatial analysis '''
         if name is None:
             name = 'BOC ' + self.name
-        boc = BOC(name=name)
         if objectives is None:
             printv('Warning, genBOC "%s" did not get objectives, using defaults...' % (self.name), 2, verbose)
             objectives = defaultobjectives(project=self, progsetname=progsetname)
-        boc.objectives = objectives
-        boc.constraints = constraints
         
         if parsetname is None:
             printv('Warning, using default parset', 3, verbose)
@@ -930,9 +942,6 @@ class Project(object):
         if 1.0 not in budgetratios:
             printv('Warning, current budget not present in budget ratios, adding...', 3, verbose)
             budgetratios = list(budgetratios).insert(0, 1.0) # Ensure 1.0 is in there
-        ybaseline = nan # Prepopulate, assuming it won't be found (which it probably will be)
-        yregionoptim = nan # The optimal y value for the within-region optimum
-        regionoptimbudget = None # The budget for the within-region optimum
         
         # Calculate the number of iterations
         noptims = 1 + (mc!=0) + max(abs(mc),0) # Calculate the number of optimizations per BOC point
@@ -947,10 +956,7 @@ class Project(object):
         budgetdict = odict()
         for budgetratio in budgetratios:
             budgetdict['%s'%budgetratio] = budgetratio # Store the budget ratios as a dictionary
-        tmpx = odict()
-        tmpy = odict()
-        tmptotals = odict()
-        tmpallocs = odict()
+        points = odict()
         counts = odict([(key,0) for key in budgetdict.keys()]) # Initialize to zeros -- count how many times each budget is run
         while len(budgetdict):
             key, ratio = budgetdict.items()[0] # Use first budget in the stack
@@ -959,61 +965,105 @@ class Project(object):
             thiscount = sum(counts[:])
             totalcount = len(budgetdict)+sum(counts[:])-1
             printv('Running budget %i/%i ($%0.0f)' % (thiscount, totalcount, budget), 2, verbose)
-            objectives['budget'] = budget
-            optim = Optim(project=self, name=name, objectives=objectives, constraints=constraints, parsetname=parsetname, progsetname=progsetname)
             
             # All subsequent genBOC steps use the allocation of the previous step as its initial budget, scaled up internally within optimization.py of course.
-            if len(tmptotals):
-                closest = argmin(abs(tmptotals[:]-budget)) # Find closest budget
-                origbudget = tmpallocs[closest]
+            if len(points):
+                origbudget = closestBOCallocation(points, budget)
             label = self.name+' $%sm (%i/%i)' % (sigfig(budget/1e6, sigfigs=3), thiscount, totalcount)
             
             # Actually run
-            results = optimize(optim=optim, maxiters=maxiters, maxtime=maxtime, verbose=verbose, stoppingfunc=stoppingfunc, origbudget=origbudget, label=label, mc=mc, die=die, randseed=randseed, **kwargs)
-            tmptotals[key] = budget
-            tmpallocs[key] = dcp(results.budgets.findbykey('Optim'))
-            tmpx[key] = budget # Used to be append, but can't use lists since can iterate multiple times over a single budget
-            tmpy[key] = results.outcome
-            boc.budgets[key] = tmpallocs[-1]
-            if ratio==1.0: # Check if ratio is 1, and if so, store the baseline
-                ybaseline = results.extremeoutcomes.findbykey('Base') # Store baseline result, but also not part of the BOC
-                yregionoptim = results.outcome
-                regionoptimbudget = budget
+            points[key] = self.genBOCpoint(ratio, name=name, parsetname=parsetname, progsetname=progsetname, objectives=objectives, constraints=constraints, maxiters=maxiters, maxtime=maxtime, 
+                                           verbose=verbose, stoppingfunc=stoppingfunc, mc=mc, die=die, randseed=randseed, origbudget=origbudget, label=label, **kwargs)
+            lastkey = key
             
             # Check that the BOC points are monotonic, and if not, rerun
             budgetdict.pop(key) # Remove the current key from the list
-            for oldkey in tmpy.keys():
-                if tmpy[oldkey]>tmpy[key] and tmptotals[oldkey]>tmptotals[key]: # Outcome is worse but budget is larger
-                    printv('WARNING, outcome for %s is worse than outcome for %s, rerunning...' % (oldkey, key), 1, verbose)
-                    if counts[oldkey]<5: # Don't get stuck in an infinite loop -- 5 is arbitrary, but jeez, that should take care of it
-                        budgetdict.insert(0, oldkey, float(oldkey)) # e.g. key2='0.8'
-                    else:
-                        printv('WARNING, tried 5 times to reoptimize budget and unable to get lower', 1, verbose) # Give up
+            for oldkey in bocreruns(points, keys=[key]):
+                printv('WARNING, outcome for %s is worse than outcome for %s, rerunning...' % (oldkey, key), 1, verbose)
+                if counts[oldkey]<5: # Don't get stuck in an infinite loop -- 5 is arbitrary, but jeez, that should take care of it
+                    budgetdict.insert(0, oldkey, float(oldkey)) # e.g. key2='0.8'
+                else:
+                    printv('WARNING, tried 5 times to reoptimize budget and unable to get lower', 1, verbose) # Give up
                         
         # Tidy up: insert remaining points
         if sum(counts[:]):
-            boc.parsetname = parsetname
-            boc.progsetname = progsetname
-            xorder = argsort(tmpx[:]) # Sort everything
-            boc.x = tmpx[:][xorder].tolist() # Convert to list
-            boc.y = tmpy[:][xorder].tolist()
-            boc.budgets.sort(xorder)
-            boc.x.insert(0, 0) # Add the zero-budget point to the beginning of the list
-            boc.y.insert(0, results.extremeoutcomes['Zero']) # It doesn't matter which results these come from
-            boc.yinf      = results.extremeoutcomes['Infinite'] # Store infinite money, but not as part of the BOC
-            boc.ybaseline = ybaseline # Has to be calculated out of the loop since this changes depending on the budget
-            boc.yregionoptim = yregionoptim # Outcome for within-region optimization
-            boc.defaultbudget = dcp(defaultbudget) # Default budget
-            boc.regionoptimbudget = dcp(regionoptimbudget) # Within-region-optimal budget
-            boc.bocsettings = odict([('maxiters',maxiters),('maxtime',maxtime),('mc',mc),('randseed',randseed)])
-            self.addresult(result=boc)
-            self.modified = today()
+            self.makeBOC(points, name=name, parsetname=parsetname, progsetname=progsetname, objectives=objectives, constraints=constraints, 
+                         maxiters=maxiters, maxtime=maxtime, mc=mc, randseed=randseed, extremekey=lastkey)
         else:
             errormsg = 'BOC generation failed: no BOC points were calculated'
             raise OptimaException(errormsg)
         return None        
     
     
+    def genBOCpoint(self, budgetratio=1.0, name=None, parsetname=-1, progsetname=-1, objectives=None, constraints=None, maxiters=1000, 
+                    maxtime=None, verbose=2, stoppingfunc=None, mc=3, die=False, randseed=None, origbudget=None, label=None, **kwargs):
+        ''' 
+        Run the optimization for one point of a BOC, i.e. the default budget times budgetratio. Returns an odict of
+        the budget ratio, total budget, outcome, optimized allocation, and extreme outcomes, for makeBOC(). Points can
+        be run independently, e.g. in parallel, then checked with bocreruns() and combined with makeBOC().
+        
+        Version: 2026oct18
+        '''
+        if name is None:
+            name = 'BOC ' + self.name
+        if objectives is None:
+            objectives = defaultobjectives(project=self, progsetname=progsetname)
+        defaultbudget = self.progsets[progsetname].getdefaultbudget()
+        budget = budgetratio*sum(defaultbudget[:])
+        objectives['budget'] = budget
+        optim = Optim(project=self, name=name, objectives=objectives, constraints=constraints, parsetname=parsetname, progsetname=progsetname)
+        results = optimize(optim=optim, maxiters=maxiters, maxtime=maxtime, verbose=verbose, stoppingfunc=stoppingfunc, origbudget=origbudget, label=label, mc=mc, die=die, randseed=randseed, **kwargs)
+        point = odict()
+        point['ratio'] = budgetratio
+        point['budget'] = budget
+        point['outcome'] = results.outcome
+        point['alloc'] = dcp(results.budgets.findbykey('Optim'))
+        point['extremeoutcomes'] = results.extremeoutcomes
+        return point
+    
+    
+    def makeBOC(self, points=None, name=None, parsetname=-1, progsetname=-1, objectives=None, constraints=None, maxiters=None, maxtime=None, mc=None, randseed=None, extremekey=-1):
+        ''' 
+        Make a BOC from an odict of points from genBOCpoint(), keyed by budget ratio, and add it to the project's results.
+        The zero and infinite budget outcomes are taken from the point with extremekey (by default the last).
+        
+        Version: 2026oct18
+        '''
+        if name is None:
+            name = 'BOC ' + self.name
+        boc = BOC(name=name)
+        boc.objectives = objectives
+        boc.constraints = constraints
+        boc.parsetname = parsetname
+        boc.progsetname = progsetname
+        keys = points.keys()
+        x = [points[key]['budget'] for key in keys]
+        xorder = argsort(x) # Sort everything
+        boc.x = [x[i] for i in xorder]
+        boc.y = [points[keys[i]]['outcome'] for i in xorder]
+        for i in xorder: 
+            boc.budgets[keys[i]] = points[keys[i]]['alloc']
+        boc.x.insert(0, 0) # Add the zero-budget point to the beginning of the list
+        boc.y.insert(0, points[extremekey]['extremeoutcomes']['Zero']) # It doesn't matter which results these come from
+        boc.yinf = points[extremekey]['extremeoutcomes']['Infinite'] # Store infinite money, but not as part of the BOC
+        ybaseline = nan # Prepopulate, assuming it won't be found (which it probably will be)
+        yregionoptim = nan # The optimal y value for the within-region optimum
+        regionoptimbudget = None # The budget for the within-region optimum
+        for point in points.values():
+            if point['ratio']==1.0: # Check if ratio is 1, and if so, store the baseline
+                ybaseline = point['extremeoutcomes'].findbykey('Base') # Store baseline result, but also not part of the BOC
+                yregionoptim = point['outcome']
+                regionoptimbudget = point['budget']
+        boc.ybaseline = ybaseline # Has to be calculated out of the loop since this changes depending on the budget
+        boc.yregionoptim = yregionoptim # Outcome for within-region optimization
+        boc.defaultbudget = dcp(self.progsets[progsetname].getdefaultbudget()) # Default budget
+        boc.regionoptimbudget = dcp(regionoptimbudget) # Within-region-optimal budget
+        boc.bocsettings = odict([('maxiters',maxiters),('maxtime',maxtime),('mc',mc),('randseed',randseed)])
+        self.addresult(result=boc)
+        self.modified = today()
+        return boc
+    
+    
     def getBOC(self, objectives=None, strict=False, verbose=2):
         ''' Returns a BOC result with the desired objectives (budget notwithstanding) if it exists, else None '''
         
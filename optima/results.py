@@ -7,7 +7,7 @@ Version: 2018nov19
 from optima import OptimaException, Link, Settings, odict, pchip, plotpchip, sigfig # Classes/functions
 from optima import uuid, today, makefilepath, getdate, printv, dcp, objrepr, defaultrepr, sanitizefilename, sanitize # Printing/file utilities
 from optima import quantile, findinds, findnearest, promotetolist, promotetoarray, checktype # Numeric utilities
-from numpy import array, nan, zeros, arange, shape, maximum, log
+from numpy import array, nan, zeros, arange, shape, maximum, log, argmin
 from numbers import Number
 from xlsxwriter import Workbook
 
@@ -414,38 +414,7 @@ class Resultset(object):
 
         
         # Calculate DALYs
-        
-        ## Years of life lost
-        yllpops = alldeaths.sum(axis=1) # Total deaths per population, sum over health states
-        for pk,popkey in enumerate(self.popkeys): # Loop over each population
-            meanage = self.pars['age'][pk].mean()
-            potentialyearslost = max(0,lifeexpectancy-meanage) # Don't let this go negative!
-            if discountrate>0 and discountrate<1: # Make sure it has reasonable bounds
-                denominator = log(1-discountrate) # Start calculating the integral of (1-discountrate)**potentialyearslost
-                numerator = (1-discountrate)**potentialyearslost - 1 # Minus 1 for t=0
-                discountedyearslost = numerator/denominator # See https://en.wikipedia.org/wiki/Lists_of_integrals#Exponential_functions
-            elif discountrate==0: # Nothing to discount
-                discountedyearslost = potentialyearslost
-            else:
-                raise OptimaException('Invalid discount rate (%s)' % discountrate)
-            yllpops[:,pk,:] *= discountedyearslost # Multiply by the number of potential years of life lost
-        ylltot = yllpops.sum(axis=1) # Sum over populations
-        
-        ## Years lived with disability
-        disutiltx = self.pars['disutiltx'].y
-        disutils = [self.pars['disutil'+key].y for key in self.settings.hivstates]
-        yldpops = allpeople[:,alltx,:,:].sum(axis=1)     * disutiltx
-        yldtot  = allpeople[:,alltx,:,:].sum(axis=(1,2)) * disutiltx
-        notonart = set(self.settings.notonart)
-        for h,key in enumerate(self.settings.hivstates): # Loop over health states
-            hivstateindices = set(getattr(self.settings,key))
-            healthstates = array(list(hivstateindices & notonart)) # Find the intersection of this HIV state and not on ART states
-            yldpops += allpeople[:,healthstates,:,:].sum(axis=1) * disutils[h]
-            yldtot += allpeople[:,healthstates,:,:].sum(axis=(1,2)) * disutils[h]
-        
-        ## Add them up
-        dalypops = yllpops + yldpops
-        dalytot  = ylltot + yldtot
+        dalypops, dalytot = calcdalys(allpeople, alldeaths, pars=self.pars, settings=self.settings, lifeexpectancy=lifeexpectancy, discountrate=discountrate)
         self.main['numdaly'].pops = process(dalypops[:,:,indices])
         self.main['numdaly'].tot  = process(dalytot[:,indices])
         
@@ -974,6 +943,30 @@ class BOC(object):
 
 
 
+def bocreruns(points=None, keys=None):
+    '''
+    Find the BOC points that need to be rerun because a smaller budget has a better outcome, given an odict
+    of points from Project.genBOCpoint(). If keys are supplied, only compare against those points, e.g. ones
+    that have just been run.
+    
+    Version: 2026oct18
+    '''
+    if keys is None: keys = points.keys()
+    reruns = []
+    for key in keys:
+        for oldkey in points.keys():
+            if points[oldkey]['outcome']>points[key]['outcome'] and points[oldkey]['budget']>points[key]['budget'] and oldkey not in reruns: # Outcome is worse but budget is larger
+                reruns.append(oldkey)
+    return reruns
+
+
+def closestBOCallocation(points=None, budget=None):
+    ''' Get the optimized allocation of the BOC point with the total budget closest to this one, to start from '''
+    budgets = array([point['budget'] for point in points.values()])
+    return points[argmin(abs(budgets-budget))]['alloc']
+
+
+
 class ICER(object):
     ''' Structure to hold the results of an ICER run; similar to the BOC class '''
     
@@ -1005,6 +998,101 @@ class ICER(object):
 
 
 
+def calcdalys(allpeople=None, alldeaths=None, pars=None, settings=None, lifeexpectancy=None, discountrate=None):
+    '''
+    Calculate DALYs from the people and deaths arrays of one or more model runs (with the runs along the first
+    axis), as years of life lost plus years lived with disability. Returns DALYs by population and in total.
+    '''
+    if lifeexpectancy is None: lifeexpectancy = 80 # 80 year life expectancy
+    if discountrate   is None: discountrate   = 0.03 # Discounting of 3% for YLL only
+    
+    ## Years of life lost
+    yllpops = alldeaths.sum(axis=1) # Total deaths per population, sum over health states
+    for pk in range(yllpops.shape[1]): # Loop over each population
+        meanage = pars['age'][pk].mean()
+        potentialyearslost = max(0,lifeexpectancy-meanage) # Don't let this go negative!
+        if discountrate>0 and discountrate<1: # Make sure it has reasonable bounds
+            denominator = log(1-discountrate) # Start calculating the integral of (1-discountrate)**potentialyearslost
+            numerator = (1-discountrate)**potentialyearslost - 1 # Minus 1 for t=0
+            discountedyearslost = numerator/denominator # See https://en.wikipedia.org/wiki/Lists_of_integrals#Exponential_functions
+        elif discountrate==0: # Nothing to discount
+            discountedyearslost = potentialyearslost
+        else:
+            raise OptimaException('Invalid discount rate (%s)' % discountrate)
+        yllpops[:,pk,:] *= discountedyearslost # Multiply by the number of potential years of life lost
+    ylltot = yllpops.sum(axis=1) # Sum over populations
+    
+    ## Years lived with disability
+    alltx = settings.alltx
+    disutiltx = pars['disutiltx'].y
+    disutils = [pars['disutil'+key].y for key in settings.hivstates]
+    yldpops = allpeople[:,alltx,:,:].sum(axis=1)     * disutiltx
+    yldtot  = allpeople[:,alltx,:,:].sum(axis=(1,2)) * disutiltx
+    notonart = set(settings.notonart)
+    for h,key in enumerate(settings.hivstates): # Loop over health states
+        hivstateindices = set(getattr(settings,key))
+        healthstates = array(list(hivstateindices & notonart)) # Find the intersection of this HIV state and not on ART states
+        yldpops += allpeople[:,healthstates,:,:].sum(axis=1) * disutils[h]
+        yldtot += allpeople[:,healthstates,:,:].sum(axis=(1,2)) * disutils[h]
+    
+    ## Add them up
+    dalypops = yllpops + yldpops
+    dalytot  = ylltot + yldtot
+    return dalypops, dalytot
+
+
+
+def calcoutcomes(raw=None, keys=None, pars=None, settings=None, annual=True, bypop=False):
+    '''
+    Calculate the totals for a few of the main results directly from the output of a single model run, without
+    making a Resultset. This is used by outcomecalc() for each step of an optimization, where only the objectives
+    are needed, and by autofit(). Returns the time vector and an odict of the results, which are the same as
+    results.main[key].tot[0] (or results.main[key].pops[0] with bypop=True) from a Resultset made with doround=False.
+    
+    Available keys are numinci, numincibypop, numnewdiag, numdeath, numdaly, numplhiv, numaids, numdiag, numevercare,
+    numincare, numtreat, numsuppressed, popsize, prev, propdiag, propevercare, propincare, proptreat and propsuppressed.
+    
+    Version: 2026oct18
+    '''
+    if settings is None: settings = Settings()
+    keys = promotetolist(keys)
+    tvec = raw['tvec']
+    if annual: indices = arange(0, len(tvec), int(round(1.0/(tvec[1]-tvec[0])))) # Subsample, as in Resultset.make()
+    else:      indices = arange(len(tvec))
+    eps = settings.eps
+    allpeople = raw['people'][None] # Add an axis for the run, so the calculations are the same as in Resultset.make()
+    axis = 1 if bypop else (1,2) # Sum over health states, and populations too for the totals
+    
+    # Define the states needed for each number or proportion
+    numstates = {'numplhiv':settings.allplhiv, 'numaids':settings.allaids, 'numdiag':settings.alldx, 'numevercare':settings.allevercare, 
+                 'numincare':settings.allcare, 'numtreat':settings.alltx, 'numsuppressed':settings.svl}
+    propstates = {'propdiag':       (settings.alldx,       settings.allplhiv),
+                  'propevercare':   (settings.allevercare, settings.alldx),
+                  'propincare':     (settings.allcare,     settings.alldx),
+                  'proptreat':      (settings.alltx,       settings.alldx),
+                  'propsuppressed': (settings.svl,         settings.alltx)}
+    flows = {'numinci':'inci', 'numincibypop':'incibypop', 'numnewdiag':'diag'} # Outputs that are already by population
+    
+    outcomes = odict()
+    for key in keys:
+        if key in flows:
+            outcome = raw[flows[key]][None,:,indices]
+            outcomes[key] = outcome[0] if bypop else outcome.sum(axis=1)[0]
+        elif key=='numdeath':    outcomes[key] = raw['death'][None,:,:,indices].sum(axis=axis)[0]
+        elif key=='numdaly':     outcomes[key] = calcdalys(allpeople, raw['death'][None], pars=pars, settings=settings)[0 if bypop else 1][...,indices][0]
+        elif key=='popsize':     outcomes[key] = allpeople[:,:,:,indices].sum(axis=axis)[0]
+        elif key=='prev':        outcomes[key] = (allpeople[:,settings.allplhiv,:,:][:,:,:,indices].sum(axis=axis) / (eps+allpeople[:,:,:,indices].sum(axis=axis)))[0]
+        elif key in numstates:   outcomes[key] = allpeople[:,numstates[key],:,:][:,:,:,indices].sum(axis=axis)[0]
+        elif key in propstates:
+            numer,denom = propstates[key]
+            outcomes[key] = (allpeople[:,numer,:,:][:,:,:,indices].sum(axis=axis)/maximum(allpeople[:,denom,:,:][:,:,:,indices].sum(axis=axis),eps))[0]
+        else:
+            errormsg = 'Outcome "%s" not available without making a Resultset; choices are: %s' % (key, list(flows.keys())+['numdeath', 'numdaly', 'popsize', 'prev']+list(numstates.keys())+list(propstates.keys()))
+            raise OptimaException(errormsg)
+    return tvec[indices], outcomes
+
+
+
 def getresults(project=None, pointer=None, die=True):
     '''
     Function for returning the results associated with something. 'pointer' can eiher be a UID,
@@ -1,14 +1,20 @@
 '''
 Define classes and functions for handling scenarios and ICERs.
 
-Version: 2017jun03
+Version: 2026oct18
 '''
 
 ## Imports
 from numpy import append, array, inf
+from numpy.random import RandomState, get_state, set_state
+from random import seed as pyseed, getstate as pygetstate, setstate as pysetstate
 from optima import OptimaException, Link, Multiresultset # Core classes/functions
 from optima import dcp, today, odict, printv, findinds, defaultrepr, getresults, vec2obj, isnumber, uuid, promotetoarray # Utilities
 
+# Import dependencies here so no biggie if they fail
+try:    from concurrent.futures import ProcessPoolExecutor
+except: ProcessPoolExecutor = None # OK to skip this if ncpus is not set
+
 class Scen(object):
     ''' The scenario base class -- not to be used directly, instead use Parscen or Progscen '''
     def __init__(self, name=None, parsetname=-1, progsetname=-1, t=None, active=True):
@@ -66,10 +72,15 @@ class Coveragescen(Progscen):
         self.coverage = coverage
 
 
-def runscenarios(project=None, verbose=2, name=None, defaultparset=-1, debug=False, nruns=None, base=None, ccsample=None, randseed=None, **kwargs):
+def runscenarios(project=None, verbose=2, name=None, defaultparset=-1, debug=False, nruns=None, base=None, ccsample=None, randseed=None, ncpus=None, **kwargs):
     """
-    Run all the scenarios.
-    Version: 2017aug15
+    Run all the scenarios. If ncpus is more than 1, the scenarios are built and run in that many worker processes,
+    each of which has a copy of the project and only builds the scenario it is running (see runscenario_task()).
+    Each scenario is seeded with its own random seed, drawn from randseed, so the results are the same whether the
+    scenarios are run in series or in parallel, and are returned in the same order. The global random state is
+    left as it was.
+    
+    Version: 2026oct18
     """
     
     printv('Running scenarios...', 1, verbose)
@@ -86,30 +97,34 @@ def runscenarios(project=None, verbose=2, name=None, defaultparset=-1, debug=Fal
     if ccsample is None: ccsample = 'best' 
     if nruns is None:    nruns = 1
     if base is None:     base = 0
+    scenseeds = RandomState(randseed).randint(0, 2**31-1, size=nscens).tolist() # One for each scenario, so they don't depend on which ones have been run already
     
-    # Convert the list of scenarios to the actual parameters to use in the model
-    scenparsets = makescenarios(project=project, scenlist=scenlist, ccsample=ccsample, randseed=randseed, verbose=verbose)        
-
-    # Run scenarios
+    # Convert each scenario to the actual parameters to use in the model, and run it
     allresults = []
-    for scenno, scen in enumerate(scenparsets):
-        printv('Running scenario "%s" (%i/%i)...' % (scen, scenno+1, nscens), 2, verbose)
-        scenparset = scenparsets[scen]
-        project.scens[scenno].scenparset = scenparset # Copy into scenarios objects
-        
-
-        # Items specific to program (budget or coverage) scenarios
-        budget = scenlist[scenno].budget if isinstance(scenlist[scenno], Progscen) else None
-        coverage = scenlist[scenno].coverage if isinstance(scenlist[scenno], Progscen) else None
-        budgetyears = scenlist[scenno].t if isinstance(scenlist[scenno], Progscen) else None
-        progsetname = scenlist[scenno].progsetname if isinstance(scenlist[scenno], Progscen) else None
-
-        # Run model and add results
-        result = project.runsim(pars=scenparset.pars, name=scenlist[scenno].parsetname, progsetname=progsetname, budget=budget, coverage=coverage, budgetyears=budgetyears, verbose=0, debug=debug, resultname=project.name+'-scenarios', addresult=False, n=nruns, **kwargs)
-
-        result.name = scenlist[scenno].name # Give a name to these results so can be accessed for the plot legend
-        allresults.append(result) 
-        printv('... completed scenario: %i/%i' % (scenno+1, nscens), 3, verbose)
+    if ncpus and ncpus>1 and nscens>1:
+        if ProcessPoolExecutor is None:
+            raise OptimaException('Running scenarios in parallel requires the concurrent.futures module')
+        printv('Running %i scenarios in %i worker processes...' % (nscens, ncpus), 2, verbose)
+        pool = ProcessPoolExecutor(max_workers=min(ncpus,nscens), initializer=initscenpool_task, initargs=(project,))
+        try:
+            scenkeys = [key for key,scen in project.scens.items() if scen.active==True] # The workers look up their own copies of the scenarios
+            outputs = pool.map(runscenario_task, scenkeys, scenseeds, [ccsample]*nscens, [nruns]*nscens, [debug]*nscens, [kwargs]*nscens)
+            for scenno,(scenattrs, scenparset, result) in enumerate(outputs): # In order, as they finish
+                for key,value in scenattrs.items(): setattr(scenlist[scenno], key, value) # Set by makescenarios()
+                scenparset.projectref = Link(project)
+                result.projectref = Link(project)
+                project.scens[scenno].scenparset = scenparset # Copy into scenarios objects
+                allresults.append(result)
+                printv('... completed scenario: %i/%i' % (scenno+1, nscens), 3, verbose)
+        finally:
+            pool.shutdown()
+    else:
+        for scenno, scen in enumerate(scenlist):
+            printv('Running scenario "%s" (%i/%i)...' % (scen.name, scenno+1, nscens), 2, verbose)
+            scenparset, result = runscenario(project=project, scen=scen, randseed=scenseeds[scenno], ccsample=ccsample, nruns=nruns, debug=debug, verbose=verbose, **kwargs)
+            project.scens[scenno].scenparset = scenparset # Copy into scenarios objects
+            allresults.append(result) 
+            printv('... completed scenario: %i/%i' % (scenno+1, nscens), 3, verbose)
     
     if name is None: name='scenarios'
 
@@ -120,17 +135,68 @@ def runscenarios(project=None, verbose=2, name=None, defaultparset=-1, debug=Fal
     return scenres
 
 
+def runscenario(project=None, scen=None, randseed=None, ccsample=None, nruns=1, debug=False, verbose=2, **kwargs):
+    ''' Build a single scenario with makescenarios() and run it, seeding both with randseed; returns the scenario's parset and results '''
+    scenparset = makescenarios(project=project, scenlist=[scen], ccsample=ccsample, randseed=randseed, verbose=verbose)[0]
+
+    # Items specific to program (budget or coverage) scenarios
+    budget = scen.budget if isinstance(scen, Progscen) else None
+    coverage = scen.coverage if isinstance(scen, Progscen) else None
+    budgetyears = scen.t if isinstance(scen, Progscen) else None
+    progsetname = scen.progsetname if isinstance(scen, Progscen) else None
+
+    # Run model and add results -- runsim() seeds numpy's global random state with randseed, so restore it afterwards
+    randstate = get_state()
+    try:
+        result = project.runsim(pars=scenparset.pars, name=scen.parsetname, progsetname=progsetname, budget=budget, coverage=coverage, budgetyears=budgetyears, verbose=0, debug=debug, resultname=project.name+'-scenarios', addresult=False, n=nruns, randseed=randseed, **kwargs)
+    finally:
+        set_state(randstate)
+    result.name = scen.name # Give a name to these results so can be accessed for the plot legend
+    return scenparset, result
+
+
+
+## Worker processes for running scenarios in parallel -- tasks have to be standalone functions, see batchtools.py
+poolproject = None # The project used by tasks in a worker process, set by initscenpool_task()
+
+def initscenpool_task(project=None):
+    ''' Store the project once per worker process, rather than sending it with every scenario '''
+    global poolproject
+    poolproject = project
+    return None
+
+
+def runscenario_task(scenkey=None, randseed=None, ccsample=None, nruns=1, debug=False, kwargs=None):
+    ''' Run runscenario() in a worker process, returning the scenario attributes set by makescenarios() as well '''
+    scen = poolproject.scens[scenkey]
+    scenparset, result = runscenario(project=poolproject, scen=scen, randseed=randseed, ccsample=ccsample, nruns=nruns, debug=debug, verbose=0, **kwargs)
+    scenparset.projectref = Link() # Don't send the project back -- restored by the main process
+    result.projectref = Link()
+    scenattrs = odict([(key, getattr(scen, key)) for key in ['t', 'pars', 'budget', 'coverage'] if hasattr(scen, key)])
+    return scenattrs, scenparset, result
+
+
 
 
 
 def makescenarios(project=None, scenlist=None, verbose=2, ccsample=False, randseed=None):
-    """ Convert dictionary of scenario parameters into parset to model parameters """
+    """ 
+    Convert dictionary of scenario parameters into parset to model parameters. The parsets are overlays of the
+    project's (see Parameterset.overlay()), so only the parameters each scenario changes are copied. If randseed is
+    given, it seeds the cost-coverage-outcome samples drawn if ccsample is 'random'.
+    
+    Version: 2026oct18
+    """
 
+    if randseed is not None: # Seed the samples (see CCOF.getccopar()), then restore the random state once done
+        randstate = pygetstate()
+        pyseed(randseed)
+    
     scenparsets = odict()
     for scenno, scen in enumerate(scenlist):
         
         try: 
-            thisparset = dcp(project.parsets[scen.parsetname])
+            thisparset = project.parsets[scen.parsetname].overlay() # Only the parameters the scenario changes are copied
             thisparset.projectref = Link(project) # Replace copy of project with pointer -- TODO: improve logic
         except: raise OptimaException('Failed to extract parset "%s" from this project:\n%s' % (scen.parsetname, project))
         npops = len(thisparset.popkeys)
@@ -139,8 +205,8 @@ def makescenarios(project=None, scenlist=None, verbose=2, ccsample=False, randse
             if scenlist[scenno].pars is None: scenlist[scenno].pars = [] # Turn into empty list instead of None
             for scenpar in scenlist[scenno].pars: # Loop over all parameters being changed
 
-                # Get the parameter object
-                thispar = thisparset.pars[scenpar['name']]
+                # Get a copy of the parameter object to change
+                thispar = thisparset.pars.override(scenpar['name'])
 
                 # Parse inputs to figure out which population(s) are affected
                 if type(scenpar['for'])==tuple: # If it's a partnership...
@@ -184,7 +250,7 @@ def makescenarios(project=None, scenlist=None, verbose=2, ccsample=False, randse
                             this_y = thispar.interp(tvec=scenpar['startyear'], usemeta=False)[popind] # Find what the model would get for this value
                         else:
                             this_y = inf # Another special value, indicating this should be filled in to the maximum                 
-                            fixproppar = thisparset.pars['fix'+scenpar['name']] # Pull out e.g. fixpropdx
+                            fixproppar = thisparset.pars.override('fix'+scenpar['name']) # Pull out e.g. fixpropdx
                             fixproppar.t = min(fixproppar.t, scenpar['startyear']) # Reset start year to the lower of these
                     
                     # Remove years after the last good year
@@ -272,7 +338,8 @@ def makescenarios(project=None, scenlist=None, verbose=2, ccsample=False, randse
         thisparset.modified = today()
         thisparset.name = scen.name
         scenparsets[scen.name] = thisparset
-        
+    
+    if randseed is not None: pysetstate(randstate)
     return scenparsets
 
 
@@ -5,7 +5,7 @@ import logging
 import matplotlib.pyplot as ppl
 import redis
 
-from flask import Flask, abort, jsonify, request, json, helpers
+from flask import Flask, Response, abort, jsonify, request, json, helpers, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from werkzeug.utils import secure_filename
@@ -123,6 +123,10 @@ app.register_blueprint(api_blueprint, url_prefix='')
 # rpcDownload will receive and save a file on the client, the target function
 # will directly receive the args and kwargs
 
+# /api/download/stream is like rpcDownload, but the target function
+# returns a filename and a generator of the file's contents, which are
+# sent as they are made, rather than saved on the server first
+
 # rpcUpload will send a file to the webserver, the target function
 # will receive the filename of the saved file as the first arg, and
 # the args from the function after, as well as kwargs
@@ -220,6 +224,35 @@ def get_remote_file():
     return response
 
 
+@app.route('/api/download/stream', methods=['POST'])
+@report_exception_decorator
+@login_required
+def get_remote_stream():
+    """
+    url-args:
+        'name': string name of function in dataio
+        'args': list of arguments for the function
+        'kwargs': dictionary of named parameters for the function
+    """
+    json = get_post_data_json()
+
+    fn_name = json['name']
+    print('>> Checking function "dataio.%s" -> %s' % (fn_name, hasattr(dataio, fn_name)))
+    fn = getattr(dataio, fn_name)
+
+    args = json.get('args', [])
+    kwargs = json.get('kwargs', {})
+
+    filename, chunks = fn(*args, **kwargs)
+
+    response = Response(stream_with_context(chunks), mimetype='application/octet-stream')
+    response.status_code = 201
+    response.headers["Content-Disposition"] = 'attachment; filename="%s"' % filename
+    response.headers["filename"] = filename
+
+    return response
+
+
 @app.route('/api/upload', methods=['POST'])
 @report_exception_decorator
 def receive_uploaded_file():
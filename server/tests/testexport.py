@@ -0,0 +1,101 @@
+"""
+Test the incremental export of projects used by bin/backup.py (see dataio.download_zip_of_projects).
+
+This needs the server's dependencies, and Postgres and Redis set up as for running the server (see
+server/config.example.py); set OPTIMA_TEST_CFG to the path of a config file to use separate test databases.
+Run from the repository root with e.g.
+
+python server/tests/testexport.py
+
+Version: 2026oct18
+"""
+
+## Define tests to run here!!!
+tests = [
+'progsetexport',
+]
+
+
+##############################################################################
+## Initialization -- same for every test script
+##############################################################################
+
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from optima import tic, toc, blank, pd # analysis:ignore
+
+def done(t=0):
+    print('Done.')
+    toc(t)
+    blank()
+
+blank()
+print('Running tests:')
+for i,test in enumerate(tests): print(('%i.  '+test) % (i+1))
+blank()
+
+
+
+##############################################################################
+## The tests
+##############################################################################
+
+T = tic()
+
+
+## Incremental export after saving a program set
+if 'progsetexport' in tests:
+    t = tic()
+
+    print('Running incremental export test...')
+    import json
+    from io import BytesIO
+    from time import sleep
+    from zipfile import ZipFile
+    from flask_login import login_user
+    from optima import defaultproject
+    from server.api import app
+    from server.webapp import dataio, parse
+    from server.webapp.dbconn import db
+    from server.webapp.dbmodels import UserDb
+
+    def export(project_id, since=None):
+        ''' Run an export and return its index, projects.json '''
+        filename, generator = dataio.download_zip_of_projects(project_ids=[project_id], since=since)
+        with ZipFile(BytesIO(b''.join(generator))) as zipfile:
+            return json.loads(zipfile.read('projects.json').decode('utf-8'))
+
+    with app.test_request_context():
+        user = UserDb(name='Export test', email='exporttest@optima.test', password='exporttest', username='exporttest', country='', organization='', position='')
+        db.session.add(user)
+        db.session.commit()
+        login_user(user)
+        project_id = None
+        try:
+            P = defaultproject('best', dorun=False)
+            dataio.save_project_as_new(P, user.id)
+            project_id = P.uid
+            first = export(project_id)
+            assert first['projects'][0]['included'], 'A full export should include every project'
+
+            # Nothing has changed since the first export, so the project should be left out
+            sleep(1.1) # Export times are in whole seconds
+            unchanged = export(project_id, since=first['time'])
+            assert not unchanged['projects'][0]['included'], 'An unchanged project should not be exported again'
+
+            # Saving a program set, which doesn't go through update_project_with_fn(), should count as a change
+            progsetsummary = json.loads(json.dumps(parse.normalize_obj(parse.get_progset_summary(P, P.progsets[0].name))))
+            dataio.save_progset(project_id, progsetsummary['id'], progsetsummary)
+            changed = export(project_id, since=unchanged['time'])
+            assert changed['projects'][0]['included'], 'A project with a saved program set should be exported again'
+        finally:
+            if project_id is not None: dataio.delete_projects([project_id])
+            db.session.delete(user)
+            db.session.commit()
+
+    done(t)
+
+
+
+print('\n\n\nDONE: ran %i tests' % len(tests))
+toc(T)
@@ -18,7 +18,10 @@ All parameters and return types are either id's, json-summaries, or mpld3 graphs
 import traceback
 from functools import wraps
 import os
-from zipfile import ZipFile
+import json
+import calendar
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+from multiprocessing.pool import ThreadPool
 from uuid import uuid4, UUID
 from hashlib import sha224
 
@@ -34,7 +37,7 @@ from .dbconn import db
 from . import parse
 from .exceptions import ProjectDoesNotExist, ParsetAlreadyExists, \
     UserAlreadyExists, UserDoesNotExist, InvalidCredentials
-from .dbmodels import UserDb, ProjectDb, ResultsDb, PyObjectDb, UndoStackDb
+from .dbmodels import UserDb, ProjectDb, ResultsDb, PyObjectDb, UndoStackDb, split_project, manifest_keys, join_project
 from .plot import make_mpld3_graph_dict, convert_to_mpld3
 
 import six
@@ -42,6 +45,7 @@ if six.PY3: # Python 3
     basestring = str
 
 TEMPLATEDIR = "/tmp"  # CK: hotfix to prevent ownership issues
+UNDO_STACK_MAX_BYTES = 50*1024*1024 # Per project: the oldest versions are dropped beyond this
 
     
 def templatepath(filename):
@@ -434,20 +438,26 @@ def save_project(project, db_session=None, is_skip_result=False):
     db_session.commit()
 
 
-def load_project_from_record(project_record):
+def load_project_from_record(project_record, components=None):
+    """
+    components is an optional list of the project attributes needed, e.g. ['parsets'];
+    the others are not loaded, and are set to None (see ProjectDb.load)
+    """
     try:
-        project = project_record.load()
+        project = project_record.load(components=components)
     except:
         print('WARNING, could not load project!')
         return None
-    for progset in project.progsets.values():
-        if not hasattr(progset, 'inactive_programs'):
-            progset.inactive_programs = op.odict()
-    project.restorelinks()
+    if project.progsets is not None:
+        for progset in project.progsets.values():
+            if not hasattr(progset, 'inactive_programs'):
+                progset.inactive_programs = op.odict()
+    if components is None:
+        project.restorelinks()
     return project
 
 
-def load_project(project_id, raise_exception=True, db_session=None, authenticate=True):
+def load_project(project_id, raise_exception=True, db_session=None, authenticate=True, components=None):
     if db_session is None:
         db_session = db.session
     project_record = load_project_record(
@@ -460,7 +470,7 @@ def load_project(project_id, raise_exception=True, db_session=None, authenticate
             raise ProjectDoesNotExist(id=project_id)
         else:
             return None
-    return load_project_from_record(project_record)
+    return load_project_from_record(project_record, components=components)
 
 
 def update_project_with_fn(project_id, update_project_fn, db_session=None):
@@ -468,8 +478,7 @@ def update_project_with_fn(project_id, update_project_fn, db_session=None):
         db_session = db.session
     project = load_project(project_id, db_session=db_session)
     update_project_fn(project)
-    project.modified = op.today()
-    save_project(project, db_session=db_session)
+    save_project(project, db_session=db_session) # Sets project.modified
 
 
 def load_project_summary_from_project_record(project_record):
@@ -479,19 +488,27 @@ def load_project_summary_from_project_record(project_record):
     return project_summary
 
 
+def load_project_summaries_from_project_records(project_records):
+    """ Like load_project_summary_from_project_record(), but reads the summary index rather than the projects """
+    project_summaries = ProjectDb.load_summaries(project_records)
+    for project_record, project_summary in zip(project_records, project_summaries):
+        project_summary['userId'] = project_record.user_id
+    return project_summaries
+
+
 def load_project_summary(project_id):
     project_entry = load_project_record(project_id)
-    return load_project_summary_from_project_record(project_entry)
+    return load_project_summaries_from_project_records([project_entry])[0]
 
 
 def load_current_user_project_summaries():
     query = ProjectDb.query.filter_by(user_id=current_user.id)
-    return {'projects': map(load_project_summary_from_project_record, query.all())}
+    return {'projects': load_project_summaries_from_project_records(query.all())}
 
 
 def load_all_project_summaries():
     query = ProjectDb.query
-    return {'projects': map(load_project_summary_from_project_record, query.all())}
+    return {'projects': load_project_summaries_from_project_records(query.all())}
 
 
 def get_default_populations():
@@ -815,6 +832,110 @@ def load_zip_of_prj_files(project_ids):
     return full_filename
 
 
+# Projects read from Redis at once by download_zip_of_projects
+export_threads = 4
+
+
+class ZipStream(object):
+    """
+    A write-only file object for ZipFile that keeps what has been written only until it is
+    taken by pop(), so the zip can be sent as it is made
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def epoch_seconds(date):
+    """ Seconds since the epoch for a datetime, taken to be UTC if it has no timezone """
+    return calendar.timegm(date.utctimetuple())
+
+
+def download_zip_of_projects(project_ids=None, since=None):
+    """
+    Returns the filename and a generator of the contents of a .zip of the selected projects
+    (default all of the current user's, or all projects for an admin), as user/project.prj, so it
+    can be streamed. The projects are read straight from Redis, several at a time (see
+    ProjectDb.load_prj). If since is given, in seconds since the epoch, only projects saved
+    since then are included (ProjectDb.save_obj sets their modified time). The zip also has projects.json, listing all the selected projects,
+    whether or not they're included, and the time of the export, to use as since next time.
+    """
+    if project_ids is None:
+        query = ProjectDb.query
+        if not current_user.is_admin:
+            query = query.filter_by(user_id=current_user.id)
+    else:
+        query = ProjectDb.query.filter(ProjectDb.id.in_(project_ids))
+        if not current_user.is_admin:
+            query = query.filter_by(user_id=current_user.id)
+    project_records = query.all()
+    project_summaries = ProjectDb.load_summaries(project_records)
+
+    export = {'time': epoch_seconds(op.today()), 'since': since, 'projects': []}
+    included = []
+    paths = {}
+    for project_record, project_summary in zip(project_records, project_summaries):
+        username = project_record.user.username if project_record.user else 'unknown'
+        name = get_unique_name(secure_filename(project_summary['name']) or 'project', paths.setdefault(username, []))
+        paths[username].append(name)
+        updated = project_summary['updatedTime']
+        is_changed = since is None or not hasattr(updated, 'utctimetuple') or epoch_seconds(updated) >= since # Whole seconds, so include saves in the same second as the last export
+        entry = {
+            'id': project_record.id.hex,
+            'user': username,
+            'name': project_summary['name'],
+            'path': '%s/%s.prj' % (username, name),
+            'included': is_changed,
+        }
+        export['projects'].append(entry)
+        if is_changed:
+            included.append((project_record, entry['path']))
+
+    print(">> download_zip_of_projects %d of %d projects" % (len(included), len(project_records)))
+
+    def load_prj(item):
+        return item[0].load_prj()
+
+    def generate():
+        stream = ZipStream()
+        pool = ThreadPool(export_threads)
+        try:
+            with ZipFile(stream, 'w', ZIP_STORED, allowZip64=True) as zipfile:
+                for i in range(0, len(included), export_threads): # Only hold a few projects at a time
+                    batch = included[i:i+export_threads]
+                    for (project_record, path), prj in zip(batch, pool.map(load_prj, batch)):
+                        if prj is None:
+                            print(">> download_zip_of_projects %s not found" % project_record.id.hex)
+                            continue
+                        zipfile.writestr(path, prj) # Already compressed
+                        yield stream.pop()
+                zipfile.writestr('projects.json', json.dumps(export, indent=2), ZIP_DEFLATED)
+            yield stream.pop()
+        finally:
+            pool.close()
+
+    datestr = op.today().strftime('%Y%b%d_%H%M%S')
+    return 'Optima_projects_%s.zip' % datestr, generate()
+
+
 def resolve_project(project):
     """
     Returns boolean to whether any changes needed to be made to the project.
@@ -970,10 +1091,10 @@ def load_result(project_id, which=None, name=None):
         result = result_record.load()
         if result.name == name:
             print(">> load_result loaded '%s'" % str(result.name))
-            if which:
+            if which and getattr(result, 'which', None) != which:
                 result.which = which
                 print(">> load_result saving which", which)
-                result_record.save_obj(result)
+                result_record.save_obj(result, keep_graphs=True)
             return result
     print(">> load_result: stored result is empty")
     return None
@@ -984,10 +1105,10 @@ def load_result_by_id(result_id, which=None):
     if result_record is None:
         raise Exception("Results '%s' does not exist" % result_id)
     result = result_record.load()
-    if which is not None:
+    if which is not None and getattr(result, 'which', None) != which:
         result.which = which
         print(">> load_result_by_id saving which", which)
-        result_record.save_obj(result)
+        result_record.save_obj(result, keep_graphs=True)
     return result
 
 
@@ -1213,12 +1334,12 @@ def fixproptx_off(project_id, parset_id):
 
 def get_isfixed(project_id, parset_id):
     ''' Read whether constant proportion is off or on for ART '''
-    project = load_project(project_id)
+    project = load_project(project_id, components=['parsets'])
     parset = parse.get_parset_from_project(project, parset_id)
     return {"isfixed": parset.isfixed}
 
 def load_parset_summaries(project_id):
-    project = load_project(project_id)
+    project = load_project(project_id, components=['parsets'])
     return {"parsets": parse.get_parset_summaries(project)}
 
 
@@ -1232,7 +1353,7 @@ def load_parameters_from_progset_parset(project_id, progset_id, parset_id):
 
 
 def load_parameters(project_id, parset_id, advanced=False):
-    project = load_project(project_id)
+    project = load_project(project_id, components=['parsets'])
     parset = parse.get_parset_from_project(project, parset_id)
     return parse.get_parameters_from_parset(parset, advanced=advanced)
 
@@ -1496,7 +1617,7 @@ def make_scenarios_graphs(project_id, which=None, is_run=False, zoom=None, start
         print(">> make_scenarios_graphs project '%s' from %s to %s" % (
             project_id, startYear, endYear))
         # start=None, end=None -> does nothing
-        project.runscenarios(end=endYear) # Only change end year from default
+        project.runscenarios(end=endYear, ncpus=current_app.config.get('SCENARIO_CPUS')) # Only change end year from default
         result = project.results[-1]
         if which:
             result.which = which
@@ -1850,7 +1971,9 @@ def make_region_projects(spreadsheet_fname, project_id):
 class UndoStack(object):
     """
     A stack of Project objects for allowing Undo and Redo functionality in 
-    Optima.
+    Optima. Each version is stored as a manifest of its components (see 
+    split_project()), which are stored once, compressed, and shared between 
+    versions, so pushing a version only adds the components that changed.
     
     Methods:
         __init__(theProjectUID: UUID): void -- constructor, taking the project's 
@@ -1878,14 +2001,19 @@ class UndoStack(object):
         atStackTop(): bool -- are we at the top of the stack (latest version)?
         atStackBottom(): bool -- are we at the bottom of the stack (oldest version)?
         showContents(): void -- print out the contents of the stack
+        getSizeInBytes(): int -- the size of the stored components
                     
     Attributes:
         projectUID: UUID -- UID of the project, indexing the Postgres and 
             Redis tables
         useDirtyFlag: bool -- should we use the dirty flag?
         dirtyFlag: bool -- do we have pending information waiting to be saved?
-        projectVersions: list of Project objects -- Python list holding 
-            the Project objects we want to be able to revert to
+        versionManifests: list of manifests -- Python list holding the 
+            manifests of the Project versions we want to be able to revert to
+        components: dict -- the compressed components of all the versions, 
+            by key
+        maxBytes: int -- the most the components may take up; the oldest 
+            versions are dropped to keep within it
         currentIndex: int [or None] -- the index into the current project 
             version on the stack
         
@@ -1904,9 +2032,54 @@ class UndoStack(object):
         self.setClean()
         
         # Start with an empty list of Projects and index None.
-        self.projectVersions = []
+        self.versionManifests = []
+        self.components = {}
+        self.maxBytes = UNDO_STACK_MAX_BYTES
         self.currentIndex = None       
         
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        
+        # Convert stacks stored before versions were split into components.
+        if 'projectVersions' in state:
+            projectVersions = self.__dict__.pop('projectVersions')
+            self.versionManifests = []
+            self.components = {}
+            self.maxBytes = UNDO_STACK_MAX_BYTES
+            for project in projectVersions:
+                self.versionManifests.append(self.storeVersion(project))
+        
+    def storeVersion(self, project):
+        # Store any of the project's components that aren't stored already, 
+        # and return its manifest.
+        manifest, objs = split_project(project)
+        for key, obj in objs.items():
+            if key not in self.components:
+                self.components[key] = op.dumpstr(obj)
+        return manifest
+    
+    def loadVersion(self, index):
+        # Rebuild the Project object for the version at index.
+        manifest = self.versionManifests[index]
+        objs = dict([(key, op.loadstr(self.components[key])) for key in manifest_keys(manifest)])
+        return join_project(manifest, objs)
+    
+    def trimToBudget(self):
+        # Remove the components no version uses any more, then drop the 
+        # oldest versions until we are within budget, always keeping the 
+        # current one.
+        while True:
+            usedKeys = set()
+            for manifest in self.versionManifests:
+                usedKeys.update(manifest_keys(manifest))
+            for key in list(self.components.keys()):
+                if key not in usedKeys:
+                    del self.components[key]
+            if self.getSizeInBytes() <= self.maxBytes or not self.currentIndex:
+                break
+            self.versionManifests.pop(0)
+            self.currentIndex -= 1
+        
     def pushNewVersion(self, newVersion):
         # Exit if we cannot save to the stack yet.
         if not self.canSave():
@@ -1915,10 +2088,10 @@ class UndoStack(object):
         # If we are not at the stack top, trim out all indices after the 
         # current one.
         if not self.atStackTop():
-            self.projectVersions = self.projectVersions[:(self.currentIndex + 1)]
+            self.versionManifests = self.versionManifests[:(self.currentIndex + 1)]
             
-        # Append the Project object for the new version.
-        self.projectVersions.append(newVersion)
+        # Append the manifest for the new version, storing its new components.
+        self.versionManifests.append(self.storeVersion(newVersion))
         
         # Move the index up so we point to the new version.
         if self.currentIndex == None:
@@ -1926,6 +2099,9 @@ class UndoStack(object):
         else:
             self.currentIndex += 1
             
+        # Drop the oldest versions if we are over budget.
+        self.trimToBudget()
+            
         # Set the dirty flag clean.
         self.setClean()
         
@@ -1951,7 +2127,7 @@ class UndoStack(object):
                 self.currentIndex -= 1
                 
                 # Return the now-pointed-to version of the Project.
-                return self.projectVersions[self.currentIndex]
+                return self.loadVersion(self.currentIndex)
         
         # Otherwise (not using the dirty flag)...
         else:
@@ -1959,7 +2135,7 @@ class UndoStack(object):
             self.currentIndex -= 1
             
             # Return the now-pointed-to version of the Project.
-            return self.projectVersions[self.currentIndex]
+            return self.loadVersion(self.currentIndex)
     
     def getRedoVersion(self):
         # Exit if we cannot redo from the stack yet.
@@ -1973,10 +2149,10 @@ class UndoStack(object):
         self.setClean()
         
         # Return the now-pointed-to version of the Project.
-        return self.projectVersions[self.currentIndex]
+        return self.loadVersion(self.currentIndex)
     
     def getSelectedVersion(self):
-        return self.projectVersions[self.currentIndex]
+        return self.loadVersion(self.currentIndex)
     
     def getProjectUID(self):
         return self.projectUID
@@ -2030,13 +2206,16 @@ class UndoStack(object):
         return (not self.atStackTop())
     
     def isEmpty(self):
-        return len(self.projectVersions) == 0
+        return len(self.versionManifests) == 0
+    
+    def getSizeInBytes(self):
+        return sum([len(component) for component in self.components.values()])
     
     def atStackTop(self):
         if self.currentIndex == None:
             return True
         else:
-            return (self.currentIndex == (len(self.projectVersions) - 1))
+            return (self.currentIndex == (len(self.versionManifests) - 1))
         
     def atStackBottom(self):
         return self.currentIndex == 0
@@ -2056,8 +2235,9 @@ class UndoStack(object):
         if self.isEmpty():
             print('Contents: Empty')
         else:
-            print('Contents: %d Project versions' % len(self.projectVersions))
+            print('Contents: %d Project versions' % len(self.versionManifests))
             print('Stack Index: %d' % self.currentIndex)
+            print('Size: %d components, %d bytes' % (len(self.components), self.getSizeInBytes()))
         print
         
 
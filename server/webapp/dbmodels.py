@@ -1,10 +1,95 @@
 import os
+from copy import copy
+from hashlib import sha1
+from six.moves import cPickle as pkl
 #from flask_restful_swagger import swagger
+from flask import current_app
 from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.dialects.postgresql import JSON
 import optima as op
 from .dbconn import db, redis
+from . import parse
+
+
+# Each item in these project attributes is stored under its own Redis key, so only
+# the items that changed are written, and only the attributes needed are loaded
+project_components = ['parsets', 'progsets', 'scens', 'optims', 'results']
+
+# Redis hash of project summaries, so projects can be listed without loading them
+project_summaries_key = "project-summaries"
+
+# The first bytes of a gzipped pickle, i.e. of a .prj file
+gzip_magic = b'\x1f\x8b'
+
+# Saving a project reads its manifest, writes the new one and deletes the components it no longer refers to,
+# so saves of the same project are run one at a time under a Redis lock, which expires if a save dies
+project_lock_timeout = 120 # Seconds before the lock expires
+project_lock_wait = 60 # Seconds to wait for another save to finish before giving up
+
+
+def result_graphs_key(result_id):
+    """ Redis hash of the mpld3 graphs made from a result, by plot key and settings """
+    return "result-graphs-" + result_id.hex
+
+
+def portfolio_bocs_key(portfolio_id):
+    """ Redis hash of the BOCs generated for the projects of a portfolio, by project id """
+    return "portfolio-bocs-" + portfolio_id.hex
+
+
+def split_project(project, prefix=''):
+    """
+    Split a project into its components and a shell holding everything else. Each is given
+    a key made from prefix and a hash of its contents, so an unchanged one keeps its key.
+    Returns the manifest -- the key of the shell, and a list of (name, key) pairs for each
+    component attribute, or None if it wasn't loaded -- and a dict of the objects by key.
+    """
+    manifest = op.odict()
+    objs = {}
+
+    def add(obj):
+        key = prefix + sha1(pkl.dumps(obj, protocol=-1)).hexdigest()
+        objs[key] = obj
+        return key
+
+    shell = copy(project)
+    for attr in project_components:
+        items = getattr(project, attr)
+        if items is None:
+            manifest[attr] = None
+        else:
+            manifest[attr] = []
+            for name, item in items.items():
+                if hasattr(item, 'projectref'): # Don't store the whole project with each component
+                    item = copy(item)
+                    item.projectref = op.Link()
+                manifest[attr].append((name, add(item)))
+        setattr(shell, attr, op.odict())
+    manifest['shell'] = add(shell)
+    return manifest, objs
+
+
+def manifest_keys(manifest, components=None):
+    """ The keys of the shell and of the given components (default all) in a manifest """
+    if components is None:
+        components = project_components
+    return [manifest['shell']] + [key for attr in components for name, key in manifest[attr]]
+
+
+def join_project(manifest, objs, components=None):
+    """ The inverse of split_project(): objs must include the shell and the given components (default all) """
+    project = objs[manifest['shell']]
+    for attr in project_components:
+        if components is None or attr in components:
+            items = op.odict([(name, objs[key]) for name, key in manifest[attr]])
+            for item in items.values():
+                if hasattr(item, 'projectref'):
+                    item.projectref = op.Link(project)
+        else:
+            items = None
+        setattr(project, attr, items)
+    return project
 
 
 #@swagger.model
@@ -66,8 +151,28 @@ class PyObjectDb(db.Model):
         if redis_entry is None:
             print('WARNING, object %s not found' % self.id.hex) 
             return None
-        else:
-            return op.loadstr(redis_entry)
+        obj = op.loadstr(redis_entry)
+        if self.type == "portfolio":
+            self.load_bocs(obj)
+        return obj
+
+    def load_bocs(self, portfolio):
+        """
+        Add the BOCs stored separately by the BOC tasks to the projects of the portfolio,
+        replacing any saved with the portfolio itself
+        """
+        projects = list(portfolio.projects.values())
+        if not projects:
+            return
+        redis_entries = redis.hmget(portfolio_bocs_key(self.id), [project.uid.hex for project in projects])
+        for project, redis_entry in zip(projects, redis_entries):
+            if redis_entry is not None:
+                project.addresult(result=op.loadstr(redis_entry))
+
+    def save_boc(self, project_id, boc):
+        """ Store the BOC of one project of the portfolio, without rewriting the portfolio """
+        print(">> PyObjectDb.save_boc %s %s" % (self.id.hex, project_id.hex))
+        redis.hset(portfolio_bocs_key(self.id), project_id.hex, op.dumpstr(boc))
 
     def save_obj(self, obj):
         print(">> PyObjectDb.save " + self.id.hex)
@@ -75,7 +180,7 @@ class PyObjectDb(db.Model):
 
     def cleanup(self):
         print(">> PyObjectDb.cleanup " + self.id.hex)
-        redis.delete(self.id.hex)
+        redis.delete(self.id.hex, portfolio_bocs_key(self.id))
     
     def as_portfolio_file(self, loaddir, filename=None):
         portfolio = self.load()
@@ -96,15 +201,179 @@ class ProjectDb(db.Model):
     def __init__(self, user_id):
         self.user_id = user_id
 
-    def load(self):
+    def manifest_key(self):
+        return "project-manifest-" + self.id.hex
+
+    def lock_key(self):
+        return "project-lock-" + self.id.hex
+
+    def lock(self):
+        """ The lock for reading and replacing the manifest, for use in a with statement """
+        return redis.lock(self.lock_key(), timeout=project_lock_timeout, blocking_timeout=project_lock_wait)
+
+    def load_manifest(self):
+        redis_entry = redis.get(self.manifest_key())
+        if redis_entry is None:
+            return None
+        return op.loadstr(redis_entry)
+
+    def load_objs(self, manifest, components=None, attempts=3):
+        """
+        Load the shell and the given components (default all) that the manifest refers to. If a save has
+        replaced the manifest and deleted some of them since it was read, the new manifest is used instead.
+        Returns the manifest used and a dict of the objects by key.
+        """
+        for attempt in range(attempts):
+            keys = manifest_keys(manifest, components)
+            redis_entries = redis.mget(keys)
+            if all(redis_entry is not None for redis_entry in redis_entries):
+                return manifest, dict([(key, op.loadstr(redis_entry)) for key, redis_entry in zip(keys, redis_entries)])
+            print(">> ProjectDb.load_objs %s: manifest replaced while loading, trying again" % self.id.hex)
+            manifest = self.load_manifest()
+        raise Exception("Could not load project %s: the components of its manifest are missing" % self.id.hex)
+
+    def load(self, components=None):
+        """
+        Load the project. If components is a list of project attributes (e.g. ['parsets']),
+        only those are loaded and the others are set to None; such a project can be saved,
+        in which case the stored versions of the missing components are kept.
+        """
         print(">> ProjectDb.load " + self.id.hex)
-        redis_entry = redis.get(self.id.hex)
-        project = op.loadproj(redis_entry, fromdb=True)
+        manifest = self.load_manifest()
+        if manifest is None: # Saved before projects were split into components
+            redis_entry = redis.get(self.id.hex)
+            return op.loadproj(redis_entry, fromdb=True)
+
+        manifest, objs = self.load_objs(manifest, components)
+        if components is not None and str(objs[manifest['shell']].version) != str(op.version):
+            components = None # Migrations need the whole project
+            manifest, objs = self.load_objs(manifest)
+        project = join_project(manifest, objs, components)
+
+        if components is None:
+            try:
+                project = op.migrate(project)
+            except Exception as E:
+                print('WARNING, could not migrate project %s: %s' % (self.id.hex, repr(E)))
         return project
 
     def save_obj(self, obj):
+        """
+        Save the project, writing only the components whose contents have changed. Saves of the same
+        project are run one at a time, so one can't delete components that another's manifest refers to.
+        The project's modified time is set here, so every save counts as a change, e.g. for the
+        incremental export in download_zip_of_projects.
+        """
         print(">> ProjectDb.save " + self.id.hex)
-        redis.set(self.id.hex, op.dumpstr(obj))
+        obj.modified = op.today()
+        manifest, objs = split_project(obj, prefix="project-%s-" % self.id.hex)
+        with self.lock():
+            old_manifest = self.load_manifest()
+            for attr in project_components:
+                if manifest[attr] is None: # Not loaded, so keep what is stored
+                    manifest[attr] = old_manifest[attr] if old_manifest else []
+
+            old_keys = set(manifest_keys(old_manifest)) if old_manifest else set()
+            new_keys = set(manifest_keys(manifest))
+            changed = dict([(key, op.dumpstr(item)) for key, item in objs.items() if key not in old_keys])
+            if changed:
+                redis.mset(changed)
+            redis.set(self.manifest_key(), op.dumpstr(manifest)) # Switch over only once everything it refers to is stored
+            self.save_summary(obj, manifest=manifest)
+            stale = list(old_keys - new_keys)
+            if old_manifest is None:
+                stale.append(self.id.hex) # The unsplit version
+            if stale:
+                redis.delete(*stale)
+
+    def cleanup(self):
+        with self.lock():
+            manifest = self.load_manifest()
+            keys = [self.id.hex, self.manifest_key()]
+            if manifest:
+                keys.extend(manifest_keys(manifest))
+            redis.delete(*keys)
+            redis.hdel(project_summaries_key, self.id.hex)
+
+    def summary_source(self, manifest=None):
+        """ The stored parts of the project that its summary is made from, for checking the index is up to date """
+        if manifest is None:
+            manifest = self.load_manifest()
+        if manifest is None:
+            return 'unsplit' # Not changed since it was stored in the old format, since saving splits it
+        return [manifest['shell']] + [key for attr in ['parsets', 'progsets'] for name, key in manifest[attr]]
+
+    def load_summary_entry(self):
+        redis_entry = redis.hget(project_summaries_key, self.id.hex)
+        if redis_entry is None:
+            return None
+        return op.loadstr(redis_entry)
+
+    def save_summary(self, project=None, manifest=None):
+        """ Update the summary index entry for the project, loading it if not supplied; returns the summary """
+        if project is None:
+            project = self.load()
+        missing = [attr for attr in ['parsets', 'progsets'] if getattr(project, attr) is None]
+        if missing: # Only partially loaded, so take what these would contribute from the previous summary
+            entry = self.load_summary_entry()
+            if entry is None:
+                redis.hdel(project_summaries_key, self.id.hex) # Leave it for the repair job
+                return None
+            project = copy(project)
+            for attr in missing:
+                setattr(project, attr, op.odict())
+            summary = parse.get_project_summary_from_project(project)
+            if 'parsets' in missing:
+                summary['calibrationOK'] = entry['summary']['calibrationOK']
+            if 'progsets' in missing:
+                summary['programsOK'] = entry['summary']['programsOK']
+                summary['costFuncsOK'] = entry['summary']['costFuncsOK']
+        else:
+            summary = parse.get_project_summary_from_project(project)
+        entry = {'summary': summary, 'source': self.summary_source(manifest)}
+        redis.hset(project_summaries_key, self.id.hex, op.dumpstr(entry))
+        return summary
+
+    def is_summary_stale(self):
+        entry = self.load_summary_entry()
+        return entry is None or entry['source'] != self.summary_source()
+
+    @staticmethod
+    def load_summaries(project_records):
+        """ Read the summaries of the projects from the index, making any that are missing """
+        ids = [project_record.id.hex for project_record in project_records]
+        redis_entries = redis.hmget(project_summaries_key, ids) if ids else []
+        summaries = []
+        for project_record, redis_entry in zip(project_records, redis_entries):
+            if redis_entry is None:
+                try:
+                    summary = project_record.save_summary()
+                except Exception as E:
+                    print('WARNING, could not load project %s: %s' % (project_record.id.hex, repr(E)))
+                    summary = parse.get_project_summary_from_project(None) # Gives the "Load failed" summary
+            else:
+                summary = op.loadstr(redis_entry)['summary']
+            summaries.append(summary)
+        return summaries
+
+    def load_prj(self):
+        """
+        Returns the project, without results, as the contents of a .prj file, or None if it isn't stored.
+        It isn't migrated, and one stored as a gzipped pickle before projects were split into components
+        is returned as it is, without unpickling it.
+        """
+        manifest = self.load_manifest()
+        if manifest is None:
+            redis_entry = redis.get(self.id.hex)
+            if redis_entry is None or redis_entry[:2] == gzip_magic:
+                return redis_entry
+            return op.dumpstr(op.loadstr(redis_entry), codec='gzip')
+
+        components = [attr for attr in project_components if attr != 'results']
+        manifest, objs = self.load_objs(manifest, components)
+        project = join_project(manifest, objs, components)
+        project.results = op.odict()
+        return op.dumpstr(project, codec='gzip')
 
     def as_file(self, loaddir, filename=None):
         project = self.load()
@@ -140,6 +409,7 @@ class ProjectDb(db.Model):
         str_project_id = str(self.id)
         # delete all relevant entries explicitly
         self.delete_dependent_objects(synchronize_session=synchronize_session)
+        self.cleanup()
         # db.session.query(ProjectDataDb).filter_by(id=str_project_id).delete(synchronize_session)
         db.session.query(ProjectDb).filter_by(id=str_project_id).delete(synchronize_session)
         db.session.flush()
@@ -164,17 +434,45 @@ class ResultsDb(db.Model):
         if id:
             self.id = id
 
+    def store_path(self):
+        """
+        Where the result store is kept if RESULTS_FOLDER is set, so its arrays can be memory-mapped
+        on load; otherwise the result is pickled into Redis.
+        """
+        folder = current_app.config.get('RESULTS_FOLDER')
+        if not folder:
+            return None
+        return os.path.join(folder, "result-%s.res" % self.id.hex)
+
     def load(self):
+        path = self.store_path()
+        if path and os.path.exists(path):
+            print(">> ResultsDb.load result-%s from %s" % (self.id.hex, path))
+            return op.loadresults(path, verbose=False)
         print(">> ResultsDb.load result-" + self.id.hex)
-        return op.loadstr(redis.get("result-" + self.id.hex))
-
-    def save_obj(self, obj):
-        print(">> ResultsDb.save result-" + self.id.hex)
-        redis.set("result-" + self.id.hex, op.dumpstr(obj))
+        return op.loadstr(redis.get("result-" + self.id.hex)) # Saved before RESULTS_FOLDER was set
+
+    def save_obj(self, obj, keep_graphs=False):
+        """ Set keep_graphs if only the result's which has changed, so its graphs are still valid """
+        if not keep_graphs:
+            redis.delete(result_graphs_key(self.id))
+        path = self.store_path()
+        if path:
+            print(">> ResultsDb.save result-%s to %s" % (self.id.hex, path))
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            op.saveresults(path, obj, verbose=False)
+            redis.delete("result-" + self.id.hex)
+        else:
+            print(">> ResultsDb.save result-" + self.id.hex)
+            redis.set("result-" + self.id.hex, op.dumpstr(obj))
 
     def cleanup(self):
         print(">> ResultsDb.cleanup result-" + self.id.hex)
-        redis.delete("result-" + self.id.hex)
+        path = self.store_path()
+        if path and os.path.exists(path):
+            os.remove(path)
+        redis.delete("result-" + self.id.hex, result_graphs_key(self.id))
 
 
 class WorkLogDb(db.Model):  # pylint: disable=R0903
@@ -200,14 +498,43 @@ class UndoStackDb(db.Model):
         if id:
             self.id = id
 
+    # The stack's components are stored under their own keys, so each save only writes the new ones
+
+    def component_key(self, key):
+        return "undo-stack-%s-%s" % (self.id.hex, key)
+
+    def stored_component_keys(self):
+        redis_entry = redis.get("undo-stack-" + self.id.hex)
+        if redis_entry is None:
+            return set()
+        obj = op.loadstr(redis_entry)
+        return set([key for key, component in obj.components.items() if component is None])
+
     def load(self):
         print(">> UndoStackDb.load undo-stack-" + self.id.hex)
-        return op.loadstr(redis.get("undo-stack-" + self.id.hex))
+        obj = op.loadstr(redis.get("undo-stack-" + self.id.hex))
+        keys = [key for key, component in obj.components.items() if component is None]
+        if keys:
+            obj.components.update(zip(keys, redis.mget([self.component_key(key) for key in keys])))
+        return obj
 
     def save_obj(self, obj):
         print(">> UndoStackDb.save undo-stack-" + self.id.hex)
-        redis.set("undo-stack-" + self.id.hex, op.dumpstr(obj))
+        old_keys = self.stored_component_keys()
+        components = obj.components
+        added = dict([(self.component_key(key), component) for key, component in components.items() if key not in old_keys])
+        if added:
+            redis.mset(added)
+        obj.components = dict.fromkeys(components) # Keep just the keys
+        try:
+            redis.set("undo-stack-" + self.id.hex, op.dumpstr(obj))
+        finally:
+            obj.components = components
+        removed = [self.component_key(key) for key in old_keys if key not in components]
+        if removed:
+            redis.delete(*removed)
 
     def cleanup(self):
         print(">> UndoStackDb.cleanup undo-stack-" + self.id.hex)
-        redis.delete("undo-stack-" + self.id.hex)
\ No newline at end of file
+        keys = [self.component_key(key) for key in self.stored_component_keys()]
+        redis.delete("undo-stack-" + self.id.hex, *keys)
\ No newline at end of file
@@ -8,12 +8,19 @@ from numpy import array
 import optima as op
 
 from .parse import normalize_obj
+from .dbconn import redis
+from .dbmodels import result_graphs_key
 
 frontendfigsize = (5.5, 2)
 frontendpositionnolegend = [[0.19, 0.12], [0.85, 0.85]]
 frontendpositionlegend   = [[0.19, 0.12], [0.63, 0.85]]
 frontendpositionmidway   = [[0.19, 0.12], [0.80, 0.85]]
 
+# Plots that op.makeplots() makes before the epi plots, in the order it makes them
+special_plots = ['improvement', 'budgets', 'tvbudget', 'coverage', 'cascade', 'cascadebars', 'deathbycd4', 'plhivbycd4']
+
+graph_cache_seconds = 7*24*60*60 # Cached graphs are dropped if not used for this long
+
 
 def extract_graph_selector(graph_key):
     s = repr(str(graph_key))
@@ -67,6 +74,58 @@ def convert_to_selectors(graph_selectors):
     return selectors
 
 
+def make_graph_dicts(result, plot_key, zoom=None, startYear=None, endYear=None):
+    """
+    Makes the mpld3 graph dictionaries for one key in which -- some keys, e.g.
+    'prev-population', make several graphs -- and returns a list of (graph
+    selector, graph dictionary) pairs.
+    """
+    graphs = op.makeplots(result, toplot=[plot_key], plotstartyear=startYear, plotendyear=endYear, newfig=True, die=False)
+    op.reanimateplots(graphs)
+
+    graph_dicts = []
+    for graph_key in graphs:
+        graph_pos = None
+        graph_dict = convert_to_mpld3(graphs[graph_key], zoom=zoom, graph_pos=graph_pos)
+        graph = graphs[graph_key]
+        while len(graph.axes)>1:
+            print('Warning, too many axes, attempting removal')
+            graph.delaxes(graph.axes[1])
+        ylabels = [l.get_text() for l in graph.axes[0].get_yticklabels()]
+        graph_dict['ylabels'] = ylabels
+        xlabels = [l.get_text() for l in graph.axes[0].get_xticklabels()]
+        graph_dict['xlabels'] = xlabels
+        graph_dicts.append((extract_graph_selector(graph_key), graph_dict))
+
+    return graph_dicts
+
+
+def load_graph_dicts(result, which, zoom=None, startYear=None, endYear=None):
+    """
+    Returns the (graph selector, graph dictionary) pairs for the keys in which,
+    in the order op.makeplots() would make them. The graphs for each key are
+    cached in Redis by result and plot settings, and only the ones that aren't
+    cached are made. ResultsDb clears the cache when the result is saved or
+    deleted.
+    """
+    plot_keys = [key for key in special_plots if key in which] + [key for key in which if key not in special_plots]
+    cache_key = result_graphs_key(result.uid)
+    fields = [repr((key, zoom, startYear, endYear)) for key in plot_keys]
+
+    cached = redis.hmget(cache_key, fields) if fields else []
+    graph_dicts = [op.loadstr(entry) if entry is not None else None for entry in cached]
+    missing = [i for i, entry in enumerate(graph_dicts) if entry is None]
+    print(">> load_graph_dicts %i of %i cached" % (len(plot_keys)-len(missing), len(plot_keys)))
+
+    if missing:
+        for i in missing:
+            graph_dicts[i] = make_graph_dicts(result, plot_keys[i], zoom=zoom, startYear=startYear, endYear=endYear)
+        redis.hmset(cache_key, dict((fields[i], op.dumpstr(graph_dicts[i])) for i in missing))
+        redis.expire(cache_key, graph_cache_seconds)
+
+    return [pair for entry in graph_dicts for pair in entry]
+
+
 def make_mpld3_graph_dict(result=None, which=None, zoom=None, startYear=None, endYear=None):
     """
     Converts an Optima sim Result into a dictionary containing
@@ -158,24 +217,11 @@ def make_mpld3_graph_dict(result=None, which=None, zoom=None, startYear=None, en
 
     print(">> make_mpld3_graph_dict which:", which)
 
-    graphs = op.makeplots(result, toplot=which, plotstartyear=startYear, plotendyear=endYear, newfig=True, die=False)
-    op.reanimateplots(graphs)
-
     graph_selectors = []
     mpld3_graphs = []
-    for g,graph_key in enumerate(graphs):
-        graph_selectors.append(extract_graph_selector(graph_key))
-        graph_pos = None
-        graph_dict = convert_to_mpld3(graphs[graph_key], zoom=zoom, graph_pos=graph_pos)
-        graph = graphs[graph_key]
-        while len(graph.axes)>1:
-            print('Warning, too many axes, attempting removal')
-            graph.delaxes(graph.axes[1])
-        ylabels = [l.get_text() for l in graph.axes[0].get_yticklabels()]
-        graph_dict['ylabels'] = ylabels
-        xlabels = [l.get_text() for l in graph.axes[0].get_xticklabels()]
-        graph_dict['xlabels'] = xlabels
-        graph_dict['id'] = ('graph%i-' % g) + graph_dict['id'] # Prepend graph dict
+    for selector, graph_dict in load_graph_dicts(result, which, zoom=zoom, startYear=startYear, endYear=endYear):
+        graph_selectors.append(selector)
+        graph_dict = dict(graph_dict, id=('graph%i-' % len(mpld3_graphs)) + graph_dict['id']) # Prepend graph dict
         mpld3_graphs.append(graph_dict)
 
     return {
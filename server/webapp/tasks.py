@@ -1,6 +1,9 @@
 import traceback
 import pprint
-from celery import Celery
+import json
+from time import time
+from celery import Celery, chord, group
+from celery.signals import worker_process_init
 from celery.contrib.abortable import AbortableTask, AbortableAsyncResult
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import sessionmaker, scoped_session
@@ -43,9 +46,29 @@ put on the celery queue.
 - `parse_work_log_record` converts it into a JSON object that
   can be consumed by the web-client
 
+- long-running tasks (optimize, autofit, boc) add progress events
+  to a Redis stream for the task, which `check_task` reads, and
+  optimize and autofit periodically checkpoint their best state so
+  far, so that relaunching an interrupted task resumes from it
+
+- `boc` optimizes each budget ratio of a project's BOC in a separate
+  task, as a celery chord, so they run in parallel across workers;
+  the chord's callback checks that the BOC is monotonic, rerunning
+  points if not, and stores the BOC in a Redis hash per portfolio,
+  so BOC tasks for different projects don't overwrite each other.
+  These tasks finish the work log themselves: `boc` returns
+  `TASK_PENDING` so that `run_task` leaves it running
+
 - in any async function, access to the db has to be carefully
   circumsribed. This is done through a paired call to
-  `init_db_session` and `close_db_session`
+  `init_db_session` and `close_db_session`, which check a session
+  out of the process's scoped_session and return its connection
+  to the engine's pool
+
+- the state of each work log is also cached in Redis, so that
+  `check_task`, which the web-client polls, usually doesn't need
+  the database at all; Postgres stays the durable record, and
+  the cache is refilled from it when missing
 
 The function `run_task.delay` should not need to be run directly,
 and should be accessed through `launch_task`, which will
@@ -80,6 +103,103 @@ class ContextTask(TaskBase):
 
 celery_instance.Task = ContextTask
 
+# Thread-local sessions for this process, which share the engine's connection pool
+db_sessions = scoped_session(sessionmaker(bind=db.engine))
+
+
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    # Connections can't be shared with the parent process, so each celery worker starts its own pool
+    db.engine.dispose()
+
+
+
+TASK_PROGRESS_MAXLEN = 1000 # Approximate number of progress events kept per task
+TASK_PROGRESS_EXPIRY = 24*60*60 # Seconds to keep the progress of a finished task
+TASK_CHECKPOINT_INTERVAL = 60 # Minimum seconds between checkpoints
+TASK_STATE_EXPIRY = 24*60*60 # Seconds to cache the state of a work log in Redis
+TASK_PENDING = 'pending' # Returned by task functions that launch other tasks to finish the work log
+
+BOC_BUDGET_RATIOS = [1.0, 0.8, 0.5, 0.3, 0.1, 0.01, 1.5, 3.0, 5.0, 10.0, 30.0, 100.0] # As for project.genBOC()
+BOC_MAX_RUNS = 5 # Times a BOC point is optimized before giving up on making the BOC monotonic, as for project.genBOC()
+
+
+def task_state_key(task_id):
+    return "task-state-" + task_id
+
+
+def progress_key(task_id):
+    return "task-progress-" + task_id
+
+
+def checkpoint_key(task_id):
+    return "task-checkpoint-" + task_id
+
+
+def make_progress_handler(task_id, checkpoint=False, interval=TASK_CHECKPOINT_INTERVAL):
+    """
+    Returns a progressfunc for asd(), via project.optimize(), project.autofit() or
+    project.genBOC(), that adds each event to the task's Redis stream. With
+    checkpoint=True, the event with the best objective so far is also saved as
+    the task's checkpoint, at most every interval seconds.
+    """
+    state = {'best': None, 'saved': time()}
+
+    def progressfunc(event):
+        fields = [
+            ('label', event['label']),
+            ('iteration', event['iteration']),
+            ('maxiters', event['maxiters']),
+            ('fval', float(event['fval'])),
+            ('elapsed', event['elapsed']),
+            ('eta', event['eta']),
+            ('time', time()),
+        ]
+        if 'budget' in event:
+            fields.append(('budget', op.odict([(key, float(val)) for key, val in event['budget'].items()])))
+        args = [json.dumps(val) if i % 2 else val for field in fields for i, val in enumerate(field)]
+        dbmodels.redis.execute_command('XADD', progress_key(task_id), 'MAXLEN', '~', TASK_PROGRESS_MAXLEN, '*', *args)
+
+        if checkpoint:
+            if state['best'] is None or float(event['fval']) <= float(state['best']['fval']):
+                state['best'] = event
+            if time() - state['saved'] > interval:
+                dbmodels.redis.set(checkpoint_key(task_id), op.dumpstr(state['best']))
+                state['saved'] = time()
+
+    return progressfunc
+
+
+def load_progress(task_id):
+    """
+    Returns the last progress event of a task as a dict, or None if there isn't one
+    """
+    entries = dbmodels.redis.execute_command('XREVRANGE', progress_key(task_id), '+', '-', 'COUNT', 1)
+    if not entries:
+        return None
+    entry_id, fields = entries[0]
+    if not isinstance(fields, dict):
+        fields = dict(zip(fields[::2], fields[1::2]))
+    decode = lambda value: value.decode() if isinstance(value, bytes) else value
+    return dict((decode(key), json.loads(decode(value))) for key, value in fields.items())
+
+
+def boc_inputs_key(task_id):
+    return "boc-inputs-" + task_id
+
+
+def boc_points_key(task_id):
+    return "boc-points-" + task_id
+
+
+def load_checkpoint(task_id):
+    """
+    Returns the checkpointed progress event of an interrupted task, or None
+    """
+    redis_entry = dbmodels.redis.get(checkpoint_key(task_id))
+    if redis_entry is None:
+        return None
+    return op.loadstr(redis_entry)
 
 
 def parse_work_log_record(work_log):
@@ -99,39 +219,63 @@ def parse_work_log_record(work_log):
 
 def init_db_session():
     """
-    Create scoped_session, eventually bound to engine
+    Returns the session for this thread, which gets its connections from the engine's pool
     """
-    return scoped_session(sessionmaker(db.engine))
+    return db_sessions
 
 
 def close_db_session(db_session):
-    # this line might be redundant (not 100% sure - not clearly described)
-    db_session.connection().close() # pylint: disable=E1101
+    # Closes the session, returning its connection to the pool rather than disconnecting
     db_session.remove()
-    # black magic to actually close the connection by forcing the engine to dispose of garbage (I assume)
-    db_session.bind.dispose() # pylint: disable=E1101
 
 
-def check_task(task_id):
+def save_task_state(task_id, work_log_record):
     """
-    Returns current calculation state of a work_log.
+    Caches the state of a work log in Redis, for check_task
+    """
+    calc_state = parse_work_log_record(work_log_record)
+    dbmodels.redis.set(task_state_key(task_id), op.dumpstr(calc_state))
+    dbmodels.redis.expire(task_state_key(task_id), TASK_STATE_EXPIRY)
+    return calc_state
+
+
+def load_task_state(task_id):
+    """
+    Returns the state of a work log, from Redis if cached, otherwise from the database
     """
+    redis_entry = dbmodels.redis.get(task_state_key(task_id))
+    if redis_entry is not None:
+        return op.loadstr(redis_entry)
 
     db_session = init_db_session()
     work_log_record = db_session.query(dbmodels.WorkLogDb).filter_by(task_id=task_id).first()
-    calc_state = parse_work_log_record(work_log_record)
+    if work_log_record is None:
+        calc_state = parse_work_log_record(work_log_record)
+    else:
+        calc_state = save_task_state(task_id, work_log_record)
+    close_db_session(db_session)
+    return calc_state
 
-    if calc_state is None:
-        print(">> check_task: Task found but the work log record was empty")
-        return
+
+def check_task(task_id):
+    """
+    Returns current calculation state of a work_log.
+    """
+
+    calc_state = load_task_state(task_id)
 
     print(">> check_task", task_id, calc_state['status'])
 
     if calc_state['status'] == 'started':
-        if work_log_record.start_time is None:
+        if calc_state['start_time'] is None:
             calc_state['status_string'] = 'Waiting to start...'
         else:
-            calc_state['status_string'] = 'Running for %d seconds' % ((op.today()-work_log_record.start_time).seconds)
+            calc_state['status_string'] = 'Running for %d seconds' % ((op.today()-calc_state['start_time']).seconds)
+            progress = load_progress(task_id)
+            if progress is not None:
+                calc_state['progress'] = progress
+                calc_state['status_string'] += ': iteration %d, best objective %s, about %d seconds left' % (
+                    progress['iteration'], op.sigfig(progress['fval'], sigfigs=4), progress['eta'])
     elif calc_state['status'] == 'cancelled':
         calc_state['status_string'] = 'Job cancelled' # Probably won't get shown?
     elif calc_state['status'] == 'error':
@@ -146,6 +290,28 @@ def check_task(task_id):
     return calc_state
 
 
+def is_task_running(task_id):
+    """
+    Returns False if the task's work log has been removed, e.g. by cancel_task, or finished
+    """
+    return load_task_state(task_id)['status'] == 'started'
+
+
+def finish_work_log(task_id, status, error_text=""):
+    db_session = init_db_session()
+    worklog = db_session.query(dbmodels.WorkLogDb).filter_by(task_id=task_id).first()
+    if worklog is None:
+        print(">> finish_work_log WorkLogDb record missing, so task was cancelled")
+    else:
+        worklog.status = status
+        worklog.error = error_text
+        worklog.stop_time = op.today()
+        db_session.add(worklog)
+        db_session.commit()
+        save_task_state(task_id, worklog)
+    close_db_session(db_session)
+
+
 def check_if_task_started(task_id):
     calc_state = check_task(task_id)
     if calc_state['status'] == 'error':
@@ -154,6 +320,7 @@ def check_if_task_started(task_id):
         worklogs.delete()
         db_session.commit()
         close_db_session(db_session)
+        dbmodels.redis.delete(task_state_key(task_id))
         raise Exception(calc_state['error_text'])
     return calc_state
 
@@ -180,18 +347,24 @@ def run_task(self, task_id, fn_name, args, kwargs=None):
         # possible for anyone to retrieve it
         # Therefore, we should just return immediately
         print('>> run_task WorkLogDb record missing, so task is effectively revoked, returning immediately')
+        close_db_session(db_session)
         return
 
     worklog.start_time = op.today()
     db_session.add(worklog)
     db_session.commit()
+    save_task_state(task_id, worklog)
     close_db_session(db_session)
 
     if fn_name in {'optimize','autofit'}:
         kwargs['stoppingfunc'] = self.is_aborted
+    if fn_name in {'optimize','autofit','boc'}:
+        kwargs['task_id'] = task_id
 
     try:
-        task_fn(*args, **kwargs)
+        if task_fn(*args, **kwargs) == TASK_PENDING:
+            print(">> run_task continued by other tasks")
+            return
         print(">> run_task completed")
         error_text = ""
         status = 'completed'
@@ -212,14 +385,11 @@ def run_task(self, task_id, fn_name, args, kwargs=None):
         print(">> run_task cancelled via return")
         return
 
-    db_session = init_db_session()
-    worklog = db_session.query(dbmodels.WorkLogDb).filter_by(task_id=task_id).first()
-    worklog.status = status
-    worklog.error = error_text
-    worklog.stop_time = op.today()
-    db_session.add(worklog)
-    db_session.commit()
-    close_db_session(db_session)
+    dbmodels.redis.expire(progress_key(task_id), TASK_PROGRESS_EXPIRY)
+    if status == 'completed':
+        dbmodels.redis.delete(checkpoint_key(task_id))
+
+    finish_work_log(task_id, status, error_text)
 
 
 def launch_task(task_id, fn_name, args):
@@ -245,6 +415,8 @@ def launch_task(task_id, fn_name, args):
             print(">> launch_task cleanup %d logs" %  work_log_records.count())
             work_log_records.delete()
 
+        dbmodels.redis.delete(progress_key(task_id)) # Any checkpoint is kept, so the task resumes from it
+
         # create a work_log status is 'started by default'
         print(">> launch_task new work log")
         work_log_record = dbmodels.WorkLogDb(task_id=task_id)
@@ -252,7 +424,7 @@ def launch_task(task_id, fn_name, args):
         db_session.commit() # Trigger the server-side default for start time
         work_log_record.start_time = None  # start time of 'None' means that the task is waiting to run
         db_session.commit() # Override the start time
-        calc_state = parse_work_log_record(work_log_record)
+        calc_state = save_task_state(task_id, work_log_record)
     else:
         db_session.commit()
 
@@ -269,6 +441,7 @@ def cancel_task(task_id):
     celery_instance.control.revoke(str(work_log_record.id))
     res = AbortableAsyncResult(str(work_log_record.id), app=celery_instance)
     res.abort() # This triggers the WorkLogDb cleanup in run_task()
+    dbmodels.redis.delete(task_state_key(task_id), progress_key(task_id), checkpoint_key(task_id), boc_inputs_key(task_id), boc_points_key(task_id))
     db_session.delete(work_log_record)
     db_session.commit()
     close_db_session(db_session)
@@ -287,7 +460,7 @@ def cancel_task(task_id):
 #   the `rpcService.runAsyncTask('launch_task')` interface
 
 
-def autofit(project_id, parset_id, maxtime, stoppingfunc=None):
+def autofit(project_id, parset_id, maxtime, stoppingfunc=None, task_id=None):
 
     db_session = init_db_session()
     project = dataio.load_project(project_id, db_session=db_session, authenticate=False)
@@ -299,12 +472,34 @@ def autofit(project_id, parset_id, maxtime, stoppingfunc=None):
     parset_id = orig_parset.uid
     autofit_parset_name = "autofit-" + str(orig_parset_name)
 
-    project.autofit(
-        name=autofit_parset_name,
-        orig=orig_parset_name,
-        maxtime=float(maxtime),
-        stoppingfunc=stoppingfunc,
-    )
+    kwargs = {}
+    if task_id is not None:
+        kwargs['progressfunc'] = make_progress_handler(task_id, checkpoint=True)
+        checkpoint = load_checkpoint(task_id)
+        if checkpoint is not None:
+            print(">> autofit resuming from checkpoint at iteration %d" % checkpoint['iteration'])
+            kwargs['parvec'] = checkpoint['x']
+
+    try:
+        project.autofit(
+            name=autofit_parset_name,
+            orig=orig_parset_name,
+            maxtime=float(maxtime),
+            stoppingfunc=stoppingfunc,
+            **kwargs
+        )
+    except op.OptimaException:
+        if 'parvec' not in kwargs:
+            raise
+        print(">> autofit could not resume from checkpoint, starting again")
+        del kwargs['parvec']
+        project.autofit(
+            name=autofit_parset_name,
+            orig=orig_parset_name,
+            maxtime=float(maxtime),
+            stoppingfunc=stoppingfunc,
+            **kwargs
+        )
 
     result = project.parsets[autofit_parset_name].getresults()
     result_name = 'parset-' + orig_parset_name
@@ -337,7 +532,7 @@ def autofit(project_id, parset_id, maxtime, stoppingfunc=None):
     print("> autofit finish")
 
 
-def optimize(project_id, optimization_id, maxtime, stoppingfunc=None):
+def optimize(project_id, optimization_id, maxtime, stoppingfunc=None, task_id=None):
 
     db_session = init_db_session()
     project = dataio.load_project(project_id, db_session=db_session, authenticate=False)
@@ -364,7 +559,14 @@ def optimize(project_id, optimization_id, maxtime, stoppingfunc=None):
     maxtime = float(maxtime)
     if maxtime>3600: mc = 9 # Arbitrary threshold for "unlimited" run: run with uncertainty
     else:            mc = 0
-    result = project.optimize(optim=optim, maxtime=maxtime, mc=mc, stoppingfunc=stoppingfunc)  # Set this to zero for now while we decide how to handle uncertainties etc.
+    kwargs = {}
+    if task_id is not None:
+        kwargs['progressfunc'] = make_progress_handler(task_id, checkpoint=True)
+        checkpoint = load_checkpoint(task_id)
+        if checkpoint is not None:
+            print(">> optimize resuming from checkpoint at iteration %d" % checkpoint['iteration'])
+            kwargs['startbudget'] = checkpoint['budget']
+    result = project.optimize(optim=optim, maxtime=maxtime, mc=mc, stoppingfunc=stoppingfunc, **kwargs)  # Set this to zero for now while we decide how to handle uncertainties etc.
 
     print(">> optimize budgets %s" % result.budgets)
     
@@ -413,7 +615,40 @@ def reconcile(project_id, progset_id, parset_id, year, maxtime):
 
 
 
-def boc(portfolio_id, project_id, maxtime=2):
+def repair_project_summaries():
+    """
+    Rebuild the entries in the project summary index that are missing or out of date,
+    e.g. if a save was interrupted, and remove the entries of deleted projects
+    """
+    db_session = init_db_session()
+    project_records = db_session.query(dbmodels.ProjectDb).all()
+    close_db_session(db_session)
+
+    n_repaired = 0
+    for project_record in project_records:
+        if project_record.is_summary_stale():
+            try:
+                project_record.save_summary()
+                n_repaired += 1
+            except Exception:
+                print(">> repair_project_summaries could not load project %s" % project_record.id.hex)
+                print(traceback.format_exc())
+
+    ids = set([project_record.id.hex for project_record in project_records])
+    indexed = [key.decode() if isinstance(key, bytes) else key for key in dbmodels.redis.hkeys(dbmodels.project_summaries_key)]
+    deleted = [key for key in indexed if key not in ids]
+    if deleted:
+        dbmodels.redis.hdel(dbmodels.project_summaries_key, *deleted)
+
+    print(">> repair_project_summaries repaired %d of %d, removed %d" % (n_repaired, len(project_records), len(deleted)))
+
+
+
+def boc(portfolio_id, project_id, maxtime=2, task_id=None):
+    """
+    Generates the BOC of one project in a portfolio by launching a boc_point_task for
+    each budget ratio, with boc_merge_task as the callback to combine them
+    """
 
     db_session = init_db_session()
     portfolio = dataio.load_portfolio(portfolio_id, db_session)
@@ -425,15 +660,115 @@ def boc(portfolio_id, project_id, maxtime=2):
     else:
         raise Exception("Couldn't find project in portfolio")
 
-    project.genBOC(maxtime=float(maxtime), objectives=portfolio.objectives, mc=0) # TODO: Enable MC
+    inputs = {'project': project, 'objectives': portfolio.objectives, 'maxtime': float(maxtime)}
+    dbmodels.redis.set(boc_inputs_key(task_id), op.dumpstr(inputs))
+    dbmodels.redis.delete(boc_points_key(task_id))
+
+    counts = dict(('%s' % ratio, 1) for ratio in BOC_BUDGET_RATIOS)
+    launch_boc_points(task_id, portfolio_id, counts.keys(), counts)
+    print(">> boc launched %d points" % len(counts))
+    return TASK_PENDING
+
+
+def launch_boc_points(task_id, portfolio_id, keys, counts):
+    header = group(boc_point_task.si(task_id, key) for key in keys)
+    chord(header)(boc_merge_task.si(task_id, portfolio_id, counts))
+
+
+def load_boc_points(task_id):
+    """
+    Returns the BOC points calculated so far, and the errors of any that failed
+    """
+    points = op.odict()
+    errors = []
+    redis_entries = dbmodels.redis.hgetall(boc_points_key(task_id))
+    for key, redis_entry in redis_entries.items():
+        point = op.loadstr(redis_entry)
+        if isinstance(point, op.odict):
+            points[key.decode() if isinstance(key, bytes) else key] = point
+        else:
+            errors.append(point)
+    return points, errors
+
+
+def cleanup_boc(task_id):
+    dbmodels.redis.delete(boc_inputs_key(task_id), boc_points_key(task_id))
+    dbmodels.redis.expire(progress_key(task_id), TASK_PROGRESS_EXPIRY)
+
+
+@celery_instance.task
+def boc_point_task(task_id, key):
+    """
+    Optimizes one point of a BOC, starting from the allocation of the closest
+    point calculated so far, and stores it (or the error) in the BOC points hash.
+    Something is always stored, even if the setup fails, so that boc_merge_task
+    runs and finishes the work log
+    """
+    if not is_task_running(task_id):
+        print(">> boc_point_task %s %s cancelled" % (task_id, key))
+        return
+
+    try:
+        inputs = op.loadstr(dbmodels.redis.get(boc_inputs_key(task_id)))
+        project = inputs['project']
+        points, errors = load_boc_points(task_id)
+        ratio = float(key)
+        budget = ratio*sum(project.progsets[-1].getdefaultbudget()[:])
+        origbudget = op.closestBOCallocation(points, budget) if len(points) else None
+        label = project.name + ' $%sm' % op.sigfig(budget/1e6, sigfigs=3)
+        print(">> boc_point_task %s" % label)
+        point = project.genBOCpoint(
+            ratio,
+            objectives=inputs['objectives'],
+            maxtime=inputs['maxtime'],
+            mc=0, # TODO: Enable MC
+            origbudget=origbudget,
+            label=label,
+            progressfunc=make_progress_handler(task_id),
+        )
+    except Exception:
+        point = traceback.format_exc()
+        print(">> boc_point_task error")
+        print(point)
+    dbmodels.redis.hset(boc_points_key(task_id), key, op.dumpstr(point))
+
+
+@celery_instance.task
+def boc_merge_task(task_id, portfolio_id, counts):
+    """
+    Reruns any points of the BOC that have a worse outcome than a point with a smaller
+    budget, as project.genBOC() does, otherwise makes the BOC and stores it for the portfolio
+    """
+    if not is_task_running(task_id):
+        print(">> boc_merge_task %s cancelled" % task_id)
+        cleanup_boc(task_id)
+        return
+
+    points, errors = load_boc_points(task_id)
+    if errors:
+        cleanup_boc(task_id)
+        finish_work_log(task_id, 'error', errors[0])
+        return
+
+    reruns = [key for key in op.bocreruns(points) if counts[key] < BOC_MAX_RUNS]
+    if reruns:
+        print(">> boc_merge_task rerunning %s" % reruns)
+        for key in reruns:
+            counts[key] += 1
+        launch_boc_points(task_id, portfolio_id, reruns, counts)
+        return
+
+    inputs = op.loadstr(dbmodels.redis.get(boc_inputs_key(task_id)))
+    project = inputs['project']
+    boc = project.makeBOC(points, objectives=inputs['objectives'], maxtime=inputs['maxtime'], mc=0)
 
-    project_id = str(project.uid)
     db_session = init_db_session()
-    portfolio = dataio.load_portfolio(portfolio_id, db_session) # Reload portfolio, since another BOC task probably changed it
-    portfolio.projects[project.name] = project
-    dataio.save_portfolio(portfolio, db_session)
+    portfolio_record = dataio.load_portfolio_record(portfolio_id, db_session=db_session)
+    portfolio_record.save_boc(project.uid, boc)
     close_db_session(db_session)
 
+    cleanup_boc(task_id)
+    finish_work_log(task_id, 'completed')
     print(">> boc finish")
 
 
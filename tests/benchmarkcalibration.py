@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+BENCHMARKCALIBRATION
+
+Check how long each objective evaluation in automatic calibration takes, comparing making a full
+Resultset and looping over the data (objectivecalc) against compiling the data once and running
+the model only as far as the data (fastobjectivecalc), and how many iterations per second autofit()
+manages with each; and compares fitting by ASD with fitting by Levenberg-Marquardt (optimizer='lm'),
+using the finite-difference Jacobian from batched model runs, both minimizing the WAPE mismatch.
+
+Version: 2026oct18
+"""
+
+doevaluations = True
+doautofit = True
+dolm = True
+
+# Settings
+which = 'concentrated' # Which default project to use
+fitwhat = ['force', 'init'] # Which parameters to fit
+nevals = 10 # Number of parameter vectors to evaluate
+maxiters = 30 # Number of iterations for autofit
+asditers = 200 # Number of ASD iterations to compare with Levenberg-Marquardt
+lmiters = 10 # Number of Levenberg-Marquardt iterations
+tolerance = 1e-12
+
+
+from optima import defaultproject, dcp, tic, toc
+import optima as op
+from numpy import random
+makeparlist, convert, makefittargets, objectivecalc, fastobjectivecalc = op._calibration.makeparlist, op._calibration.convert, op._calibration.makefittargets, op._calibration.objectivecalc, op._calibration.fastobjectivecalc
+
+P = defaultproject(which=which, dorun=False, verbose=0)
+
+
+
+############################################################################################################################
+## Individual evaluations
+############################################################################################################################
+if doevaluations:
+    print('Benchmarking objective evaluations...')
+    
+    pars = dcp(P.parsets[-1].pars)
+    parlist = makeparlist(pars, fitwhat)
+    random.seed(1)
+    parvecs = [convert(pars, parlist)*(1+0.05*random.rand(len(parlist))) for i in range(nevals)]
+    
+    t = tic()
+    targets = makefittargets(project=P, pars=pars, fitto=None)
+    compiletime = toc(t, output=True)
+    
+    full, compiled = [], []
+    fulltime, compiledtime = 0., 0.
+    for parvec in parvecs: # Alternate, so both are affected equally by anything else running
+        t = tic()
+        full.append(objectivecalc(parvec, pars=pars, parlist=parlist, project=P, fitto=None, verbose=0).sum())
+        fulltime += toc(t, output=True)
+        t = tic()
+        compiled.append(fastobjectivecalc(parvec, pars=pars, parlist=parlist, project=P, targets=targets, verbose=0))
+        compiledtime += toc(t, output=True)
+    
+    maxdiff = max([abs(f-c)/abs(f) for f,c in zip(full,compiled)])
+    print('%s: %i evaluations, %i data points, model run to %i instead of %i' % (which, nevals, len(targets['datay']), targets['end'], P.data['years'][-1]))
+    print('  Compiling:       %0.3f s' % compiletime)
+    print('  Full results:    %0.3f s per evaluation' % (fulltime/nevals))
+    print('  Compiled:        %0.3f s per evaluation (%0.1fx speedup)' % (compiledtime/nevals, fulltime/compiledtime))
+    print('  Maximum relative difference: %e' % maxdiff)
+    if maxdiff>tolerance: raise Exception('Compiled objective does not match the full results: maximum relative difference %e' % maxdiff)
+
+
+
+############################################################################################################################
+## Autofit
+############################################################################################################################
+if doautofit:
+    print('Benchmarking autofit...')
+    
+    rates = op.odict()
+    mismatches = op.odict()
+    for key,compile in [('Full results', lambda **kwargs: None), ('Compiled', makefittargets)]:
+        op._calibration.makefittargets = compile # Used by autofit() to decide which objective to use
+        Q = dcp(P)
+        t = tic()
+        Q.autofit(name='autofit', orig=0, fitwhat=fitwhat, fitto=None, maxiters=maxiters, randseed=1, verbose=0)
+        parset = Q.parsets['autofit']
+        elapsed = toc(t, output=True)
+        rates[key] = len(parset.improvement[-1])/elapsed
+        mismatches[key] = parset.improvement[-1][-1]
+    op._calibration.makefittargets = makefittargets # Restore
+    
+    print('%s: %i iterations' % (which, maxiters))
+    for key in rates.keys():
+        print('  %-14s %0.2f iterations/s (mismatch %0.6f)' % (key+':', rates[key], mismatches[key]))
+    print('  Speedup: %0.1fx' % (rates['Compiled']/rates['Full results']))
+    if abs(mismatches[0]-mismatches[1])>tolerance*abs(mismatches[0]): raise Exception('Autofit with the compiled objective does not match full results: %s vs. %s' % (mismatches[0], mismatches[1]))
+
+
+
+
+############################################################################################################################
+## Levenberg-Marquardt vs. ASD
+############################################################################################################################
+if dolm:
+    print('Comparing Levenberg-Marquardt with ASD...')
+    
+    for thiswhich in ['concentrated', 'generalized']:
+        Q = defaultproject(which=thiswhich, dorun=False, verbose=0)
+        pars = Q.parsets[0].pars
+        parlist = makeparlist(pars, fitwhat)
+        targets = makefittargets(project=Q, pars=pars, fitto=None, method='wape')
+        mismatch = lambda thesepars: fastobjectivecalc(convert(thesepars, parlist), pars=dcp(thesepars), parlist=parlist, project=Q, targets=targets, verbose=0)
+        
+        print('%s: %i parameters' % (thiswhich, len(parlist)))
+        print('  %-22s %8s %8s %10s' % ('', 'Time (s)', 'Runs', 'WAPE'))
+        print('  %-22s %8s %8s %10.4f' % ('Original', '', '', mismatch(pars)))
+        for optimizer,iters in [('asd',asditers), ('lm',lmiters)]:
+            t = tic()
+            Q.autofit(name=optimizer, orig=0, fitwhat=fitwhat, fitto=None, optimizer=optimizer, maxiters=iters, randseed=1, verbose=0)
+            elapsed = toc(t, output=True)
+            fvals = Q.parsets[optimizer].improvement[-1]
+            nruns = len(fvals) if optimizer=='asd' else 1+(len(fvals)-1)*(len(parlist)+3) # One run per ASD iteration; the Jacobian and three steps per LM iteration
+            label = '%s (%i iterations)' % (optimizer.upper(), len(fvals)-1)
+            print('  %-22s %8.1f %8i %10.4f' % (label, elapsed, nruns, mismatch(Q.parsets[optimizer].pars)))
+
+print('Done.')
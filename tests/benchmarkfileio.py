@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+BENCHMARKFILEIO
+
+Check how big each codec makes a project and how fast it can save and load it, using
+dumpstr() and loadstr(), and that each one loads back the same project. Data saved
+with the default (gzip) format by earlier versions are loaded the same way.
+
+Version: 2026oct18
+"""
+
+doroundtrip = True
+dobenchmark = True
+
+# Settings
+which = ['concentrated', 'generalized'] # Which default projects to use
+nrepeats = 3 # Number of times to save and load each project, taking the fastest
+
+
+from optima import defaultproject, dumpstr, loadstr, tic, toc
+import optima as op
+
+projects = op.odict()
+for key in which:
+    projects[key] = defaultproject(which=key, dorun=True, verbose=0)
+names = ['gzip'] + op._fileio.codecs.keys()
+
+
+
+############################################################################################################################
+## Round trip
+############################################################################################################################
+if doroundtrip:
+    print('Checking that each codec loads back the same project...')
+    
+    for key,P in projects.items():
+        reference = dumpstr(loadstr(dumpstr(P, codec='pickle')), codec='pickle') # Pickle a loaded copy, since objects pickle slightly differently once they've been loaded
+        for name in names:
+            P2 = loadstr(dumpstr(P, codec=name))
+            if dumpstr(P2, codec='pickle')!=reference: raise Exception('Project "%s" saved with codec "%s" does not load back the same' % (key, name))
+            if (P2.results[-1].main['prev'].tot[0]!=P.results[-1].main['prev'].tot[0]).any(): raise Exception('Results of "%s" saved with codec "%s" do not match' % (key, name))
+    
+    print('Done checking round trips.')
+
+
+
+############################################################################################################################
+## Size and speed
+############################################################################################################################
+if dobenchmark:
+    print('Benchmarking codecs...')
+    
+    for key,P in projects.items():
+        rawsize = len(dumpstr(P, codec='pickle'))/1e6
+        print('%s: %0.2f MB uncompressed' % (key, rawsize))
+        print('  %-8s %8s %10s %10s' % ('Codec', 'Size (MB)', 'Save (MB/s)', 'Load (MB/s)'))
+        for name in names:
+            savetimes, loadtimes = [], []
+            for r in range(nrepeats):
+                t = tic()
+                data = dumpstr(P, codec=name)
+                savetimes.append(toc(t, output=True))
+                t = tic()
+                loadstr(data)
+                loadtimes.append(toc(t, output=True))
+            print('  %-8s %8.3f %10.1f %10.1f' % (name, len(data)/1e6, rawsize/min(savetimes), rawsize/min(loadtimes)))
+    
+    print('Done benchmarking codecs.')
+
+print('Done.')
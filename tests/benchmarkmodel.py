@@ -13,10 +13,16 @@ Requires line_profiler, available from:
 or: 
     pip install line_profiler
 
-Version: 2018apr24
+Also checks the vectorized force-of-infection calculation against the original loop over
+partnerships, and reports how long each takes per timestep; and compares running several
+simulations one at a time against running them together with model_batch().
+
+Version: 2026oct18
 """
 
 dobenchmark = True
+doforceinf = True
+dobatch = True
 doprofile = True
 
 # If running profiling, choose which function to line profile. 
@@ -79,6 +85,116 @@ if dobenchmark:
 
 
 
+############################################################################################################################
+## Force-of-infection regression
+############################################################################################################################
+if doforceinf:
+    print('Checking force-of-infection calculation...')
+    
+    from optima import defaultproject, makesimpars, makeforceinf, calcforceinf
+    from numpy import ones, einsum, power as npow, random, zeros, array
+    from time import time
+    
+    # Settings
+    nsus = 2
+    nstates = 38 # Doesn't need to match the model, since effallprev is synthetic
+    tolerance = 1e-12
+    
+    def loopforceinf(foi, t, alleff, effallprev, transinj, sharing, osteff, prepeff):
+        ''' The original loop over partnerships, used as the reference '''
+        npops = foi['npops']
+        forceinffull = ones((nsus, npops, nstates, npops))
+        for i in range(len(foi['sexpop1'])):
+            pop1, pop2, wholeacts, fracacts, cond, thistrans = foi['sexpop1'][i], foi['sexpop2'][i], foi['sexwhole'][0,i], foi['sexfrac'][0,i], foi['sexcond'][0,i], foi['sextrans'][0,i]
+            thisforceinfsex = (1-fracacts[t]*thistrans*cond[t]*einsum('a,b',alleff[pop1,t,:],effallprev[:,pop2]))
+            if wholeacts[t]: thisforceinfsex  *= npow((1-thistrans*cond[t]*einsum('a,b',alleff[pop1,t,:],effallprev[:,pop2])), int(wholeacts[t]))
+            forceinffull[:,pop1,:,pop2] *= thisforceinfsex 
+        for i in range(len(foi['injpop1'])):
+            pop1, pop2, wholeacts, fracacts = foi['injpop1'][i], foi['injpop2'][i], foi['injwhole'][0,i], foi['injfrac'][0,i]
+            thisforceinfinj = 1-transinj*sharing[pop1,t]*osteff[t]*prepeff[pop1,t]*fracacts[t]*effallprev[:,pop2]
+            if wholeacts[t]: thisforceinfinj *= npow((1-transinj*sharing[pop1,t]*osteff[t]*prepeff[pop1,t]*effallprev[:,pop2]), int(wholeacts[t]))
+            for index in range(nsus):
+                forceinffull[index,pop1,:,pop2] *= thisforceinfinj
+        return forceinffull
+    
+    for which in ['concentrated', 'generalized']:
+        P = defaultproject(which=which, dorun=False, verbose=0)
+        simpars = makesimpars(P.pars(), settings=P.settings, start=P.settings.start, end=P.settings.end, dt=P.settings.dt, verbose=0)
+        npops = len(simpars['popkeys'])
+        npts = len(simpars['tvec'])
+        foi = makeforceinf(simpars, verbose=0)
+        
+        # Synthetic inputs, since we only care about the two calculations agreeing
+        random.seed(1)
+        alleff     = random.rand(npops, npts, nsus)
+        sharing    = random.rand(npops, npts)
+        prepeff    = random.rand(npops, npts)
+        osteff     = random.rand(npts)
+        transinj   = simpars['transinj']
+        allprev    = [0.01*random.rand(nstates, npops) for t in range(npts)]
+        
+        looptime, kerneltime, maxdiff = 0., 0., 0.
+        for t in range(npts):
+            starttime = time()
+            orig = loopforceinf(foi, t, alleff, allprev[t], transinj, sharing, osteff, prepeff)
+            looptime += time()-starttime
+            starttime = time()
+            new = calcforceinf(foi, t, alleff[None], allprev[t][None], transinj=array([transinj]), sharing=sharing[None], osteff=osteff[None], prepeff=prepeff[None], nsus=nsus)[0] # Add and remove the simulation axis
+            kerneltime += time()-starttime
+            maxdiff = max(maxdiff, abs(orig-new).max())
+        
+        print('%s: %i sexual + %i injecting partnerships, %i timesteps' % (which, len(foi['sexpop1']), len(foi['injpop1']), npts))
+        print('  Loop:   %0.2f ms per timestep' % (looptime/npts*1e3))
+        print('  Kernel: %0.2f ms per timestep (%0.1fx speedup)' % (kerneltime/npts*1e3, looptime/kerneltime))
+        print('  Maximum difference: %e' % maxdiff)
+        if maxdiff>tolerance: raise Exception('Vectorized force of infection does not match the loop: maximum difference %e' % maxdiff)
+    
+    print('Done checking force of infection.')
+
+
+
+############################################################################################################################
+## Batched model runs
+############################################################################################################################
+if dobatch:
+    print('Comparing individual and batched model runs...')
+    
+    from optima import defaultproject, makesimpars, model, model_batch
+    from numpy import random
+    from time import time
+    
+    # Settings
+    nsims = 10
+    tolerance = 1e-9
+    keys = ['people', 'inci', 'incibypop', 'births', 'diag', 'newtreat', 'death']
+    
+    for which in ['concentrated', 'generalized']:
+        P = defaultproject(which=which, dorun=False, verbose=0)
+        random.seed(1)
+        simparslist = [makesimpars(P.pars(), settings=P.settings, start=P.settings.start, end=P.settings.end, dt=P.settings.dt, sample='new', verbose=0) for i in range(nsims)]
+        
+        starttime = time()
+        individual = [model(simpars, P.settings, verbose=0) for simpars in simparslist]
+        individualtime = time()-starttime
+        starttime = time()
+        batched = model_batch(simparslist, P.settings, verbose=0)
+        batchtime = time()-starttime
+        
+        maxdiff = 0.
+        for raw1,raw2 in zip(individual, batched):
+            for key in keys:
+                maxdiff = max(maxdiff, (abs(raw1[key]-raw2[key])/(abs(raw1[key])+1.)).max())
+        
+        print('%s: %i simulations' % (which, nsims))
+        print('  Individual: %0.2f s' % individualtime)
+        print('  Batched:    %0.2f s (%0.1fx speedup)' % (batchtime, individualtime/batchtime))
+        print('  Maximum relative difference: %e' % maxdiff)
+        if maxdiff>tolerance: raise Exception('Batched model does not match individual runs: maximum relative difference %e' % maxdiff)
+    
+    print('Done comparing batched model runs.')
+
+
+
 ############################################################################################################################
 ## Profiling
 ############################################################################################################################
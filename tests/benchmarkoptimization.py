@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+BENCHMARKOPTIMIZATION
+
+Check how long each objective evaluation in an optimization takes, comparing making a full
+Resultset for each budget against calculating just the outcomes needed for the objective,
+and how much time this saves in a short outcome minimization (minoutcomes).
+
+Version: 2026oct18
+"""
+
+doevaluations = True
+dominoutcomes = True
+
+# Settings
+which = 'concentrated' # Which default project to use
+nevals = 10 # Number of budgets to evaluate
+maxiters = 30 # Number of iterations for minoutcomes
+nrepeats = 3 # Number of times to run minoutcomes each way; the fastest is reported
+tolerance = 1e-9
+
+
+from optima import defaultproject, defaultobjectives, outcomecalc, findinds, tic, toc
+import optima as op
+from numpy import random
+
+P = defaultproject(which=which, dorun=False, verbose=0)
+progset = P.progsets[-1]
+origbudget = progset.getdefaultbudget()
+budgetvec = origbudget[:][findinds(progset.optimizable())]
+
+
+def fulloutcomecalc(*args, **kwargs):
+    ''' Always make the full Resultset, as outcomecalc() used to for every evaluation '''
+    if kwargs.get('outputresults'): return outcomecalc(*args, **kwargs)
+    else:                           return outcomecalc(*args, outputresults=True, **kwargs).outcome
+
+
+
+############################################################################################################################
+## Individual evaluations
+############################################################################################################################
+if doevaluations:
+    print('Benchmarking objective evaluations...')
+
+    objectives = defaultobjectives(project=P, verbose=0)
+    random.seed(1)
+    budgets = [random.rand(len(budgetvec))*budgetvec.sum() for i in range(nevals)]
+
+    full, reduced = [], []
+    fulltime, reducedtime = 0., 0.
+    for budget in budgets: # Alternate, so both are affected equally by anything else running
+        t = tic()
+        full.append(fulloutcomecalc(budget, project=P, objectives=objectives, verbose=0))
+        fulltime += toc(t, output=True)
+        t = tic()
+        reduced.append(outcomecalc(budget, project=P, objectives=objectives, verbose=0))
+        reducedtime += toc(t, output=True)
+
+    maxdiff = max([abs(f-r)/abs(f) for f,r in zip(full,reduced)])
+    print('%s: %i evaluations' % (which, nevals))
+    print('  Full results:    %0.3f s per evaluation' % (fulltime/nevals))
+    print('  Reduced outputs: %0.3f s per evaluation (%0.1f%% faster)' % (reducedtime/nevals, (1-reducedtime/fulltime)*100))
+    print('  Maximum relative difference: %e' % maxdiff)
+    if maxdiff>tolerance: raise Exception('Reduced outputs do not match the full results: maximum relative difference %e' % maxdiff)
+
+
+
+############################################################################################################################
+## Minimize outcomes
+############################################################################################################################
+if dominoutcomes:
+    print('Benchmarking minoutcomes...')
+
+    calcs = [('Full results', fulloutcomecalc), ('Reduced outputs', outcomecalc)]
+    outcomes = op.odict()
+    times = op.odict([(key,[]) for key,calc in calcs])
+    for repeat in range(nrepeats):
+        for key,calc in (calcs if repeat%2==0 else calcs[::-1]): # Alternate the order, so neither always runs first
+            op._optimization.outcomecalc = calc # Used by minoutcomes() for each iteration
+            t = tic()
+            multires = P.optimize(maxiters=maxiters, mc=0, randseed=1, verbose=0)
+            times[key].append(toc(t, output=True))
+            outcomes[key] = multires.outcome
+    op._optimization.outcomecalc = outcomecalc # Restore
+    for key in times.keys(): times[key] = min(times[key])
+
+    print('%s: %i iterations, fastest of %i runs' % (which, maxiters, nrepeats))
+    for key in times.keys():
+        print('  %-16s %0.2f s (outcome %0.1f)' % (key+':', times[key], outcomes[key]))
+    print('  Saving: %0.1f%%' % ((1-times['Reduced outputs']/times['Full results'])*100))
+    if outcomes[0]!=outcomes[1]: raise Exception('Optimization with reduced outputs does not match full results: %s vs. %s' % (outcomes[0], outcomes[1]))
+
+print('Done.')
@@ -5,7 +5,7 @@ To use: comment out lines in the definition of 'tests' to not run those tests.
 NOTE: for best results, run in interactive mode, e.g.
 python -i tests.py
 
-Version: 2016feb06 by cliffk
+Version: 2026oct18 by cliffk
 """
 
 ## Define tests to run here!!!
@@ -14,6 +14,9 @@ tests = [
 #'sensitivity',
 #'manualfit',
 'autofit',
+'fittargets',
+'autofitchains',
+'autofitlm',
 #'autofitmulti',
 # 'longfit',
 # 'debugautofit',
@@ -130,6 +133,96 @@ if 'autofit' in tests:
 
 
 
+## Compiled objective test
+if 'fittargets' in tests:
+    t = tic()
+
+    print('Running compiled calibration objective test...')
+    from optima import defaultproject, dcp, _calibration as cal
+    from numpy import random
+    
+    P = defaultproject('concentrated', dorun=False)
+    pars = dcp(P.parsets[0].pars)
+    parlist = cal.makeparlist(pars, ['force', 'init'])
+    random.seed(1)
+    parvec = cal.convert(pars, parlist)*(1+0.05*random.rand(len(parlist)))
+    for fitto in [['prev'], None]:
+        for method in ['wape', 'mape', 'mad', 'mse']:
+            targets = cal.makefittargets(project=P, pars=pars, fitto=fitto, method=method)
+            orig = cal.objectivecalc(parvec, pars=pars, parlist=parlist, project=P, fitto=fitto, method=method).sum()
+            fast = cal.fastobjectivecalc(parvec, pars=pars, parlist=parlist, project=P, targets=targets)
+            assert abs(orig-fast) <= 1e-12*abs(orig), 'Compiled %s mismatch for fitto=%s does not match: %s vs. %s' % (method, fitto, fast, orig)
+    assert targets['end'] < P.data['years'][-1] # The model only needs to be run as far as the data
+    
+    done(t)
+
+
+
+
+
+
+
+## Multi-chain autofit test
+if 'autofitchains' in tests:
+    t = tic()
+
+    print('Running multi-chain autofit test...')
+    from optima import defaultproject
+    
+    P = defaultproject('concentrated', dorun=False)
+    P.autofit(name='chains', orig='default', fitwhat=['force'], maxiters=20, nchains=2, nblocks=2, randseed=1, verbose=0)
+    parset = P.parsets['chains']
+    assert parset.multiimprovement.shape==(2,21) # One row for each chain
+    assert parset.improvement[-1][-1]==parset.multiimprovement[:,-1].min() # The best chain is kept
+    assert parset.improvement[-1][-1]<parset.improvement[-1][0]
+    
+    done(t)
+
+
+
+
+
+
+
+## Levenberg-Marquardt autofit test
+if 'autofitlm' in tests:
+    t = tic()
+
+    print('Running Levenberg-Marquardt autofit test...')
+    from optima import defaultproject
+    
+    from optima import OptimaException, dcp
+    import optima as op
+    
+    P = defaultproject('concentrated', dorun=False)
+    P.autofit(name='lm', orig='default', fitwhat=['force'], optimizer='lm', maxiters=3, verbose=0)
+    fvals = P.parsets['lm'].improvement[-1]
+    assert all(fvals[1:]<=fvals[:-1]) # Steps are only taken if they improve the fit
+    assert fvals[-1]<fvals[0]
+    
+    # The mismatch minimized is the one selected by method, the same as for ASD
+    makeparlist, convert, makefittargets, fastobjectivecalc = op._calibration.makeparlist, op._calibration.convert, op._calibration.makefittargets, op._calibration.fastobjectivecalc
+    pars = P.parsets['default'].pars
+    parlist = makeparlist(pars, ['force'])
+    targets = makefittargets(project=P, pars=pars, fitto=['prev'], method='wape')
+    wape = fastobjectivecalc(convert(pars, parlist), pars=dcp(pars), parlist=parlist, project=P, targets=targets, verbose=0)
+    assert abs(fvals[0]-wape)<1e-3*wape, 'The Levenberg-Marquardt fit should start from the WAPE mismatch: %s vs. %s' % (fvals[0], wape)
+    
+    # Arguments it doesn't use are an error, rather than being ignored
+    try:
+        P.autofit(name='lm', orig='default', optimizer='lm', maxiters=1, stepsize=0.1, verbose=0)
+        raise Exception('Unused arguments should raise an OptimaException')
+    except OptimaException:
+        pass
+    
+    done(t)
+
+
+
+
+
+
+
 ## Autofit test
 if 'autofitmulti' in tests:
     t = tic()
@@ -9,7 +9,7 @@ NOTE: for best results, run in interactive mode, e.g.
 
 python -i tests.py
 
-Version: 2019dec02
+Version: 2026oct18
 """
 
 
@@ -18,6 +18,7 @@ Version: 2019dec02
 tests = [
 'makespreadsheet',
 'genBOC',
+'BOCpoints',
 'runGA',
 #'geogui',
 ]
@@ -76,6 +77,31 @@ if 'genBOC' in tests:
     
     P.genBOC(maxtime=1, mc=0, budgetratios=[1.0, 0.5, 2.0], objectives=defaultobjectives())
     done(t)
+
+
+
+## Make BOC from separately calculated points, as the server does in parallel
+if 'BOCpoints' in tests:
+    t = tic()
+    print('Running BOC points...')
+    from optima import defaultproject, defaultobjectives, odict, bocreruns
+    
+    P = defaultproject('simple')
+    objectives = defaultobjectives()
+    points = odict()
+    for ratio in [1.0, 0.5, 2.0]:
+        points['%s'%ratio] = P.genBOCpoint(ratio, maxtime=1, mc=0, objectives=objectives)
+    
+    # Make the largest budget worse than the others, so it should be rerun
+    points['2.0']['outcome'] = points['0.5']['outcome']+1
+    assert bocreruns(points) == ['2.0']
+    assert bocreruns(points, keys=['1.0']) == ['2.0']
+    points['2.0']['outcome'] = points['0.5']['outcome']-1
+    
+    boc = P.makeBOC(points, objectives=objectives)
+    assert P.getBOC(objectives) is boc
+    assert boc.x == sorted(boc.x) and len(boc.x) == 4 and boc.budgets.keys() == ['0.5', '1.0', '2.0']
+    done(t)
    
 
 
@@ -16,6 +16,9 @@ Version: 2016feb06 by cliffk
 tests = [
 'force',
 'treatment',
+'checkpoint',
+'interpcache',
+'baseline',
 ]
 
 
@@ -100,5 +103,115 @@ if 'treatment' in tests:
 
 
 
+## Checkpoint test
+if 'checkpoint' in tests:
+    t = tic()
+
+    print('Running checkpoint test...')
+    from optima import Project, makesimpars, model
+    from numpy import array_equal
+    
+    P = Project(spreadsheet='simple.xlsx', dorun=False)
+    simpars = makesimpars(P.pars(), settings=P.settings, start=P.settings.start, end=P.settings.end, dt=P.settings.dt)
+    full = model(simpars, P.settings, savecheckpoints=[20, 60])
+    resumed = model(simpars, P.settings, checkpoint=full['checkpoints'])
+    assert resumed['resumedfrom']==60, 'Expected to resume from the latest checkpoint, not %s' % resumed['resumedfrom']
+    for key in ['people', 'inci', 'diag', 'newtreat', 'death']:
+        assert array_equal(full[key], resumed[key]), 'Results resumed from a checkpoint do not match for "%s"' % key
+    
+    # Changing a parameter after a checkpoint should make it invalid, so the previous one is used
+    simpars['hivtest'][:,40:] *= 2
+    changed = model(simpars, P.settings)
+    resumed = model(simpars, P.settings, checkpoint=full['checkpoints'])
+    assert resumed['resumedfrom']==20, 'Expected to resume from the checkpoint before the change, not %s' % resumed['resumedfrom']
+    assert array_equal(changed['people'], resumed['people']), 'Results resumed from a checkpoint do not match after changing a parameter'
+    
+    # Changing a parameter before every checkpoint should make them all invalid
+    simpars['hivtest'][:,:10] *= 2
+    resumed = model(simpars, P.settings, checkpoint=full['checkpoints'])
+    assert resumed['resumedfrom'] is None, 'Expected to run from the beginning, not from checkpoint %s' % resumed['resumedfrom']
+
+    done(t)
+
+
+
+## Interpolation cache test
+if 'interpcache' in tests:
+    t = tic()
+
+    print('Running interpolation cache test...')
+    from optima import Project, makesimpars
+    from optima import _parameters
+    interpcache = _parameters.interpcache
+    from numpy import array_equal
+    
+    P = Project(spreadsheet='simple.xlsx', dorun=False)
+    pars = P.pars()
+    kwargs = dict(settings=P.settings, start=P.settings.start, end=P.settings.end, dt=P.settings.dt)
+    simpars1 = makesimpars(pars, **kwargs)
+    cached1 = dict([(key, interpcache[pars[key]][1]) for key in ['hivtest', 'force', 'condcas']])
+    simpars2 = makesimpars(pars, **kwargs)
+    assert interpcache[pars['hivtest']][1] is cached1['hivtest'], 'Unchanged parameters should not be interpolated again'
+    
+    # Each simpars should get its own writable copy
+    assert simpars2['hivtest'] is not simpars1['hivtest'], 'Interpolated parameters should not be shared between simpars'
+    simpars2['hivtest'][:] *= 2
+    assert array_equal(simpars1['hivtest'], makesimpars(pars, **kwargs)['hivtest']), 'Changing one simpars should not affect the others'
+    
+    # Changing parameters in place, as manualfit() and autofit() do, should make them be interpolated again
+    pars['hivtest'].m *= 2
+    pars['force'].y[0] *= 2
+    simpars3 = makesimpars(pars, **kwargs)
+    assert interpcache[pars['hivtest']][1] is not cached1['hivtest'] and interpcache[pars['force']][1] is not cached1['force'], 'Changed parameters were not interpolated again'
+    assert interpcache[pars['condcas']][1] is cached1['condcas'], 'Unchanged parameters should not be interpolated again'
+    for key in ['hivtest', 'force']:
+        assert array_equal(simpars3[key], pars[key].interp(tvec=simpars3['tvec'], dt=simpars3['dt'], popkeys=pars['popkeys'])), 'Cached interpolation of "%s" does not match' % key
+
+    done(t)
+
+
+
+## Stored baseline test
+if 'baseline' in tests:
+    t = tic()
+
+    print('Running stored baseline test...')
+    from optima import Project, defaultproject, makesimpars, model, model_batch
+    from numpy import array, argmin
+    
+    # Totals over populations and health states in 2005, 2015 and 2025, from the model before simulations were batched
+    baseline = {
+        'simple': {
+            'people':   [1323519.5258605313, 1694015.3260857598, 2168224.849684492],
+            'inci':     [894.7977346282357, 462.3057120978202, 411.3212037089429],
+            'death':    [1140.0388630760879, 461.77933311888745, 392.4450532836221],
+            'diag':     [889.9578864805678, 619.1330928835343, 396.0004228990191],
+            'newtreat': [200.67088194798612, 636.1544625306245, 531.4605369903799],
+            },
+        'generalized': {
+            'people':   [11921359.348642202, 15483377.42415332, 20622251.93920603],
+            'inci':     [97994.32679023326, 51804.01205486049, 34228.199008181065],
+            'death':    [71702.81535406788, 27650.51954746953, 14045.834004135595],
+            'diag':     [65927.33881018875, 62338.21220029953, 32202.466066202964],
+            'newtreat': [33384.49517445247, 153321.63696225506, 156817.41453705227],
+            },
+        }
+    tolerance = 1e-9 # Maximum difference relative to the value plus one, as stated in model_batch()
+    
+    for which in baseline.keys():
+        if which=='simple': P = Project(spreadsheet='simple.xlsx', dorun=False, verbose=0)
+        else:               P = defaultproject(which, dorun=False, verbose=0)
+        simpars = makesimpars(P.pars(), settings=P.settings, start=P.settings.start, end=P.settings.end, dt=P.settings.dt)
+        inds = [argmin(abs(simpars['tvec']-year)) for year in [2005, 2015, 2025]]
+        for raw in [model(simpars, P.settings, verbose=0)] + model_batch([simpars, simpars], P.settings, verbose=0):
+            for key,stored in baseline[which].items():
+                total = raw[key].reshape(-1, raw[key].shape[-1]).sum(axis=0)[inds]
+                maxdiff = (abs(total-array(stored))/(abs(array(stored))+1.)).max()
+                assert maxdiff<tolerance, 'Results for "%s" in the %s project differ from the stored baseline by %e' % (key, which, maxdiff)
+
+    done(t)
+
+
+
 print('\n\n\nDONE: ran %i tests' % len(tests))
 toc(T)
\ No newline at end of file
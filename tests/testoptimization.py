@@ -5,13 +5,16 @@ To use: comment out lines in the definition of 'tests' to not run those tests.
 NOTE: for best results, run in interactive mode, e.g.
 python -i tests.py
 
-Version: 2019oct14
+Version: 2026oct18
 """
 
 ## Define tests to run here!!!
 tests = [
 'minimizeoutcomes',
-# 'multichain',
+'outcomecache',
+'progress',
+'parallel',
+'multichain',
 # 'investmentstaircase',
 #'minimizemoney',
 #'optimizetesting',
@@ -75,6 +78,59 @@ if 'minimizeoutcomes' in tests:
     done(t)
 
 
+if 'outcomecache' in tests:
+    t = tic()
+
+    print('Running outcome cache test...')
+    import optima as op
+    P = op.demo(0)
+    cache = op.Outcomecache()
+    budgetvec = P.progsets[0].getdefaultbudget()[:][op.findinds(P.progsets[0].optimizable())]
+    first  = op.outcomecalc(budgetvec, project=P, cache=cache, verbose=0)
+    second = op.outcomecalc(budgetvec, project=P, cache=cache, verbose=0) # Should be found in the cache
+    third  = op.outcomecalc(budgetvec, project=P, verbose=0) # Without the cache
+    assert first==second==third, 'Cached outcome does not match: %s vs. %s vs. %s' % (first, second, third)
+    assert cache.hits==1 and cache.misses==1, 'Expected 1 hit and 1 miss, not %s' % cache.stats()
+    
+    # Evaluating a budget, whether it's cached or not, shouldn't change the random numbers the optimization uses
+    from numpy.random import get_state
+    origstate = get_state()
+    op.outcomecalc(budgetvec, project=P, cache=cache, verbose=0)
+    op.outcomecalc(budgetvec*1.1, project=P, cache=cache, verbose=0)
+    assert (get_state()[1]==origstate[1]).all() and get_state()[2:]==origstate[2:], 'Evaluating a budget changed the random state'
+    
+    done(t)
+
+
+if 'progress' in tests:
+    t = tic()
+
+    print('Running progress and restart test...')
+    import optima as op
+    P = op.demo(0)
+    events = []
+    first = P.optimize(name='first', maxiters=10, mc=0, randseed=1, progressfunc=events.append)
+    assert len(events)==10 and events[-1].fval==first.improvement[-1][-1], 'Expected one progress event per iteration'
+    resumed = P.optimize(name='resumed', maxiters=10, mc=0, randseed=1, startbudget=events[-1].budget) # Carry on from the last event
+    assert resumed.outcomes[0]==first.outcomes[0], 'Restarting should not change the baseline'
+    assert resumed.outcome<=first.outcome, 'Restarting should not make the outcome worse: %s vs. %s' % (resumed.outcome, first.outcome)
+    
+    done(t)
+
+
+if 'parallel' in tests:
+    t = tic()
+
+    print('Running parallel optimization test...')
+    import optima as op
+    P = op.demo(0)
+    serial   = P.optimize(name='serial',   maxiters=20, mc=1, randseed=1)
+    parallel = P.optimize(name='parallel', maxiters=20, mc=1, randseed=1, ncpus=2)
+    assert serial.outcome==parallel.outcome, 'Parallel optimization does not match serial: %s vs. %s' % (serial.outcome, parallel.outcome)
+    
+    done(t)
+
+
 if 'multichain' in tests:
     t = tic()
 
@@ -7,7 +7,7 @@ NOTE: for best results, run in interactive mode, e.g.
 
 python -i tests.py
 
-Version: 2016feb06
+Version: 2026oct18
 """
 
 
@@ -19,6 +19,7 @@ tests = [
 'addpopfactor',
 #'plotprogram',
 'compareoutcomes',
+'compiledprogset',
 #'reconcilepars',
 ]
 
@@ -189,6 +190,37 @@ if 'compareoutcomes' in tests:
 
 
 
+## Compiled program set test
+if 'compiledprogset' in tests:
+    t = tic()
+    print('Running compiled program set test...')
+    from numpy import array_equal
+    from optima import Parsoverlay
+    P = defaultproject('best')
+    progset, parset = P.progsets[0], P.parsets[0]
+    budget = progset.getdefaultbudget()
+    for key in budget.keys(): budget[key] *= 1.5 # Use a different budget from the default
+    years = [2020, 2021]
+    compiled = progset.compile(t=years, parset=parset)
+    for key in budget.keys(): budget[key] = [budget[key]]*len(years) # One budget for each year
+    origpars     = progset.getpars(coverage=progset.getprogcoverage(budget=budget, t=years, parset=parset), t=years, parset=parset)
+    compiledpars = compiled.getpars(coverage=compiled.getprogcoverage(budget=budget))
+    for parname in progset.targetpartypes:
+        for pop in origpars[parname].y.keys():
+            assert array_equal(origpars[parname].t[pop], compiledpars[parname].t[pop]), 'Years for %s %s do not match' % (parname, pop)
+            assert array_equal(origpars[parname].y[pop], compiledpars[parname].y[pop]), 'Values for %s %s do not match' % (parname, pop)
+    assert compiledpars['popsize'] is parset.pars['popsize'], 'Parameters not affected by programs should not be copied'
+    assert isinstance(compiledpars, Parsoverlay) and set(compiledpars.overridden)==set(progset.targetpartypes), 'Only the parameters affected by programs should be overridden'
+    
+    # Changing the parameter set in place should make the compiled program set out of date
+    assert compiled.matches(t=years, parset=parset, progset=progset, sample='best'), 'Compiled program set should match the inputs it was compiled for'
+    parset.pars['popsize'].m *= 2
+    assert not compiled.matches(t=years, parset=parset, progset=progset, sample='best'), 'Compiled program set should not match a changed parameter set'
+    assert compiled.matches(t=years, parset=parset, progset=progset, sample='best', checkpars=False), 'Parameters should not be compared with checkpars=False'
+    done(t)
+
+
+
 # Reconciliation test
 if 'reconcilepars' in tests:
     import optima as op
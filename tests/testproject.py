@@ -22,7 +22,8 @@ tests = [
 #'saveload',
 'loadspreadsheet',
 #'loadeconomics',
-'runsim'
+'runsim',
+'resultstore',
 ]
 
 ##############################################################################
@@ -218,5 +219,32 @@ if 'runsim' in tests:
 
 
 
+## Result store test
+if 'resultstore' in tests:
+    t = tic()
+    print('Running result store test...')
+    
+    from optima import defaultproject, saveresults, loadresults
+    from os import remove
+    P = defaultproject('simple', dorun=False, verbose=0)
+    P.runsim(n=2, sample='new', keepraw=True, verbose=0) # Multiple runs, with raw arrays
+    results = P.result()
+    filename = 'testresults.res'
+    saveresults(filename, results)
+    for usemmap in [True, False]:
+        newresults = loadresults(filename, usemmap=usemmap)
+        for key in results.main.keys():
+            assert (newresults.main[key].tot==results.main[key].tot).all()
+            assert (newresults.main[key].pops==results.main[key].pops).all()
+        assert (newresults.raw[0]['people']==results.raw[0]['people']).all()
+    newresults.main['prev'].tot[:] = 0 # Can be changed without affecting the file
+    assert (loadresults(filename).main['prev'].tot==results.main['prev'].tot).all()
+    remove(filename)
+    
+    done(t)
+
+
+
+
 print('\n\n\nDONE: ran %i tests' % len(tests))
 toc(T)
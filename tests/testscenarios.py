@@ -1,7 +1,7 @@
 """
 Test scenarios
 
-Version: 2016feb07
+Version: 2026oct18
 """
 
 
@@ -10,6 +10,8 @@ tests = [
 #'standardscen',
 #'maxcoverage',
 'budget',
+'parallel',
+'overlay',
 #'90-90-90',
 #'sensitivity',
 #'VMMC',
@@ -407,6 +409,82 @@ if 'budget' in tests:
 
 
 
+## Test running scenarios in parallel
+if 'parallel' in tests:
+    t = tic()
+
+    print('Running parallel scenario test...')
+    from optima import defaultproject, defaultscenarios, dcp
+    
+    P = defaultproject('generalized',dorun=False)
+    defaultscenarios(P, which='budgets', dorun=False, doplot=False)
+    Q = dcp(P)
+    serial   = P.runscenarios(nruns=2, randseed=1, verbose=0)['scenarios']
+    parallel = Q.runscenarios(nruns=2, randseed=1, ncpus=2, verbose=0)['scenarios']
+    assert serial.keys==parallel.keys # Same order
+    for key in serial.main.keys():
+        for i in range(len(serial.keys)):
+            assert (serial.main[key].tot[i]==parallel.main[key].tot[i]).all(), 'Scenario "%s" differs for %s when run in parallel' % (serial.keys[i], key)
+    assert all([scen.scenparset.projectref() is Q for scen in Q.scens.values()])
+    
+    # Running scenarios should leave the global random state as it was
+    from numpy.random import get_state
+    from random import getstate
+    origstate, origpystate = get_state(), getstate()
+    P.runscenarios(nruns=2, randseed=2, ccsample='random', verbose=0)
+    assert (get_state()[1]==origstate[1]).all() and get_state()[2:]==origstate[2:] and getstate()==origpystate, 'Running scenarios changed the global random state'
+    
+    done(t)
+
+
+
+
+
+## Test that scenarios only copy the parameters they change
+if 'overlay' in tests:
+    t = tic()
+
+    print('Running scenario parameter overlay test...')
+    from optima import defaultproject, Parscen, Budgetscen, Parsoverlay, odict, dcp, dumpstr, loadstr
+    
+    P = defaultproject('concentrated',dorun=False)
+    P.addscens([Parscen(name='More testing', parsetname='default', pars=[{'name':'hivtest', 'for':0, 'startyear':2016, 'endyear':2020, 'startval':0.5, 'endval':0.9}])])
+    orig = dumpstr(P.parsets['default'].pars)
+    P.runscenarios(verbose=0)
+    pars = P.scens[0].scenparset.pars
+    assert isinstance(pars, Parsoverlay)
+    assert pars['hivtest'] is not P.parsets['default'].pars['hivtest'] # Copied, since it was changed...
+    assert pars['force'] is P.parsets['default'].pars['force'] # ...but the rest are shared
+    assert dumpstr(P.parsets['default'].pars)==orig # And the original is unchanged
+    assert type(dcp(pars))==odict and type(loadstr(dumpstr(pars)))==odict # Saved as ordinary pars
+    
+    # Copied and saved projects don't share parameters between the scenario and the original parset
+    P.addscens([Budgetscen(name='Default budget', parsetname='default', progsetname='default', t=[2016], budget=P.progsets['default'].getdefaultbudget())], overwrite=False)
+    P.runscenarios(verbose=0)
+    for Q in [dcp(P), loadstr(dumpstr(P))]:
+        orig = dumpstr(Q.parsets['default'].pars)
+        for scenpars in [Q.scens[0].scenparset.pars, Q.scens[1].scenparset.pars, Q.scens[1].pars]:
+            assert scenpars['force'] is not Q.parsets['default'].pars['force']
+            for key in ['force', 'hivtest']: scenpars[key].y[:] *= 2
+        assert dumpstr(Q.parsets['default'].pars)==orig
+    
+    # Changing the overlay's other attributes shouldn't change the original parset either
+    parset = P.parsets['default']
+    parset.improvement = [] # As made by autofit()
+    orig = dumpstr(dict([(key, val) for key,val in parset.__dict__.items() if key not in ['pars', 'projectref']]))
+    overlay = parset.overlay()
+    assert overlay.projectref() is P
+    overlay.popkeys.append('New')
+    overlay.posterior['force'] = 1.
+    overlay.improvement.append([0.])
+    assert dumpstr(dict([(key, val) for key,val in parset.__dict__.items() if key not in ['pars', 'projectref']]))==orig, 'Changing an overlay changed the original parset'
+    
+    done(t)
+
+
+
+
+
 ## Set up project etc.
 if 'VMMC' in tests:
     t = tic()
@@ -11,6 +11,7 @@ Version: 2016jan05 by cliffk
 ## Define tests to run here!!!
 tests = [
 'odict',
+'codecs',
 'gridcolormap',
 ]
 
@@ -71,6 +72,26 @@ if 'odict' in tests:
 
 
 
+## Codecs test
+if 'codecs' in tests:
+    t = tic()
+    
+    print('Running codec tests...')
+    from optima import odict, dumpstr, loadstr, _fileio
+    from numpy import arange
+    
+    obj = odict([('array', arange(1e5)), ('list', [1,'two',3.0]), ('text', u'text\n'*100)])
+    for codec in ['gzip']+_fileio.codecs.keys():
+        data = dumpstr(obj, codec=codec)
+        newobj = loadstr(data) # Detects the codec from the data
+        assert((newobj['array']==obj['array']).all())
+        assert(newobj['list']==obj['list'] and newobj['text']==obj['text'])
+        print('  %s: %i bytes' % (codec, len(data)))
+    assert(dumpstr(obj, codec='gzip')[:2]==b'\x1f\x8b') # Still a gzip file, so older versions can load it
+    done(t)
+
+
+
 ## gridcolormap test
 if 'gridcolormap' in tests and doplot:
     from mpl_toolkits.mplot3d import Axes3D # analysis:ignore